@@ -0,0 +1,179 @@
+# © 2024 Amazon Web Services, Inc. or its affiliates. All Rights Reserved
+# This AWS Content is provided subject to the terms of the AWS Customer Agreement available at http://aws.amazon.com/agreement or other written agreement between Customer and either Amazon Web Services, Inc. or Amazon Web Services EMEA SARL or both.
+# License terms can be found at: https://aws.amazon.com/legal/aws-ip-license-terms/
+
+import hashlib
+import json
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from utils.image_meta import get_image_info
+from utils.schema_utils import get_structure
+
+# (image bytes, system prompt) -> model output text
+Responder = Callable[[bytes, str], str]
+
+
+def schema_from_truth(truth: Dict) -> Dict:
+    """Build a field schema from the ground truth fields that carry bounding boxes."""
+    return {field: get_structure(value) for field, value in truth.items() if "bbox" in json.dumps(get_structure(value))}
+
+
+class TruthResponder:
+    """
+    Answers with the ground truth boxes of registered images, formatted the way the model would.
+
+    Boxes are stored as fractions of the image, so they are emitted correctly for whatever
+    resolution is sent. With ``norm`` the output uses [x1, y1, x2, y2] scaled to 0..norm,
+    otherwise absolute pixels of the sent image; both with a top-left origin. ``noise`` jitters
+    every coordinate by a deterministic fraction of the box size.
+    """
+
+    def __init__(self, norm: Optional[int] = None, noise: float = 0.0, seed: int = 0):
+        self.norm = norm
+        self.noise = noise
+        self.seed = seed
+        self._truths: Dict[bytes, Any] = {}
+
+    def add(self, image_bytes: bytes, truth: Dict) -> None:
+        """Register the ground truth (bottom-left origin, original pixels) of the image that will be sent."""
+        info = get_image_info(image_bytes)
+        self._truths[self._key(image_bytes)] = self._to_fractions(truth, info.width, info.height)
+
+    def __call__(self, image_bytes: bytes, system_prompt: str) -> str:
+        fractions = self._truths.get(self._key(image_bytes))
+        if fractions is None:
+            return "```json\n{}\n```"
+        info = get_image_info(image_bytes)
+        rng = random.Random(self.seed ^ int.from_bytes(self._key(image_bytes)[:4], "big"))
+        output = self._from_fractions(fractions, info.width, info.height, rng)
+        return "```json\n" + json.dumps(output, indent=2) + "\n```"
+
+    @staticmethod
+    def _key(image_bytes: bytes) -> bytes:
+        return hashlib.blake2b(image_bytes, digest_size=16).digest()
+
+    def _to_fractions(self, data: Any, width: int, height: int) -> Any:
+        if isinstance(data, dict):
+            if "bbox" in data:
+                (x1, y1), (x2, y2) = data["bbox"]
+                return {"bbox": (min(x1, x2) / width, (height - max(y1, y2)) / height,
+                                 max(x1, x2) / width, (height - min(y1, y2)) / height)}
+            return {k: self._to_fractions(v, width, height) for k, v in data.items() if isinstance(v, (dict, list))}
+        return [self._to_fractions(item, width, height) for item in data if isinstance(item, (dict, list))]
+
+    def _from_fractions(self, data: Any, width: int, height: int, rng: random.Random) -> Any:
+        if isinstance(data, dict):
+            if "bbox" in data:
+                x1, y1, x2, y2 = data["bbox"]
+                if self.noise:
+                    dx, dy = (x2 - x1) * self.noise, (y2 - y1) * self.noise
+                    x1, x2 = x1 + rng.uniform(-dx, dx), x2 + rng.uniform(-dx, dx)
+                    y1, y2 = y1 + rng.uniform(-dy, dy), y2 + rng.uniform(-dy, dy)
+                scale_x, scale_y = (self.norm, self.norm) if self.norm else (width, height)
+                return {"bbox": [round(x1 * scale_x), round(y1 * scale_y), round(x2 * scale_x), round(y2 * scale_y)]}
+            return {k: self._from_fractions(v, width, height, rng) for k, v in data.items()}
+        return [self._from_fractions(item, width, height, rng) for item in data]
+
+
+class ReplayResponder:
+    """Replays recorded model outputs in order, starting over when they run out."""
+
+    def __init__(self, texts: List[str]):
+        if not texts:
+            raise ValueError("ReplayResponder needs at least one recorded response")
+        self.texts = texts
+        self._index = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_jsonl(cls, path: str) -> "ReplayResponder":
+        """Load recordings from JSONL lines holding either {"text": ...} or a full converse response."""
+        texts = []
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    texts.append(record["text"] if "text" in record else record["output"]["message"]["content"][0]["text"])
+        return cls(texts)
+
+    def __call__(self, image_bytes: bytes, system_prompt: str) -> str:
+        with self._lock:
+            text = self.texts[self._index % len(self.texts)]
+            self._index += 1
+        return text
+
+
+class FakeBedrockClient:
+    """
+    Offline stand-in for the bedrock-runtime client, passed as ``client`` to the extractor.
+
+    Implements ``converse`` and ``converse_stream`` with the response shapes of the real API.
+    Output text comes from a responder; usage is estimated from the prompt, the image size and
+    the output length, and output longer than maxTokens is cut with stopReason "max_tokens".
+
+    Args:
+        responder: Callable (image bytes, system prompt) -> output text
+        latency: Seconds to sleep before answering, to simulate the network and model
+        stream_chunk_chars: Characters per contentBlockDelta event of converse_stream
+        stream_delay: Seconds to sleep between stream events
+    """
+
+    def __init__(self, responder: Responder, latency: float = 0.0, stream_chunk_chars: int = 32,
+                 stream_delay: float = 0.0):
+        self.responder = responder
+        self.latency = latency
+        self.stream_chunk_chars = stream_chunk_chars
+        self.stream_delay = stream_delay
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def converse(self, modelId: str, messages: List[Dict], system: List[Dict], inferenceConfig: Dict, **kwargs) -> Dict:
+        start = time.perf_counter()
+        text, stop_reason, usage = self._respond(messages, system, inferenceConfig)
+        if self.latency:
+            time.sleep(self.latency)
+        return {
+            "output": {"message": {"role": "assistant", "content": [{"text": text}]}},
+            "stopReason": stop_reason,
+            "usage": usage,
+            "metrics": {"latencyMs": int((time.perf_counter() - start) * 1000)}
+        }
+
+    def converse_stream(self, modelId: str, messages: List[Dict], system: List[Dict], inferenceConfig: Dict, **kwargs) -> Dict:
+        text, stop_reason, usage = self._respond(messages, system, inferenceConfig)
+        return {"stream": self._events(text, stop_reason, usage)}
+
+    def _events(self, text: str, stop_reason: str, usage: Dict) -> Iterator[Dict]:
+        start = time.perf_counter()
+        if self.latency:
+            time.sleep(self.latency)
+        yield {"messageStart": {"role": "assistant"}}
+        for i in range(0, len(text), self.stream_chunk_chars):
+            if self.stream_delay:
+                time.sleep(self.stream_delay)
+            yield {"contentBlockDelta": {"delta": {"text": text[i:i + self.stream_chunk_chars]}, "contentBlockIndex": 0}}
+        yield {"contentBlockStop": {"contentBlockIndex": 0}}
+        yield {"messageStop": {"stopReason": stop_reason}}
+        yield {"metadata": {"usage": usage, "metrics": {"latencyMs": int((time.perf_counter() - start) * 1000)}}}
+
+    def _respond(self, messages: List[Dict], system: List[Dict], inference_config: Dict) -> tuple:
+        with self._lock:
+            self.calls += 1
+        image_bytes = next(block["image"]["source"]["bytes"] for message in messages
+                           for block in message["content"] if "image" in block)
+        system_prompt = "".join(block.get("text", "") for block in system)
+        text = self.responder(image_bytes, system_prompt)
+
+        info = get_image_info(image_bytes)
+        # Rough token estimates: ~4 characters per text token, ~750 pixels per image token
+        input_tokens = len(system_prompt) // 4 + info.width * info.height // 750
+        output_tokens = max(1, len(text) // 4)
+        stop_reason = "end_turn"
+        max_tokens = inference_config.get("maxTokens")
+        if max_tokens and output_tokens > max_tokens:
+            text, output_tokens, stop_reason = text[:max_tokens * 4], max_tokens, "max_tokens"
+        usage = {"inputTokens": input_tokens, "outputTokens": output_tokens, "totalTokens": input_tokens + output_tokens}
+        return text, stop_reason, usage
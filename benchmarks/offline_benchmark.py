@@ -0,0 +1,259 @@
+# © 2024 Amazon Web Services, Inc. or its affiliates. All Rights Reserved
+# This AWS Content is provided subject to the terms of the AWS Customer Agreement available at http://aws.amazon.com/agreement or other written agreement between Customer and either Amazon Web Services, Inc. or Amazon Web Services EMEA SARL or both.
+# License terms can be found at: https://aws.amazon.com/legal/aws-ip-license-terms/
+
+"""
+Offline throughput, latency and memory benchmark of extraction, parsing, evaluation and rendering.
+
+Model calls go to a FakeBedrockClient that answers from the ground truth (or from recorded
+responses), so the benchmark measures this library's own overhead and runs without network or
+AWS credentials. The corpus is the FATURA examples, repeated --scale times, plus --synthetic
+generated invoices. Every scenario reports documents/sec, per-stage p50/p95 latency and the peak
+Python heap (tracemalloc, measured in a separate pass so it does not slow the timed run).
+
+Results are compared against a baseline file; a scenario regresses when its throughput drops or
+its peak memory grows by more than --tolerance. Baselines are machine specific: record one on the
+machine that runs the comparison with --save-baseline.
+
+Example:
+    python benchmarks/offline_benchmark.py --scale 20 --synthetic 40
+    python benchmarks/offline_benchmark.py --scale 20 --synthetic 40 --repeat 3 --save-baseline benchmarks/baseline.json
+"""
+
+import argparse
+import json
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from io import BytesIO
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+from PIL import Image, ImageDraw
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "src"))
+
+from extractor import BoundingBoxExtractor
+from evaluator import BBoxEvaluator
+from utils.bbox_drawing import draw_bounding_boxes, render_overlays
+from utils.instrumentation import Instrumentation
+from utils.json_parser import get_local_json, parse_json_response_detailed
+
+from fake_bedrock import FakeBedrockClient, ReplayResponder, TruthResponder, schema_from_truth
+
+ROOT = Path(__file__).resolve().parent.parent
+SCENARIOS = ("extract", "extract_stream", "parse", "evaluate", "draw", "thumbnails")
+SYNTHETIC_FIELDS = ("NUMBER", "DATE", "DUE_DATE", "BILL_TO", "SELLER_ADDRESS", "TOTAL", "NOTE")
+
+
+class BenchDocument(NamedTuple):
+    doc_id: str
+    image_bytes: bytes
+    truth: Dict
+
+
+class ScenarioResult(NamedTuple):
+    documents: int
+    seconds: float
+    docs_per_sec: float
+    peak_mb: Optional[float]
+    stages: Dict[str, Dict[str, float]]
+
+
+def synthetic_document(rng: random.Random, width: int = 1240, height: int = 1754) -> BenchDocument:
+    """Draw an invoice-like page with one text block per field and return it with its ground truth."""
+    image = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(image)
+    truth = {}
+    for row, field in enumerate(SYNTHETIC_FIELDS):
+        top = int(height * (0.05 + 0.12 * row + rng.uniform(0, 0.04)))
+        left = int(width * rng.uniform(0.03, 0.5))
+        box_width, box_height = int(width * rng.uniform(0.15, 0.4)), int(height * rng.uniform(0.015, 0.06))
+        draw.rectangle([left, top, left + box_width, top + box_height], outline="black")
+        draw.text((left + 4, top + 4), f"{field}: {rng.randint(10000, 99999)}", fill="black")
+        # Ground truth uses a bottom-left origin like the FATURA annotations
+        truth[field] = {"bbox": [[float(left), float(height - top - box_height)], [float(left + box_width), float(height - top)]]}
+    buffer = BytesIO()
+    image.save(buffer, format="JPEG", quality=85)
+    return BenchDocument(f"synthetic-{rng.random():.8f}", buffer.getvalue(), truth)
+
+
+def build_corpus(documents_dir: str, scale: int, synthetic: int, seed: int) -> List[BenchDocument]:
+    base = []
+    for image_path in sorted(Path(documents_dir).glob("*.jpg")):
+        truth_path = image_path.with_suffix(".json")
+        if truth_path.exists():
+            base.append(BenchDocument(image_path.stem, image_path.read_bytes(), get_local_json(str(truth_path))))
+    corpus = [doc._replace(doc_id=f"{doc.doc_id}-{copy}") for copy in range(scale) for doc in base]
+    rng = random.Random(seed)
+    corpus.extend(synthetic_document(rng) for _ in range(synthetic))
+    return corpus
+
+
+def measure(run: Callable[[Instrumentation], int], memory: bool, repeat: int = 3) -> ScenarioResult:
+    """
+    Time run with instrumentation, keeping the fastest of repeat runs, then optionally run it
+    once more under tracemalloc for the peak heap.
+    """
+    instrumentation = Instrumentation()
+    seconds = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        documents = run(instrumentation)
+        seconds = min(seconds, time.perf_counter() - start)
+
+    peak_mb = None
+    if memory:
+        tracemalloc.start()
+        try:
+            run(Instrumentation())
+            peak_mb = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+        finally:
+            tracemalloc.stop()
+
+    stages = {
+        stage: {"p50_ms": values["p50"] * 1000, "p95_ms": values["p95"] * 1000, "count": values["count"]}
+        for stage, values in instrumentation.summary()["stages"].items()
+    }
+    return ScenarioResult(documents, seconds, documents / seconds if seconds else 0.0, peak_mb, stages)
+
+
+def run_benchmarks(corpus: List[BenchDocument], scenarios: List[str], args: argparse.Namespace) -> Dict[str, ScenarioResult]:
+    schema = {}
+    for doc in corpus:
+        schema.update(schema_from_truth(doc.truth))
+
+    if args.recordings:
+        responder = ReplayResponder.from_jsonl(args.recordings)
+    else:
+        responder = TruthResponder(norm=args.norm, noise=args.noise, seed=args.seed)
+        for doc in corpus:
+            responder.add(doc.image_bytes, doc.truth)
+    client = FakeBedrockClient(responder, latency=args.latency)
+    prompt = str(ROOT / "src" / "prompts" / ("localization_normalized.txt" if args.norm else "localization_dimensions.txt"))
+
+    def _extractor(instrumentation: Instrumentation) -> BoundingBoxExtractor:
+        return BoundingBoxExtractor("fake-model", prompt, schema, norm=args.norm, client=client, instrumentation=instrumentation)
+
+    # Predictions and raw responses are shared by the scenarios that do not call the model
+    predictions = {doc.doc_id: doc.truth for doc in corpus}
+    texts = [responder(doc.image_bytes, "") for doc in corpus]
+
+    def _extract(instrumentation: Instrumentation) -> int:
+        documents = ((doc.doc_id, doc.image_bytes) for doc in corpus)
+        count = 0
+        for result in _extractor(instrumentation).get_bboxes_batch(documents, max_concurrency=args.max_concurrency):
+            if result.error is not None:
+                raise result.error
+            predictions[result.doc_id] = result.bboxes
+            count += 1
+        return count
+
+    def _extract_stream(instrumentation: Instrumentation) -> int:
+        extractor = _extractor(instrumentation)
+        for doc in corpus:
+            _, metadata = extractor.get_bboxes_streaming(doc.image_bytes)
+            instrumentation.observe("time_to_first_field", (metadata["latency"]["timeToFirstFieldMs"] or 0) / 1000)
+        return len(corpus)
+
+    def _parse(instrumentation: Instrumentation) -> int:
+        for text in texts:
+            with instrumentation.timer("parse"):
+                parse_json_response_detailed(text)
+        return len(texts)
+
+    def _evaluate(instrumentation: Instrumentation) -> int:
+        evaluator = BBoxEvaluator(schema, matching=args.matching, instrumentation=instrumentation)
+        return len(evaluator.evaluate_dataset([predictions[doc.doc_id] for doc in corpus], [doc.truth for doc in corpus]))
+
+    def _draw(instrumentation: Instrumentation) -> int:
+        for doc in corpus:
+            with instrumentation.timer("draw"):
+                draw_bounding_boxes(doc.image_bytes, predictions[doc.doc_id] or {})
+        return len(corpus)
+
+    def _thumbnails(instrumentation: Instrumentation) -> int:
+        with tempfile.TemporaryDirectory() as output_dir:
+            jobs = ((doc.image_bytes, predictions[doc.doc_id] or {}, f"{output_dir}/{index}.jpg")
+                    for index, doc in enumerate(corpus))
+            with instrumentation.timer("render_overlays"):
+                return sum(error is None for _, error in render_overlays(jobs, max_size=512))
+
+    runs = {"extract": _extract, "extract_stream": _extract_stream, "parse": _parse, "evaluate": _evaluate,
+            "draw": _draw, "thumbnails": _thumbnails}
+    return {name: measure(runs[name], memory=not args.no_memory, repeat=args.repeat) for name in scenarios}
+
+
+def compare(results: Dict[str, ScenarioResult], baseline: Dict, tolerance: float) -> List[str]:
+    """Return a message for every scenario that is slower or uses more memory than the baseline allows."""
+    regressions = []
+    for name, result in results.items():
+        expected = baseline.get(name)
+        if not expected:
+            continue
+        if result.docs_per_sec < expected["docs_per_sec"] * (1 - tolerance):
+            regressions.append(f"{name}: {result.docs_per_sec:.1f} docs/s vs baseline {expected['docs_per_sec']:.1f}")
+        # Allow 1 MB of slack so tiny heaps do not flap
+        if result.peak_mb is not None and expected.get("peak_mb") is not None \
+                and result.peak_mb > expected["peak_mb"] * (1 + tolerance) + 1:
+            regressions.append(f"{name}: peak {result.peak_mb:.1f} MB vs baseline {expected['peak_mb']:.1f} MB")
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", default=str(ROOT / "examples" / "resources"))
+    parser.add_argument("--scale", type=int, default=20, help="Copies of every example document")
+    parser.add_argument("--synthetic", type=int, default=40, help="Number of generated documents")
+    parser.add_argument("--scenarios", nargs="*", default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument("--norm", type=int, default=1000)
+    parser.add_argument("--noise", type=float, default=0.05, help="Coordinate jitter as a fraction of the box size")
+    parser.add_argument("--latency", type=float, default=0.0, help="Simulated model latency in seconds")
+    parser.add_argument("--recordings", default=None, help="JSONL of recorded responses to replay instead of the ground truth")
+    parser.add_argument("--max-concurrency", type=int, default=8)
+    parser.add_argument("--matching", choices=["first", "instance"], default="first")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per scenario; the fastest is reported")
+    parser.add_argument("--no-memory", action="store_true", help="Skip the tracemalloc pass")
+    parser.add_argument("--baseline", default=str(ROOT / "benchmarks" / "baseline.json"))
+    parser.add_argument("--save-baseline", default=None, help="Write the results to this baseline file")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative regression")
+    parser.add_argument("--json", default=None, help="Also write the full results as JSON")
+    args = parser.parse_args(argv)
+
+    corpus = build_corpus(args.documents, args.scale, args.synthetic, args.seed)
+    print(f"Corpus: {len(corpus)} documents")
+    results = run_benchmarks(corpus, args.scenarios, args)
+
+    print(f"{'scenario':<16} {'docs':>6} {'best s':>8} {'docs/s':>9} {'peak MB':>8}  stages (p50 / p95 ms)")
+    for name, result in results.items():
+        stages = ", ".join(f"{stage} {v['p50_ms']:.2f}/{v['p95_ms']:.2f}" for stage, v in sorted(result.stages.items()))
+        peak = f"{result.peak_mb:.1f}" if result.peak_mb is not None else "-"
+        print(f"{name:<16} {result.documents:>6} {result.seconds:>8.2f} {result.docs_per_sec:>9.1f} {peak:>8}  {stages}")
+
+    serialized = {name: result._asdict() for name, result in results.items()}
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(serialized, f, indent=2)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump({name: {"docs_per_sec": round(r.docs_per_sec, 1),
+                              "peak_mb": round(r.peak_mb, 2) if r.peak_mb is not None else None}
+                       for name, r in results.items()}, f, indent=2)
+        print(f"Saved baseline to {args.save_baseline}")
+        return 0
+
+    if Path(args.baseline).exists():
+        regressions = compare(results, get_local_json(args.baseline), args.tolerance)
+        for message in regressions:
+            print(f"REGRESSION {message}")
+        if regressions:
+            return 1
+        print(f"No regressions against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
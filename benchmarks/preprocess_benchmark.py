@@ -0,0 +1,80 @@
+# © 2024 Amazon Web Services, Inc. or its affiliates. All Rights Reserved
+# This AWS Content is provided subject to the terms of the AWS Customer Agreement available at http://aws.amazon.com/agreement or other written agreement between Customer and either Amazon Web Services, Inc. or Amazon Web Services EMEA SARL or both.
+# License terms can be found at: https://aws.amazon.com/legal/aws-ip-license-terms/
+
+"""
+Compare image preprocessing settings by payload size, latency, input tokens and localization quality.
+
+Runs every document in a directory through the extractor once per setting and reports the averages,
+so the size/quality trade-off can be picked from data. Calls Amazon Bedrock.
+
+Example:
+    python benchmarks/preprocess_benchmark.py --documents examples/resources --norm 1000
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "src"))
+
+from extractor import BoundingBoxExtractor
+from evaluator import BBoxEvaluator
+from utils.bedrock_helper import NOVA_PRO_MODEL_ID
+from utils.image_preprocessing import PreprocessConfig, preprocess_image
+from utils.json_parser import get_local_json
+
+from fake_bedrock import schema_from_truth
+
+SETTINGS = {
+    "original": None,
+    "max_side_1600": PreprocessConfig(max_side=1600),
+    "max_side_1024": PreprocessConfig(max_side=1024),
+    "max_side_768": PreprocessConfig(max_side=768),
+    "1mp_jpeg_q75": PreprocessConfig(max_pixels=1_000_000, format="jpeg", quality=75),
+    "1mp_gray_webp_q70": PreprocessConfig(max_pixels=1_000_000, grayscale=True, format="webp", quality=70),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", default=str(Path(__file__).resolve().parent.parent / "examples" / "resources"))
+    parser.add_argument("--model-id", default=NOVA_PRO_MODEL_ID)
+    parser.add_argument("--prompt", default=str(Path(__file__).resolve().parent.parent / "src" / "prompts" / "localization_normalized.txt"))
+    parser.add_argument("--norm", type=int, default=1000)
+    parser.add_argument("--settings", nargs="*", default=list(SETTINGS), choices=list(SETTINGS))
+    args = parser.parse_args()
+
+    documents = []
+    for image_path in sorted(Path(args.documents).glob("*.jpg")):
+        truth_path = image_path.with_suffix(".json")
+        if truth_path.exists():
+            documents.append((image_path.read_bytes(), get_local_json(str(truth_path))))
+
+    print(f"{'setting':<20} {'payload KB':>10} {'latency s':>10} {'input tok':>10} {'mean IoU':>9} {'mean AP':>8}")
+    for name in args.settings:
+        config = SETTINGS[name]
+        payload, latency, tokens, ious, aps = [], [], [], [], []
+        for image_bytes, truth in documents:
+            schema = schema_from_truth(truth)
+            extractor = BoundingBoxExtractor(args.model_id, args.prompt, schema, norm=args.norm, preprocess=config)
+            payload.append(len(preprocess_image(image_bytes, config).image_bytes) if config else len(image_bytes))
+
+            start = time.perf_counter()
+            bboxes, metadata = extractor.get_bboxes(image_bytes)
+            latency.append(time.perf_counter() - start)
+            tokens.append(metadata["usage"].get("inputTokens", 0))
+
+            evaluation = BBoxEvaluator(schema).evaluate(bboxes or {}, truth)
+            ious.extend(result.iou for result in evaluation["field_scores"].values())
+            aps.append(evaluation["mean_ap"])
+
+        def mean(values):
+            return sum(values) / len(values) if values else 0.0
+
+        print(f"{name:<20} {mean(payload) / 1024:>10.1f} {mean(latency):>10.2f} {mean(tokens):>10.0f} {mean(ious):>9.3f} {mean(aps):>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
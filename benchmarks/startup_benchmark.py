@@ -0,0 +1,84 @@
+# © 2024 Amazon Web Services, Inc. or its affiliates. All Rights Reserved
+# This AWS Content is provided subject to the terms of the AWS Customer Agreement available at http://aws.amazon.com/agreement or other written agreement between Customer and either Amazon Web Services, Inc. or Amazon Web Services EMEA SARL or both.
+# License terms can be found at: https://aws.amazon.com/legal/aws-ip-license-terms/
+
+"""
+Measure cold-start import time of the package, as paid by serverless workers and process-pool children.
+
+Every target is imported in a fresh interpreter --runs times; the median time above an empty
+interpreter is reported together with the heavy dependencies (boto3, PIL, numpy) the import
+loaded. The "deferred" row shows what importing those dependencies up front would add, which
+is what every worker paid before they were deferred to first use. The last row times a spawned
+ProcessPoolExecutor child from submit to the result of its first parse_json_response call.
+
+Example:
+    python benchmarks/startup_benchmark.py --runs 10
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+
+SRC = str(Path(__file__).resolve().parent.parent / "src")
+HEAVY_MODULES = ("boto3", "PIL", "numpy")
+TARGETS = {
+    "utils": "import utils",
+    "utils.json_parser": "from utils import parse_json_response",
+    "extractor": "import extractor",
+    "evaluator": "import evaluator",
+    "pipeline": "import pipeline",
+    "deferred boto3+PIL+numpy": "import boto3, PIL.Image, numpy",
+}
+PROBE = "import sys; print(','.join(m for m in {modules!r} if m in sys.modules))"
+
+
+def time_import(statement: str, runs: int) -> tuple:
+    """Return the median wall time in seconds of running statement in a fresh interpreter, and its heavy imports."""
+    timings, loaded = [], ""
+    code = f"{statement}; {PROBE.format(modules=HEAVY_MODULES)}"
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, "-c", code], cwd=SRC, capture_output=True, text=True, check=True)
+        timings.append(time.perf_counter() - start)
+        loaded = result.stdout.strip()
+    return statistics.median(timings), loaded
+
+
+def _child_task() -> int:
+    sys.path.insert(0, SRC)
+    from utils import parse_json_response
+    return len(parse_json_response('```json\n{"a": {"bbox": [1, 2, 3, 4]}}\n```'))
+
+
+def time_process_pool_child(runs: int) -> float:
+    """Median time from submitting to a fresh spawned worker until its first result."""
+    timings = []
+    for _ in range(runs):
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+            start = time.perf_counter()
+            executor.submit(_child_task).result()
+            timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=7)
+    args = parser.parse_args()
+
+    empty, _ = time_import("pass", args.runs)
+    print(f"Empty interpreter: {empty * 1000:.1f} ms (subtracted below)")
+    print(f"{'import':<28} {'ms':>8}  heavy modules loaded")
+    for name, statement in TARGETS.items():
+        seconds, loaded = time_import(statement, args.runs)
+        print(f"{name:<28} {(seconds - empty) * 1000:>8.1f}  {loaded or '-'}")
+    print(f"{'process-pool child':<28} {time_process_pool_child(args.runs) * 1000:>8.1f}  (spawn to first parse, not subtracted)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+# © 2024 Amazon Web Services, Inc. or its affiliates. All Rights Reserved
+# This AWS Content is provided subject to the terms of the AWS Customer Agreement available at http://aws.amazon.com/agreement or other written agreement between Customer and either Amazon Web Services, Inc. or Amazon Web Services EMEA SARL or both.
+# License terms can be found at: https://aws.amazon.com/legal/aws-ip-license-terms/
+
+from io import BytesIO
+from typing import TYPE_CHECKING, Iterator, Tuple, Union
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+DocumentSource = Union[str, bytes]
+
+
+def _encode_page(image: "Image.Image", page_format: str, quality: int) -> bytes:
+    if page_format == "jpeg" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    buffer = BytesIO()
+    if page_format == "jpeg":
+        image.save(buffer, format="JPEG", quality=quality)
+    else:
+        image.save(buffer, format=page_format.upper())
+    return buffer.getvalue()
+
+
+class Document:
+    """
+    A document made of one or more pages that are rasterised lazily.
+
+    ``iter_pages`` renders a page only when the consumer asks for it, so feeding it to
+    ``BoundingBoxExtractor.get_bboxes_batch`` keeps at most ``max_concurrency`` pages in memory.
+    """
+
+    def __init__(self, source: DocumentSource, page_format: str = "jpeg", quality: int = 90):
+        self.source = source
+        self.page_format = page_format
+        self.quality = quality
+
+    @property
+    def page_count(self) -> int:
+        raise NotImplementedError
+
+    def render_page(self, index: int) -> bytes:
+        """Rasterise and encode a single page."""
+        raise NotImplementedError
+
+    def iter_pages(self) -> Iterator[Tuple[int, bytes]]:
+        """Yield (page index, image bytes), rendering each page on demand."""
+        for index in range(self.page_count):
+            yield index, self.render_page(index)
+
+    def _open(self):
+        return BytesIO(self.source) if isinstance(self.source, bytes) else self.source
+
+
+class ImageDocument(Document):
+    """Single page image; the original bytes are sent unchanged."""
+
+    @property
+    def page_count(self) -> int:
+        return 1
+
+    def render_page(self, index: int) -> bytes:
+        if index != 0:
+            raise IndexError(f"Page {index} out of range for a single page image")
+        if isinstance(self.source, bytes):
+            return self.source
+        with open(self.source, "rb") as f:
+            return f.read()
+
+
+class TiffDocument(Document):
+    """Multi-page TIFF; frames are decoded one at a time by seeking."""
+
+    @property
+    def page_count(self) -> int:
+        from PIL import Image
+
+        with Image.open(self._open()) as img:
+            return getattr(img, "n_frames", 1)
+
+    def render_page(self, index: int) -> bytes:
+        from PIL import Image
+
+        with Image.open(self._open()) as img:
+            img.seek(index)
+            return _encode_page(img, self.page_format, self.quality)
+
+
+class PdfDocument(Document):
+    """PDF rendered page by page with pypdfium2 (optional dependency)."""
+
+    def __init__(self, source: DocumentSource, page_format: str = "jpeg", quality: int = 90, dpi: int = 150):
+        super().__init__(source, page_format, quality)
+        self.dpi = dpi
+        try:
+            import pypdfium2
+        except ImportError as e:
+            raise ImportError("PDF support requires pypdfium2: pip install pypdfium2") from e
+        self._pdf = pypdfium2.PdfDocument(source)
+
+    @property
+    def page_count(self) -> int:
+        return len(self._pdf)
+
+    def render_page(self, index: int) -> bytes:
+        page = self._pdf[index]
+        try:
+            image = page.render(scale=self.dpi / 72).to_pil()
+        finally:
+            page.close()
+        return _encode_page(image, self.page_format, self.quality)
+
+    def close(self) -> None:
+        self._pdf.close()
+
+
+def open_document(source: DocumentSource, **kwargs) -> Document:
+    """
+    Open a document from a path or bytes, choosing the page renderer from its header.
+
+    Args:
+        source: File path or document bytes
+        **kwargs: Passed to the Document class (page_format, quality, dpi for PDFs)
+    """
+    if isinstance(source, bytes):
+        header = source[:8]
+    else:
+        with open(source, "rb") as f:
+            header = f.read(8)
+    if header.startswith(b"%PDF"):
+        return PdfDocument(source, **kwargs)
+    kwargs.pop("dpi", None)
+    if header[:4] in (b"II*\x00", b"MM\x00*"):
+        return TiffDocument(source, **kwargs)
+    return ImageDocument(source, **kwargs)
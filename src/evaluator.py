@@ -2,9 +2,13 @@
 # This AWS Content is provided subject to the terms of the AWS Customer Agreement available at http://aws.amazon.com/agreement or other written agreement between Customer and either Amazon Web Services, Inc. or Amazon Web Services EMEA SARL or both.
 # License terms can be found at: https://aws.amazon.com/legal/aws-ip-license-terms/
 
-from typing import Dict, List, Optional, Tuple, Union, NamedTuple
+from typing import Dict, Iterable, List, Optional, Tuple, Union, NamedTuple
 import numpy as np
 
+from utils.bbox_array import BBoxArray
+from utils.box_ops import bbox_to_xyxy, normalize_boxes, box_iou
+from utils.instrumentation import Instrumentation, NULL_INSTRUMENTATION
+
 class BBoxEvaluator:
     """Evaluates bounding box predictions against ground truth."""
 
@@ -15,13 +19,40 @@ class BBoxEvaluator:
         f1: float
         ap: float
 
-    def __init__(self, field_config: Dict):
+    COCO_IOU_THRESHOLDS = tuple(np.round(np.arange(0.5, 0.96, 0.05), 2))
+
+    def __init__(self, field_config: Dict, matching: str = "first", iou_thresholds: Optional[Iterable[float]] = None,
+                 instrumentation: Optional[Instrumentation] = None):
+        """
+        Args:
+            field_config: Schema of the fields to evaluate
+            matching: "first" scores the first box of each field; "instance" matches every
+                predicted instance of a field against every ground-truth instance
+            iou_thresholds: IoU thresholds averaged into ``ap`` in instance mode (COCO 0.5:0.95 by default)
+            instrumentation: Optional Instrumentation timing the "evaluate" stage
+        """
+        if matching not in ("first", "instance"):
+            raise ValueError(f"Unknown matching mode: {matching}")
         self.field_config = field_config
         self.iou_threshold = 0.5
         self.margin_percent = 5
+        self.matching = matching
+        self.iou_thresholds = np.asarray(iou_thresholds if iou_thresholds is not None else self.COCO_IOU_THRESHOLDS, dtype=np.float64)
+        self.instrumentation = instrumentation if instrumentation is not None else NULL_INSTRUMENTATION
 
-    def evaluate(self, y_pred: Dict, y_true: Dict) -> Dict:
+    def evaluate(self, y_pred: Union[Dict, BBoxArray], y_true: Union[Dict, BBoxArray]) -> Dict:
         """Evaluate predictions against ground truth."""
+        with self.instrumentation.timer("evaluate"):
+            if isinstance(y_pred, BBoxArray):
+                y_pred = y_pred.to_result(decimals=None)
+            if isinstance(y_true, BBoxArray):
+                y_true = y_true.to_result(decimals=None)
+            return self._evaluate(y_pred, y_true)
+
+    def _evaluate(self, y_pred: Dict, y_true: Dict) -> Dict:
+        if self.matching == "instance":
+            return self._evaluate_instances(y_pred, y_true)
+
         scores = {}
         for field, config in self.field_config.items():
             true_config = y_true.get(field, None)
@@ -51,20 +82,213 @@ class BBoxEvaluator:
             "field_scores": scores
         }
 
+    def evaluate_dataset(self, y_preds: Iterable[Optional[Union[Dict, BBoxArray]]], y_trues: Iterable[Union[Dict, BBoxArray]], chunk_size: int = 10000) -> List[Dict]:
+        """
+        Evaluate a whole dataset with vectorized NumPy operations.
+
+        Boxes are extracted once per document and field, packed into (documents, fields, 4) arrays
+        and scored with broadcasting. Returns one result per document with the same values as
+        ``evaluate``; documents without predictions (None) score zero on every labelled field.
+        Predictions and ground truth may be BBoxArrays, whose boxes are read without walking a tree.
+        Instance matching is already vectorized per field and is evaluated document by document.
+
+        Args:
+            y_preds: Predictions per document, in the same order as y_trues
+            y_trues: Ground truth per document
+            chunk_size: Number of documents packed into arrays at a time
+        """
+        if self.matching == "instance":
+            return [self.evaluate(y_pred or {}, y_true) for y_pred, y_true in zip(y_preds, y_trues)]
+
+        results = []
+        chunk = []
+        for y_pred, y_true in zip(y_preds, y_trues):
+            chunk.append((y_pred if y_pred is not None else {}, y_true))
+            if len(chunk) >= chunk_size:
+                with self.instrumentation.timer("evaluate_chunk"):
+                    results.extend(self._evaluate_chunk(chunk))
+                chunk = []
+        if chunk:
+            with self.instrumentation.timer("evaluate_chunk"):
+                results.extend(self._evaluate_chunk(chunk))
+        return results
+
+    def _pack_boxes(self, documents: List[Union[Dict, BBoxArray]], fields: List[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Pack the first bbox of every field into a (documents, fields, 4) array with found/valid masks."""
+        if documents and all(isinstance(document, BBoxArray) for document in documents):
+            return BBoxArray.pack_first_boxes(documents, tuple(fields))
+        empty = (0.0, 0.0, 0.0, 0.0)
+        boxes, found, valid = [], [], []
+        for document in documents:
+            if isinstance(document, BBoxArray):
+                doc_boxes, doc_found, doc_valid = document.first_boxes(tuple(fields))
+                boxes.extend(map(tuple, doc_boxes.tolist()))
+                found.extend(doc_found.tolist())
+                valid.extend(doc_valid.tolist())
+                continue
+            for field in fields:
+                bbox = self._extract_bbox(document.get(field, None))
+                coords = bbox_to_xyxy(bbox) if bbox is not None else None
+                boxes.append(coords or empty)
+                found.append(bbox is not None)
+                valid.append(coords is not None)
+        shape = (len(documents), len(fields))
+        return (np.array(boxes, dtype=np.float64).reshape(shape + (4,)),
+                np.array(found, dtype=bool).reshape(shape),
+                np.array(valid, dtype=bool).reshape(shape))
+
+    def _evaluate_chunk(self, chunk: List[Tuple[Dict, Dict]]) -> List[Dict]:
+        """Score a chunk of (prediction, ground truth) pairs with broadcasting."""
+        fields = list(self.field_config.keys())
+        pred, pred_found, pred_valid = self._pack_boxes([p for p, _ in chunk], fields)
+        true, true_found, true_valid = self._pack_boxes([t for _, t in chunk], fields)
+        pred = normalize_boxes(pred)
+        true = normalize_boxes(true)
+
+        # Snap predictions that cover the ground truth horizontally within the vertical margin,
+        # unless they overlap the ground truth box of another field (see _get_iou)
+        dy = np.abs(pred[..., 1] - true[..., 1])
+        margin = (self.margin_percent / 100) * dy
+        snap = (pred[..., 0] <= true[..., 0]) & (dy < margin) & (true[..., 2] <= pred[..., 2])
+        snap &= pred_valid & true_valid
+        if snap.any():
+            d_idx, f_idx = np.nonzero(snap)
+            p = pred[d_idx, f_idx][:, None, :]
+            others = true[d_idx]
+            overlaps = ~((p[..., 2] < others[..., 0]) | (p[..., 0] > others[..., 2]) |
+                         (p[..., 3] < others[..., 1]) | (p[..., 1] > others[..., 3]))
+            overlaps &= true_valid[d_idx]
+            overlaps[np.arange(len(f_idx)), f_idx] = False
+            keep = ~overlaps.any(axis=1)
+            pred[d_idx[keep], f_idx[keep]] = true[d_idx[keep], f_idx[keep]]
+
+        iou = box_iou(pred, true)
+        scored = pred_found & pred_valid & true_valid
+        iou = np.where(scored, iou, 0.0)
+        tp = np.where(scored & (iou >= self.iou_threshold), 1.0, 0.0)
+
+        counts = true_found.sum(axis=1)
+        mean_aps = np.where(counts > 0, tp.sum(axis=1) / np.maximum(counts, 1), 0)
+
+        zero = self.FieldResult(iou=0, precision=0, recall=0, f1=0, ap=0)
+        results = []
+        for doc_found, doc_scored, doc_iou, doc_tp, mean_ap in zip(true_found.tolist(), scored.tolist(), iou.tolist(),
+                                                                   tp.tolist(), mean_aps):
+            scores = {}
+            for f, field in enumerate(fields):
+                if not doc_found[f]:
+                    continue
+                if doc_scored[f]:
+                    hit = doc_tp[f]
+                    scores[field] = self.FieldResult(iou=doc_iou[f], precision=hit, recall=hit, f1=hit, ap=hit)
+                else:
+                    scores[field] = zero
+            results.append({
+                "mean_ap": mean_ap,
+                "field_scores": scores
+            })
+        return results
+
+    def _evaluate_instances(self, y_pred: Dict, y_true: Dict) -> Dict:
+        """Evaluate every predicted instance of each field against every ground-truth instance."""
+        scores = {}
+        for field in self.field_config:
+            true_boxes = self._extract_bboxes(y_true.get(field, None))
+            if not true_boxes:
+                continue
+            pred_boxes = self._extract_bboxes(y_pred.get(field, None), with_scores=True)
+            scores[field] = self._match_instances(pred_boxes, [bbox for bbox, _ in true_boxes])
+
+        mean_ap = np.mean([result.ap for result in scores.values()]) if scores else 0
+        return {
+            "mean_ap": mean_ap,
+            "field_scores": scores
+        }
+
+    def _extract_bboxes(self, value: Union[Dict, List], with_scores: bool = False) -> List[Tuple[Tuple[float, float, float, float], float]]:
+        """Extract every valid bounding box of a field as ((x1, y1, x2, y2), score) pairs, in output order."""
+        boxes = []
+        stack = [value]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, list):
+                stack.extend(reversed(item))
+            elif isinstance(item, dict):
+                coords = bbox_to_xyxy(item['bbox']) if isinstance(item.get('bbox'), list) else None
+                if coords is not None:
+                    score = item.get('score', item.get('confidence', 1.0)) if with_scores else 1.0
+                    boxes.append((coords, float(score)))
+        return boxes
+
+    def _match_instances(self, predictions: List[Tuple[Tuple[float, float, float, float], float]],
+                         gt_boxes: List[Tuple[float, float, float, float]]) -> "BBoxEvaluator.FieldResult":
+        """
+        Greedily match predictions to ground truth at every IoU threshold at once.
+
+        Predictions are ranked by score (output order breaks ties). ``precision``, ``recall`` and
+        ``f1`` are reported at ``iou_threshold``, ``ap`` is the 101-point interpolated AP averaged
+        over ``iou_thresholds`` and ``iou`` is the mean IoU of each ground-truth instance with the
+        prediction it is matched to at any positive overlap (0 when unmatched).
+        """
+        if not predictions:
+            return self.FieldResult(iou=0, precision=0, recall=0, f1=0, ap=0)
+
+        order = np.argsort([-score for _, score in predictions], kind="stable")
+        pred = normalize_boxes(np.array([predictions[i][0] for i in order], dtype=np.float64))
+        true = normalize_boxes(np.array(gt_boxes, dtype=np.float64))
+        ious = box_iou(pred[:, None, :], true[None, :, :])
+
+        # Row 0 matches at any positive overlap, row 1 at iou_threshold, the rest at iou_thresholds
+        thresholds = np.concatenate([[np.finfo(np.float64).tiny, self.iou_threshold], self.iou_thresholds])
+        num_pred, num_true = ious.shape
+        matched_true = np.zeros((len(thresholds), num_true), dtype=bool)
+        matched_iou = np.zeros((len(thresholds), num_true))
+        tp = np.zeros((len(thresholds), num_pred), dtype=bool)
+        rows = np.arange(len(thresholds))
+        for i in range(num_pred):
+            candidates = np.where((ious[i] >= thresholds[:, None]) & ~matched_true, ious[i], -1.0)
+            best = candidates.argmax(axis=1)
+            hit = candidates[rows, best] >= 0
+            matched_true[rows[hit], best[hit]] = True
+            matched_iou[rows[hit], best[hit]] = ious[i, best[hit]]
+            tp[:, i] = hit
+
+        true_positives = tp[1].sum()
+        precision = true_positives / num_pred
+        recall = true_positives / num_true
+        f1 = 2 * (precision * recall) / (precision + recall) if (precision + recall) > 0 else 0
+        ap = float(np.mean(self._interpolated_ap(tp[2:], num_true)))
+        iou = float(matched_iou[0].mean())
+
+        return self.FieldResult(iou=iou, precision=float(precision), recall=float(recall), f1=float(f1), ap=ap)
+
+    @staticmethod
+    def _interpolated_ap(tp: np.ndarray, num_true: int) -> np.ndarray:
+        """101-point interpolated average precision for each row of a (thresholds, ranked predictions) TP matrix."""
+        cum_tp = np.cumsum(tp, axis=1)
+        cum_fp = np.cumsum(~tp, axis=1)
+        recall = cum_tp / num_true
+        precision = cum_tp / (cum_tp + cum_fp)
+        envelope = np.maximum.accumulate(precision[:, ::-1], axis=1)[:, ::-1]
+        recall_points = np.linspace(0, 1, 101)
+        aps = np.zeros(len(tp))
+        for t in range(len(tp)):
+            idx = np.searchsorted(recall[t], recall_points, side="left")
+            valid = idx < recall.shape[1]
+            aps[t] = envelope[t, idx[valid]].sum() / len(recall_points)
+        return aps
+
     def _extract_bbox(self, value: Union[Dict, List]) -> Optional[List[List[float]]]:
         """Extract bounding box from data structure based on the config schema."""
-        def _extract_bbox_dict(data_dict: Dict) -> Optional[List[List[float]]]:
-            if 'bbox' in data_dict and isinstance(data_dict['bbox'], list):
-                return data_dict['bbox']
-            return None
-
         if isinstance(value, list):
             for v in value:
                 bbox = self._extract_bbox(v)
                 if bbox is not None:
                     return bbox
         elif isinstance(value, dict):
-            return _extract_bbox_dict(value)
+            bbox = value.get('bbox')
+            if isinstance(bbox, list):
+                return bbox
 
         return None
     
@@ -2,61 +2,636 @@
 # This AWS Content is provided subject to the terms of the AWS Customer Agreement available at http://aws.amazon.com/agreement or other written agreement between Customer and either Amazon Web Services, Inc. or Amazon Web Services EMEA SARL or both.
 # License terms can be found at: https://aws.amazon.com/legal/aws-ip-license-terms/
 
-from typing import Dict, List, Optional, Any
-from io import BytesIO
-from PIL import Image
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from itertools import chain, islice
+import secrets
+import time
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Any, Iterable, Iterator, NamedTuple, Tuple, Union
+
+from document import Document
+from utils.bedrock_helper import get_converse_response, get_converse_stream_response
+from utils.image_meta import get_image_info
+from utils.instrumentation import Instrumentation, NULL_INSTRUMENTATION
+from utils.image_preprocessing import PreprocessConfig, PreprocessedImage, preprocess_image
+from utils.json_parser import IncrementalJSONParser, ParseResult, parse_json_response_detailed
+from utils.prompt_template import PromptTemplate
+from utils.rate_limiter import RateLimiter
+from utils.response_cache import ResponseCache
+from utils.schema_utils import split_schema
+
+if TYPE_CHECKING:
+    from utils.batch_jobs import JobBackend
+    from utils.bbox_array import BBoxArray
+    from utils.layout_index import LayoutFingerprint, LayoutIndex, LayoutMatch
+
+class BBoxStream:
+    """
+    Iterator over the fields of a streamed extraction.
+
+    Yields (field, bbox value) pairs as soon as each top-level field of the model output is
+    complete, already adjusted to the original image. Once exhausted, ``bboxes`` and
+    ``metadata`` hold the same result ``get_bboxes`` returns, with "latency" added. Fields
+    yielded from text before a ```json fence (a brace in a preamble) are dropped from
+    ``bboxes`` when the fence arrives, as get_bboxes ignores that text.
+    """
+
+    def __init__(self, events: Iterator[Dict], adjust: Callable[[Any], Any]):
+        self._events = events
+        self._adjust = adjust
+        self.bboxes: Optional[Dict] = None
+        self.metadata: Optional[Dict] = None
+
+    def __iter__(self) -> Iterator[Tuple[str, Any]]:
+        start = time.perf_counter()
+        first_field_ms = None
+        parser = IncrementalJSONParser()
+        bboxes: Dict[str, Any] = {}
+        usage, metrics, stop_reason = {}, {}, None
+        for event in self._events:
+            if "contentBlockDelta" in event:
+                restarts = parser.restarts
+                completed = parser.feed(event["contentBlockDelta"]["delta"].get("text", ""))
+                if parser.restarts != restarts:
+                    # A ```json fence followed text that looked like an object; only the fenced one counts
+                    bboxes = {}
+                for field, value in completed:
+                    if first_field_ms is None:
+                        first_field_ms = (time.perf_counter() - start) * 1000
+                    bboxes[field] = self._adjust(value)
+                    yield field, bboxes[field]
+            elif "messageStop" in event:
+                stop_reason = event["messageStop"].get("stopReason")
+            elif "metadata" in event:
+                usage = event["metadata"].get("usage", {})
+                metrics = event["metadata"].get("metrics", {})
+
+        # A truncated output may still end with a complete field
+        result = parser.close()
+        for field, value in result.data.items() if result.data else ():
+            if field not in bboxes:
+                if first_field_ms is None:
+                    first_field_ms = (time.perf_counter() - start) * 1000
+                bboxes[field] = self._adjust(value)
+                yield field, bboxes[field]
+
+        self.bboxes = bboxes if bboxes or result.complete else None
+        self.metadata = {
+            "usage": usage,
+            "metrics": metrics,
+            "failed_fields": result.failed_fields,
+            "stopReason": stop_reason,
+            "latency": {
+                "timeToFirstFieldMs": first_field_ms,
+                "totalMs": (time.perf_counter() - start) * 1000
+            }
+        }
 
-from utils.bedrock_helper import get_converse_response
-from utils.json_parser import parse_json_response
 
 class BoundingBoxExtractor:
     """Extracts bounding boxes from document images."""
 
-    def __init__(self, model_id: str, prompt_template_file: str, field_config: Dict, norm: Optional[int] = None):
+    class BatchResult(NamedTuple):
+        doc_id: Any
+        bboxes: Optional[Dict]
+        metadata: Optional[Dict]
+        error: Optional[Exception]
+
+    def __init__(self, model_id: str, prompt_template_file: str, field_config: Dict, norm: Optional[int] = None,
+                 client: Any = None, cache: Optional[ResponseCache] = None, rate_limiter: Optional[RateLimiter] = None,
+                 preprocess: Optional[PreprocessConfig] = None, instrumentation: Optional[Instrumentation] = None,
+                 layout_index: Optional["LayoutIndex"] = None):
         self.model_id = model_id
         self.prompt_template_path = prompt_template_file
         self.field_config = field_config
         self.norm = norm
+        self.prompt_template = PromptTemplate(prompt_template_file, field_config)
+        self.client = client
+        self.cache = cache
+        self.rate_limiter = rate_limiter
+        self.preprocess = preprocess
+        self.instrumentation = instrumentation if instrumentation is not None else NULL_INSTRUMENTATION
+        self.layout_index = layout_index
+        self._shard_template_cache: Dict[int, List[PromptTemplate]] = {}
+        self._field_template_cache: Dict[Tuple[str, ...], PromptTemplate] = {}
     
-    def get_bboxes(self, document_image: bytes, document_text: Optional[str] = None) -> Optional[Dict]:
-        """Extract bounding boxes from the document image."""
-        img = Image.open(BytesIO(document_image))
-        width, height = img.size
-        image_ext = "jpeg" if img.format == "JPG" else img.format.lower()     
-
-        system_prompt = self._create_prompt(width, height)
-        response = get_converse_response(
-            messages=[{"role": "user", "content": [{"image": {"format": image_ext, "source": {"bytes": document_image}}}]}],
-            system=[{"text": system_prompt}],
-            max_tokens=3000, temperature=0, model_id=self.model_id
-        )
-        bboxes = parse_json_response(response["output"]["message"]["content"][0]["text"])
+    def get_bboxes(self, document_image: bytes, document_text: Optional[str] = None, compact: bool = False) -> Optional[Dict]:
+        """
+        Extract bounding boxes from the document image.
+
+        With compact=True the result is a BBoxArray, adjusted in one vectorized step instead of a
+        rebuilt dict; use it when many results are kept in memory.
+
+        With a layout_index, a page matching a known template reuses its boxes without a model
+        call ("layout_match" in the metadata); sampled matches are still extracted and verified.
+        A reused result holds boxes only, no text or other values, and every box is marked
+        ``"reused": True``.
+        """
+        fingerprint = match = None
+        if self.layout_index is not None:
+            fingerprint, match = self._match_layout(document_image)
+            if match is not None and not self.layout_index.should_verify():
+                self.instrumentation.count("layout_reused")
+                metadata = {
+                    "usage": {"inputTokens": 0, "outputTokens": 0, "totalTokens": 0},
+                    "metrics": {"latencyMs": 0},
+                    "failed_fields": [],
+                    "layout_match": {"entry": match.entry, "similarity": match.similarity, "shift": list(match.shift)}
+                }
+                return self._compact(match.bboxes) if compact else match.bboxes, metadata
+
+        image = self._prepare_image(document_image)
+        with self.instrumentation.timer("prompt_render"):
+            system_prompt = self._create_prompt(image.width, image.height)
+        response = self._converse(image, system_prompt)
+        bboxes, metadata, parsed = self._result_from_response(
+            response, image.original_width, image.original_height, image.width, image.height, compact)
+        if fingerprint is not None and bboxes and parsed.complete and not parsed.failed_fields:
+            accepted = bboxes.to_result(decimals=None) if compact else bboxes
+            if match is not None:
+                metadata["layout_verification"] = {"entry": match.entry, "agreement": self.layout_index.verify(fingerprint, match, accepted)}
+            else:
+                self.layout_index.add(fingerprint, accepted)
+        return bboxes, metadata
+
+    def _result_from_response(self, response: Dict, width: int, height: int, model_width: int, model_height: int,
+                              compact: bool = False) -> Tuple[Any, Dict, ParseResult]:
+        """Parse a converse response and map its boxes to the original image; returns (bboxes, metadata, parse result)."""
+        with self.instrumentation.timer("parse"):
+            parsed = parse_json_response_detailed(response["output"]["message"]["content"][0]["text"])
+        bboxes = parsed.data if parsed.data or parsed.complete else None
         metadata = {
             "usage": response['usage'],
-            "metrics": response['metrics']
+            "metrics": response['metrics'],
+            "failed_fields": parsed.failed_fields
+        }
+        with self.instrumentation.timer("adjust"):
+            if compact:
+                bboxes = self._adjust_compact(bboxes, width, height, model_width, model_height)
+            else:
+                bboxes = self._adjust_bboxes(bboxes, width, height, model_width, model_height)
+        return bboxes, metadata, parsed
+
+    def _match_layout(self, document_image: bytes) -> Tuple["LayoutFingerprint", Optional["LayoutMatch"]]:
+        """Fingerprint the page and look it up in the layout index."""
+        from utils.layout_index import layout_fingerprint
+
+        with self.instrumentation.timer("layout_match"):
+            fingerprint = layout_fingerprint(document_image)
+            return fingerprint, self.layout_index.match(fingerprint)
+
+    @staticmethod
+    def _compact(bboxes: Dict) -> "BBoxArray":
+        from utils.bbox_array import BBoxArray
+
+        return BBoxArray.from_result(bboxes)
+
+    def stream_bboxes(self, document_image: bytes) -> BBoxStream:
+        """
+        Extract bounding boxes with the converse-stream API, yielding fields as they complete.
+
+        Example:
+            stream = extractor.stream_bboxes(image_bytes)
+            for field, value in stream:
+                ...  # draw the box while the model keeps generating
+            bboxes, metadata = stream.bboxes, stream.metadata
+        """
+        image = self._prepare_image(document_image)
+        events = get_converse_stream_response(
+            messages=[{"role": "user", "content": [{"image": {"format": image.format, "source": {"bytes": image.image_bytes}}}]}],
+            system=[{"text": self._create_prompt(image.width, image.height)}],
+            max_tokens=3000, temperature=0, model_id=self.model_id,
+            client=self.client, cache=self.cache, rate_limiter=self.rate_limiter
+        )
+        return BBoxStream(events, lambda value: self._adjust_bboxes(
+            value, image.original_width, image.original_height, image.width, image.height))
+
+    def get_bboxes_streaming(self, document_image: bytes, on_field: Optional[Callable[[str, Any], None]] = None) -> Tuple[Optional[Dict], Dict]:
+        """
+        Streaming counterpart of get_bboxes.
+
+        Args:
+            document_image: Image bytes
+            on_field: Called with (field, value) as soon as each field is complete
+
+        Returns:
+            Tuple of (bboxes, metadata) where metadata["latency"] has timeToFirstFieldMs and totalMs
+        """
+        stream = self.stream_bboxes(document_image)
+        for field, value in stream:
+            if on_field is not None:
+                on_field(field, value)
+        return stream.bboxes, stream.metadata
+
+    def get_bboxes_sharded(self, document_image: bytes, num_parts: int = 2, max_retries: int = 1,
+                           max_tokens: int = 3000) -> Tuple[Dict, Dict]:
+        """
+        Extract bounding boxes with the field schema split into parts requested concurrently.
+
+        Each part asks the model for a subset of the fields of the same image, so several short
+        generations run in parallel instead of one long one. Parts whose output was truncated
+        (stopReason "max_tokens") or could not be fully parsed are retried with twice the token
+        budget, up to max_retries times; the other parts are not repeated. Fields recovered from
+        the last attempt of a failing part are kept.
+
+        Args:
+            document_image: Image bytes
+            num_parts: Number of schema parts
+            max_retries: Retries per failed part
+            max_tokens: Output token budget of the first attempt of every part
+
+        Returns:
+            Tuple of (merged bboxes, metadata with summed usage, per-part metrics and failed fields)
+        """
+        image = self._prepare_image(document_image)
+        templates = self._shard_templates(num_parts)
+
+        def _run_part(template: PromptTemplate) -> Tuple[Dict, List[Dict]]:
+            responses = []
+            budget = max_tokens
+            for _ in range(max_retries + 1):
+                response = self._converse(image, template.render(image.width, image.height), max_tokens=budget)
+                responses.append(response)
+                with self.instrumentation.timer("parse"):
+                    parsed = parse_json_response_detailed(response["output"]["message"]["content"][0]["text"])
+                if parsed.complete and not parsed.failed_fields and response.get("stopReason") != "max_tokens":
+                    return parsed.data, responses
+                budget *= 2
+            # Keep whatever fields the last attempt recovered
+            return parsed.data or {}, responses
+
+        merged: Dict[str, Any] = {}
+        usage: Dict[str, int] = {}
+        part_metrics, failed_fields = [], []
+        with ThreadPoolExecutor(max_workers=len(templates)) as executor:
+            for template, (parsed, responses) in zip(templates, executor.map(_run_part, templates)):
+                for response in responses:
+                    for key, value in response['usage'].items():
+                        usage[key] = usage.get(key, 0) + value
+                part_metrics.append({"fields": list(template.field_config), "attempts": len(responses),
+                                     "metrics": [response['metrics'] for response in responses]})
+                merged.update(parsed)
+                failed_fields.extend(field for field in template.field_config if field not in parsed)
+
+        metadata = {"usage": usage, "parts": part_metrics, "failed_fields": failed_fields}
+        return self._adjust_bboxes(merged, image.original_width, image.original_height, image.width, image.height), metadata
+
+    def get_missed_bboxes(self, document_image: bytes, first_pass: Optional[Tuple[Optional[Dict], Dict]] = None,
+                          mask_format: str = "PNG") -> Tuple[Optional[Dict], Dict]:
+        """
+        Run a second "what did we miss" pass over the image with the found boxes masked out.
+
+        Fields without a box after the first pass are requested again, and only those fields,
+        on the masked image. The masked bytes are built in memory and sent directly.
+
+        Args:
+            document_image: Image bytes
+            first_pass: (bboxes, metadata) from get_bboxes; computed when None
+            mask_format: Encoding of the masked image; "PNG" avoids compression artifacts
+                around the masked areas
+
+        Returns:
+            Tuple of (first pass bboxes completed with recovered fields, metadata with
+            "first_pass", "second_pass" and "recovered_fields")
+        """
+        from utils.bbox_drawing import create_masked_image
+
+        bboxes, metadata = first_pass if first_pass is not None else self.get_bboxes(document_image)
+        bboxes = dict(bboxes or {})
+        missing = [field for field in self.field_config if not self._has_bbox(bboxes.get(field))]
+        result_metadata = {"first_pass": metadata, "second_pass": None, "recovered_fields": []}
+        if not missing:
+            return bboxes, result_metadata
+
+        _, masked_image = create_masked_image(document_image, bboxes, format=mask_format)
+        template = self._field_template(tuple(missing))
+        image = self._prepare_image(masked_image)
+        response = self._converse(image, template.render(image.width, image.height))
+        with self.instrumentation.timer("parse"):
+            parsed = parse_json_response_detailed(response["output"]["message"]["content"][0]["text"])
+        with self.instrumentation.timer("adjust"):
+            recovered = self._adjust_bboxes(parsed.data or {}, image.original_width, image.original_height,
+                                            image.width, image.height)
+        for field in missing:
+            if self._has_bbox(recovered.get(field)):
+                bboxes[field] = recovered[field]
+                result_metadata["recovered_fields"].append(field)
+        result_metadata["second_pass"] = {
+            "usage": response['usage'],
+            "metrics": response['metrics'],
+            "failed_fields": parsed.failed_fields
         }
-        return self._adjust_bboxes(bboxes, width, height), metadata
+        return bboxes, result_metadata
+
+    def _field_template(self, fields: Tuple[str, ...]) -> PromptTemplate:
+        """Prompt template restricted to fields, compiled once per field combination."""
+        template = self._field_template_cache.get(fields)
+        if template is None:
+            template = PromptTemplate(self.prompt_template_path, {field: self.field_config[field] for field in fields})
+            self._field_template_cache[fields] = template
+        return template
+
+    @classmethod
+    def _has_bbox(cls, value: Any) -> bool:
+        if isinstance(value, dict):
+            return "bbox" in value or any(cls._has_bbox(v) for v in value.values())
+        if isinstance(value, list):
+            return any(cls._has_bbox(item) for item in value)
+        return False
+
+    def _shard_templates(self, num_parts: int) -> List[PromptTemplate]:
+        """Prompt templates for each part of the schema, compiled once per number of parts."""
+        templates = self._shard_template_cache.get(num_parts)
+        if templates is None:
+            templates = [PromptTemplate(self.prompt_template_path, part) for part in split_schema(self.field_config, num_parts)]
+            self._shard_template_cache[num_parts] = templates
+        return templates
+
+    def _prepare_image(self, document_image: bytes) -> PreprocessedImage:
+        """Return the image to send with its model-side and original dimensions."""
+        with self.instrumentation.timer("image_prepare"):
+            if self.preprocess is not None:
+                # The model sees the preprocessed image; boxes are mapped back to the original resolution
+                return preprocess_image(document_image, self.preprocess)
+            info = get_image_info(document_image)
+            return PreprocessedImage(document_image, info.format, info.width, info.height, info.width, info.height)
+
+    def _converse(self, image: PreprocessedImage, system_prompt: str, max_tokens: int = 3000) -> Dict:
+        """Send one image with a system prompt to the model."""
+        return get_converse_response(
+            messages=[{"role": "user", "content": [{"image": {"format": image.format, "source": {"bytes": image.image_bytes}}}]}],
+            system=[{"text": system_prompt}],
+            max_tokens=max_tokens, temperature=0, model_id=self.model_id,
+            client=self.client, cache=self.cache, rate_limiter=self.rate_limiter,
+            instrumentation=self.instrumentation
+        )
+
+    def get_bboxes_batch(self, documents: Iterable[Union[bytes, Tuple[Any, bytes]]], max_concurrency: int = 8,
+                         compact: bool = False) -> Iterator["BoundingBoxExtractor.BatchResult"]:
+        """
+        Extract bounding boxes for many documents concurrently.
+
+        Documents are consumed lazily and at most ``max_concurrency`` extractions are in flight
+        at any time, all sharing the same Bedrock client. Results are yielded in completion order;
+        a failing document yields a result with ``error`` set instead of aborting the batch.
+
+        Args:
+            documents: Iterable of image bytes or ``(doc_id, image_bytes)`` tuples
+            max_concurrency: Maximum number of concurrent model calls
+            compact: Return each result as a BBoxArray (see get_bboxes)
+
+        Yields:
+            BatchResult for each document as soon as it finishes
+        """
+        if max_concurrency < 1:
+            raise ValueError(f"max_concurrency must be at least 1, got {max_concurrency}")
+
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            pending = {}
+            for index, document in enumerate(documents):
+                doc_id, document_image = document if isinstance(document, tuple) else (index, document)
+                if len(pending) >= max_concurrency:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield self._batch_result(pending.pop(future), future)
+                pending[executor.submit(self.get_bboxes, document_image, compact=compact)] = doc_id
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield self._batch_result(pending.pop(future), future)
+
+    def get_bboxes_jobs(self, documents: Iterable[Union[bytes, Tuple[Any, bytes]]], backend: "JobBackend",
+                        records_per_job: int = 10000, max_jobs: int = 4, poll_interval: float = 60.0,
+                        job_prefix: str = "bbox", max_tokens: int = 3000, compact: bool = False,
+                        max_status_errors: int = 10) -> Iterator["BoundingBoxExtractor.BatchResult"]:
+        """
+        Extract bounding boxes with asynchronous batch inference jobs, for large offline corpora.
+
+        Documents are prepared and rendered exactly as in get_bboxes and streamed into batch
+        records of up to ``records_per_job`` documents, so no more than one record is held in
+        memory while a job's input is written. Up to ``max_jobs`` jobs run at a time; they are
+        polled every ``poll_interval`` seconds and the output records of each finished job are
+        joined back to their documents by record id, parsed and adjusted like get_bboxes
+        results. Keep records_per_job within the model's batch inference quotas (minimum and
+        maximum records per job).
+
+        Args:
+            documents: Iterable of image bytes or ``(doc_id, image_bytes)`` tuples
+            backend: JobBackend, e.g. a BedrockJobBackend or a LocalJobBackend
+            records_per_job: Documents per job
+            max_jobs: Jobs in flight at a time
+            poll_interval: Seconds between status checks
+            job_prefix: Prefix of the job names
+            max_tokens: Output token limit per record
+            compact: Return each result as a BBoxArray (see get_bboxes)
+            max_status_errors: Consecutive failed status checks after which a job is given up;
+                until then the job is polled again at the next interval
+
+        Yields:
+            BatchResult per document, job by job as jobs finish; documents that could not be
+            prepared, failed in the job or are missing from its output have ``error`` set
+        """
+        from utils.batch_jobs import JOB_SUCCEEDED, JOB_TERMINAL, BatchJobError, build_model_input, model_family
+
+        if records_per_job < 1 or max_jobs < 1:
+            raise ValueError("records_per_job and max_jobs must be at least 1")
+        # Fail before any upload for models whose records cannot be built
+        model_family(self.model_id)
+        run_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{secrets.token_hex(3)}"
+        indexed = enumerate(documents)
+        # job id -> record id -> (doc_id, (original width, original height, model width, model height))
+        jobs: Dict[str, Dict[str, Tuple[Any, Tuple[int, int, int, int]]]] = {}
+        status_errors: Dict[str, int] = {}
+        exhausted = False
+        job_count = 0
+
+        while not exhausted or jobs:
+            while not exhausted and len(jobs) < max_jobs:
+                first = next(indexed, None)
+                if first is None:
+                    exhausted = True
+                    break
+                sources: Dict[str, Tuple[Any, Tuple[int, int, int, int]]] = {}
+                failures: List[BoundingBoxExtractor.BatchResult] = []
+
+                def _records(chunk=chain([first], islice(indexed, records_per_job - 1)), sources=sources, failures=failures):
+                    for index, document in chunk:
+                        doc_id, document_image = document if isinstance(document, tuple) else (index, document)
+                        try:
+                            image = self._prepare_image(document_image)
+                            with self.instrumentation.timer("prompt_render"):
+                                system_prompt = self._create_prompt(image.width, image.height)
+                        except Exception as e:
+                            failures.append(self.BatchResult(doc_id=doc_id, bboxes=None, metadata=None, error=e))
+                            continue
+                        # Bedrock record ids are 11 characters
+                        record_id = f"{index:011d}"
+                        sources[record_id] = (doc_id, (image.original_width, image.original_height, image.width, image.height))
+                        messages = [{"role": "user", "content": [{"image": {"format": image.format, "source": {"bytes": image.image_bytes}}}]}]
+                        yield {"recordId": record_id,
+                               "modelInput": build_model_input(self.model_id, messages, [{"text": system_prompt}], max_tokens, 0)}
+
+                job_name = f"{job_prefix}-{run_id}-{job_count}"
+                job_count += 1
+                try:
+                    with self.instrumentation.timer("job_submit"):
+                        job_id = backend.submit(job_name, self.model_id, _records())
+                except Exception as e:
+                    print(f"Error submitting job {job_name}: {str(e)}")
+                    # Drain the rest of the chunk if writing stopped early, so every document is reported
+                    for _ in _records():
+                        pass
+                    failures.extend(self.BatchResult(doc_id=doc_id, bboxes=None, metadata=None, error=e)
+                                    for doc_id, _ in sources.values())
+                    yield from failures
+                    continue
+                yield from failures
+                if job_id is not None:
+                    # No job is started for a chunk whose documents all failed to prepare
+                    jobs[job_id] = sources
+
+            finished = []
+            for job_id in list(jobs):
+                try:
+                    status = backend.status(job_id)
+                except Exception as e:
+                    status_errors[job_id] = status_errors.get(job_id, 0) + 1
+                    print(f"Error checking job {job_id} ({status_errors[job_id]}/{max_status_errors}): {str(e)}")
+                    if status_errors[job_id] >= max_status_errors:
+                        yield from (self.BatchResult(doc_id=doc_id, bboxes=None, metadata=None,
+                                                     error=BatchJobError(job_id, type(e).__name__, str(e)))
+                                    for doc_id, _ in jobs.pop(job_id).values())
+                    continue
+                status_errors.pop(job_id, None)
+                if status in JOB_TERMINAL:
+                    finished.append((job_id, status))
+            if not finished:
+                if jobs:
+                    time.sleep(poll_interval)
+                continue
+            for job_id, status in finished:
+                sources = jobs.pop(job_id)
+                if status in JOB_SUCCEEDED:
+                    try:
+                        for output in backend.output_records(job_id):
+                            source = sources.pop(output.get("recordId"), None)
+                            if source is not None:
+                                yield self._job_result(job_id, source, output, compact)
+                    except Exception as e:
+                        print(f"Error reading the output of job {job_id}: {str(e)}")
+                for doc_id, _ in sources.values():
+                    yield self.BatchResult(doc_id=doc_id, bboxes=None, metadata=None,
+                                           error=BatchJobError(job_id, status, "no output record"))
+
+    def _job_result(self, job_id: str, source: Tuple[Any, Tuple[int, int, int, int]], output: Dict,
+                    compact: bool) -> "BoundingBoxExtractor.BatchResult":
+        """Turn one output record of a batch job into the BatchResult of its document."""
+        from utils.batch_jobs import BatchJobError, model_output_to_response
+
+        doc_id, (width, height, model_width, model_height) = source
+        if "modelOutput" not in output:
+            error = output.get("error") or {}
+            return self.BatchResult(doc_id=doc_id, bboxes=None, metadata=None,
+                                    error=BatchJobError(job_id, error.get("errorCode"), error.get("errorMessage")))
+        try:
+            response = model_output_to_response(output["modelOutput"])
+            self.instrumentation.record_usage(self.model_id, response.get("usage"))
+            bboxes, metadata, _ = self._result_from_response(response, width, height, model_width, model_height, compact)
+        except Exception as e:
+            return self.BatchResult(doc_id=doc_id, bboxes=None, metadata=None, error=e)
+        metadata["job"] = job_id
+        return self.BatchResult(doc_id=doc_id, bboxes=bboxes, metadata=metadata, error=None)
+
+    def get_document_bboxes(self, document: "Document", max_concurrency: int = 4) -> Tuple[Dict, Dict]:
+        """
+        Extract bounding boxes from every page of a multi-page document.
+
+        Pages are rasterised only when they are scheduled and sent to the model concurrently.
+        The merged result maps each field to a list of its values across pages, ordered by page;
+        every box carries a "page" index next to its "bbox".
+
+        Args:
+            document: Document from document.open_document
+            max_concurrency: Maximum number of pages in flight
+
+        Returns:
+            Tuple of (merged bboxes, metadata with per-page usage, metrics and errors)
+        """
+        pages = sorted(self.get_bboxes_batch(document.iter_pages(), max_concurrency=max_concurrency),
+                       key=lambda result: result.doc_id)
+        merged: Dict[str, List] = {}
+        page_metadata = []
+        usage: Dict[str, int] = {}
+        for result in pages:
+            page_metadata.append({
+                "page": result.doc_id,
+                "usage": result.metadata["usage"] if result.metadata else None,
+                "metrics": result.metadata["metrics"] if result.metadata else None,
+                "error": repr(result.error) if result.error is not None else None,
+            })
+            if result.metadata:
+                for key, value in result.metadata["usage"].items():
+                    usage[key] = usage.get(key, 0) + value
+            if not result.bboxes:
+                continue
+            for field, value in result.bboxes.items():
+                merged.setdefault(field, []).append(self._tag_page(value, result.doc_id))
+        return merged, {"usage": usage, "pages": page_metadata}
+
+    def _tag_page(self, data: Any, page: int) -> Any:
+        """Add the page index to every dict that carries a bbox."""
+        if isinstance(data, dict):
+            tagged = {k: self._tag_page(v, page) for k, v in data.items()}
+            if "bbox" in data:
+                tagged["page"] = page
+            return tagged
+        elif isinstance(data, list):
+            return [self._tag_page(item, page) for item in data]
+        return data
+
+    def _batch_result(self, doc_id: Any, future) -> "BoundingBoxExtractor.BatchResult":
+        """Convert a finished extraction future into a BatchResult."""
+        try:
+            bboxes, metadata = future.result()
+            return self.BatchResult(doc_id=doc_id, bboxes=bboxes, metadata=metadata, error=None)
+        except Exception as e:
+            return self.BatchResult(doc_id=doc_id, bboxes=None, metadata=None, error=e)
 
     def _create_prompt(self, width, height):
         """"Optional parameters to use as input for the prompts are "w" for width, "h" for height, "elements" for the elements to be detected, and "schema" for the schema of the bounding boxes"""
-        schema = self.field_config
-        elements = ", ".join(schema.keys())
-        
-        with open(self.prompt_template_path, 'r') as file:
-            system_prompt = file.read().format(w=width, h=height, elements=elements, schema=schema)
-        return system_prompt
+        return self.prompt_template.render(width, height)
 
-    def _adjust_bboxes(self, data: Any, width: int, height: int) -> Any:
+    def _adjust_bboxes(self, data: Any, width: int, height: int,
+                       model_width: Optional[int] = None, model_height: Optional[int] = None) -> Any:
         """Adjust bounding boxes based on image dimensions."""
         if isinstance(data, dict):
-            return {k: self._normalize_bbox(v, width, height) if k == "bbox" 
-                    else self._adjust_bboxes(v, width, height) for k, v in data.items()}
+            return {k: self._normalize_bbox(v, width, height, model_width, model_height) if k == "bbox" 
+                    else self._adjust_bboxes(v, width, height, model_width, model_height) for k, v in data.items()}
         elif isinstance(data, list):
-            return [self._adjust_bboxes(item, width, height) for item in data]
+            return [self._adjust_bboxes(item, width, height, model_width, model_height) for item in data]
         return data
 
-    def _normalize_bbox(self, bbox: List[Any], width: int, height: int) -> List[float]:
-        """Normalize bounding box coordinates."""
+    def _adjust_compact(self, data: Optional[Dict], width: int, height: int,
+                        model_width: Optional[int] = None, model_height: Optional[int] = None) -> Optional["BBoxArray"]:
+        """Same adjustment as _adjust_bboxes, applied to all boxes of a BBoxArray at once."""
+        from utils.bbox_array import BBoxArray, adjust_model_boxes
+
+        compact = BBoxArray.from_result(data)
+        if compact is None:
+            return None
+        # Adjusted boxes are [[x1, y1], [x2, y2]] with a bottom-left origin, whatever the model emitted
+        return compact.map_boxes(lambda boxes: adjust_model_boxes(boxes, width, height, self.norm, model_width, model_height),
+                                 flat=False)
+
+    def _normalize_bbox(self, bbox: List[Any], width: int, height: int,
+                        model_width: Optional[int] = None, model_height: Optional[int] = None) -> List[float]:
+        """
+        Normalize bounding box coordinates.
+
+        width/height are the dimensions of the original image. model_width/model_height are the
+        dimensions of the image the model saw, when it was resized; absolute coordinates are
+        scaled from that grid back to the original one.
+        """
         
         # Flatten the bbox if it's nested
         if isinstance(bbox[0], list):
@@ -71,6 +646,11 @@ class BoundingBoxExtractor:
         if self.norm is not None:
             x1, x2 = x1 * width / self.norm, x2 * width / self.norm
             y1, y2 = y1 * height / self.norm, y2 * height / self.norm
+        else:
+            if model_width and model_width != width:
+                x1, x2 = x1 * width / model_width, x2 * width / model_width
+            if model_height and model_height != height:
+                y1, y2 = y1 * height / model_height, y2 * height / model_height
         
         x1, x2 = sorted([x1, x2])
         y1, y2 = sorted([y1, y2])
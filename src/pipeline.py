@@ -0,0 +1,384 @@
+# © 2024 Amazon Web Services, Inc. or its affiliates. All Rights Reserved
+# This AWS Content is provided subject to the terms of the AWS Customer Agreement available at http://aws.amazon.com/agreement or other written agreement between Customer and either Amazon Web Services, Inc. or Amazon Web Services EMEA SARL or both.
+# License terms can be found at: https://aws.amazon.com/legal/aws-ip-license-terms/
+
+"""
+Streaming corpus pipeline: load -> extract -> parse -> evaluate -> write results.
+
+Documents are listed lazily from a local directory or an S3 prefix and downloaded a bounded
+number ahead of the model calls, so only a few images are held in memory at any time, and every
+result is written as soon as it is available.
+Re-running with the same output resumes after the last completed document; documents that
+failed are retried.
+
+Example:
+    python src/pipeline.py examples/resources --schema schema.json --output results.jsonl --norm 1000
+"""
+
+import argparse
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Set
+
+from extractor import BoundingBoxExtractor
+from evaluator import BBoxEvaluator
+from utils.batch_jobs import BedrockJobBackend, JobBackend, LocalJobBackend, model_family
+from utils.bedrock_helper import NOVA_PRO_MODEL_ID, get_bedrock_client
+from utils.instrumentation import Instrumentation
+from utils.json_parser import get_local_json
+from utils.layout_index import LayoutIndex
+from utils.model_backend import BackendPool, HTTPBackend
+from utils.response_cache import SQLiteResponseCache
+from utils.s3_loader import S3BulkLoader
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".gif")
+
+
+class ManifestEntry(NamedTuple):
+    doc_id: str
+    image: str
+    truth: Optional[str]
+
+
+def iter_manifest(source: str, loader: Optional[S3BulkLoader] = None) -> Iterator[ManifestEntry]:
+    """
+    Lazily list the documents of a corpus.
+
+    Args:
+        source: Local directory or ``s3://bucket/prefix``; images are paired with a ground
+            truth ``.json`` file of the same stem when one exists. Each document is identified
+            by its file name, or its key relative to the prefix, so ``a.jpg`` and ``a.png`` or
+            keys in different folders stay distinct
+        loader: S3BulkLoader to list with; pass the one used by run_pipeline so the listed
+            ETags spare it a HEAD request per cached object
+
+    Yields:
+        ManifestEntry per image, with local paths or ``s3://`` URIs
+    """
+    if source.startswith("s3://"):
+        loader = loader if loader is not None else S3BulkLoader()
+        bucket, _, prefix = source[len("s3://"):].partition("/")
+        for pair in loader.list_pairs(bucket, prefix, IMAGE_EXTENSIONS):
+            # Listed keys all start with the prefix
+            yield ManifestEntry(doc_id=pair.image_key[len(prefix):].lstrip("/"), image=f"s3://{bucket}/{pair.image_key}",
+                                truth=f"s3://{bucket}/{pair.truth_key}" if pair.truth_key else None)
+    else:
+        for path in sorted(Path(source).iterdir()):
+            if path.suffix.lower() in IMAGE_EXTENSIONS:
+                truth = path.with_suffix(".json")
+                yield ManifestEntry(doc_id=path.name, image=str(path), truth=str(truth) if truth.exists() else None)
+
+
+def load_image(ref: str) -> bytes:
+    """Read image bytes from a local path or ``s3://`` URI."""
+    if ref.startswith("s3://"):
+        from utils.s3_helper import get_s3_image
+
+        bucket, _, key = ref[len("s3://"):].partition("/")
+        return get_s3_image(bucket, key)
+    with open(ref, "rb") as f:
+        return f.read()
+
+
+def load_truth(ref: str, loader: Optional[S3BulkLoader] = None) -> Dict:
+    """Read ground truth JSON from a local path or ``s3://`` URI, through loader's cache when given."""
+    if loader is not None:
+        return json.loads(loader.load(ref))
+    if ref.startswith("s3://"):
+        from utils.s3_helper import get_s3_json
+
+        bucket, _, key = ref[len("s3://"):].partition("/")
+        return get_s3_json(bucket, key)
+    return get_local_json(ref)
+
+
+class JSONLResultWriter:
+    """Appends one JSON record per line; the output file doubles as the resume checkpoint."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+
+    def completed_ids(self) -> Set[str]:
+        """Return the doc_ids written without error; a line truncated by a crash is ignored."""
+        done = set()
+        if os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if record.get("error") is None:
+                        done.add(record["doc_id"])
+        return done
+
+    def write(self, record: Dict) -> None:
+        if self._file is None:
+            self._truncate_partial_line()
+            self._file = open(self.path, "a")
+        self._file.write(json.dumps(record, default=str) + "\n")
+        self._file.flush()
+
+    def _truncate_partial_line(self) -> None:
+        """Drop a trailing line without newline left by an interrupted run."""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb+") as f:
+            data = f.read()
+            if data and not data.endswith(b"\n"):
+                f.truncate(data.rfind(b"\n") + 1)
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class ParquetResultWriter:
+    """
+    Writes records as a directory of Parquet part files, each renamed into place once complete.
+
+    Nested values (bboxes, metadata, evaluation) are stored as JSON strings. Requires pyarrow.
+    """
+
+    def __init__(self, path: str, rows_per_part: int = 1000):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError as e:
+            raise ImportError("Parquet output requires pyarrow: pip install pyarrow") from e
+        self.path = path
+        self.rows_per_part = rows_per_part
+        self._rows: List[Dict] = []
+        os.makedirs(path, exist_ok=True)
+        self._next_part = len(self._parts())
+
+    def _parts(self) -> List[str]:
+        return sorted(p for p in os.listdir(self.path) if p.startswith("part-") and p.endswith(".parquet"))
+
+    def completed_ids(self) -> Set[str]:
+        import pyarrow.parquet as pq
+
+        done = set()
+        for part in self._parts():
+            table = pq.read_table(os.path.join(self.path, part), columns=["doc_id", "error"]).to_pydict()
+            done.update(doc_id for doc_id, error in zip(table["doc_id"], table["error"]) if error is None)
+        return done
+
+    def write(self, record: Dict) -> None:
+        self._rows.append({k: v if k in ("doc_id", "image", "error") else json.dumps(v, default=str) for k, v in record.items()})
+        if len(self._rows) >= self.rows_per_part:
+            self._flush()
+
+    def _flush(self) -> None:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if not self._rows:
+            return
+        part = os.path.join(self.path, f"part-{self._next_part:05d}.parquet")
+        pq.write_table(pa.Table.from_pylist(self._rows), part + ".tmp")
+        os.replace(part + ".tmp", part)
+        self._next_part += 1
+        self._rows = []
+
+    def close(self) -> None:
+        self._flush()
+
+
+def make_writer(output: str):
+    """Pick a result writer from the output path: ``.parquet`` directories or JSONL files."""
+    if output.endswith(".parquet"):
+        return ParquetResultWriter(output)
+    return JSONLResultWriter(output)
+
+
+def _is_parquet_output(path: str) -> bool:
+    """Whether path is a ``.parquet`` directory holding nothing but part files written by ParquetResultWriter."""
+    return path.endswith(".parquet") and all(
+        name.startswith("part-") and name.endswith((".parquet", ".parquet.tmp")) for name in os.listdir(path))
+
+
+def _serialize_evaluation(evaluation: Dict) -> Dict[str, Any]:
+    return {
+        "mean_ap": float(evaluation["mean_ap"]),
+        "field_scores": {field: result._asdict() for field, result in evaluation["field_scores"].items()},
+    }
+
+
+def run_pipeline(entries: Iterator[ManifestEntry], extractor: BoundingBoxExtractor, writer,
+                 evaluator: Optional[BBoxEvaluator] = None, max_concurrency: int = 8,
+                 resume: bool = True, loader: Optional[S3BulkLoader] = None, job_backend: Optional[JobBackend] = None,
+                 records_per_job: int = 10000, poll_interval: float = 60.0) -> Iterator[Dict]:
+    """
+    Stream documents through extraction and evaluation, writing each result as it completes.
+
+    Args:
+        entries: Manifest entries, consumed lazily
+        extractor: Extractor used for every document
+        writer: Result writer (see make_writer)
+        evaluator: Optional evaluator, applied when ground truth is available
+        max_concurrency: Maximum number of documents in flight
+        resume: Skip documents the writer has already recorded
+        loader: S3BulkLoader prefetching images ahead of the model calls; a loader with
+            max_concurrency workers and no disk cache is used when None
+        job_backend: Submit documents as batch inference jobs through this backend instead of
+            calling the model per document (see BoundingBoxExtractor.get_bboxes_jobs)
+        records_per_job: Documents per batch job
+        poll_interval: Seconds between job status checks
+
+    Yields:
+        Result record per document, in completion order
+    """
+    completed = writer.completed_ids() if resume else set()
+    in_flight: Dict[str, ManifestEntry] = {}
+    own_loader = loader is None
+    if own_loader:
+        loader = S3BulkLoader(max_workers=max_concurrency)
+
+    def _documents():
+        pending = (entry for entry in entries if entry.doc_id not in completed)
+        for entry, image_bytes in loader.prefetch(pending, lambda entry: entry.image):
+            in_flight[entry.doc_id] = entry
+            yield entry.doc_id, image_bytes
+
+    try:
+        if job_backend is not None:
+            results = extractor.get_bboxes_jobs(_documents(), job_backend, records_per_job=records_per_job,
+                                                poll_interval=poll_interval)
+        else:
+            results = extractor.get_bboxes_batch(_documents(), max_concurrency=max_concurrency)
+        for result in results:
+            entry = in_flight.pop(result.doc_id)
+            record = {
+                "doc_id": result.doc_id,
+                "image": entry.image,
+                "bboxes": result.bboxes,
+                "metadata": result.metadata,
+                "error": repr(result.error) if result.error is not None else None,
+                "evaluation": None,
+            }
+            if evaluator is not None and entry.truth is not None and result.bboxes is not None:
+                try:
+                    record["evaluation"] = _serialize_evaluation(evaluator.evaluate(result.bboxes, load_truth(entry.truth, loader)))
+                except Exception as e:
+                    print(f"Error evaluating {result.doc_id}: {str(e)}")
+            writer.write(record)
+            yield record
+    finally:
+        writer.close()
+        if own_loader:
+            loader.close()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Extract and evaluate bounding boxes for a corpus of documents.")
+    parser.add_argument("source", help="Local directory or s3://bucket/prefix with images and ground truth JSON")
+    parser.add_argument("--schema", required=True, help="JSON file with the field schema")
+    parser.add_argument("--output", required=True, help="Results path: .jsonl file or .parquet directory")
+    parser.add_argument("--model-id", default=NOVA_PRO_MODEL_ID)
+    parser.add_argument("--prompt", default=str(Path(__file__).parent / "prompts" / "localization_normalized.txt"))
+    parser.add_argument("--norm", type=int, default=None, help="Coordinate scale used by the prompt, e.g. 1000")
+    parser.add_argument("--max-concurrency", type=int, default=8)
+    parser.add_argument("--matching", choices=("first", "instance"), default="first")
+    parser.add_argument("--cache", default=None, help="SQLite file for caching model responses")
+    parser.add_argument("--no-resume", action="store_true", help="Process every document even if already written")
+    parser.add_argument("--regions", nargs="*", default=None, help="Spread requests over these Bedrock regions with failover")
+    parser.add_argument("--max-pool-connections", type=int, default=50, help="HTTP connections per region")
+    parser.add_argument("--endpoint-url", default=None, help="Local model server to use instead of Bedrock")
+    parser.add_argument("--download-workers", type=int, default=16, help="Concurrent S3 downloads")
+    parser.add_argument("--s3-cache-dir", default=None, help="Local cache of S3 objects keyed by ETag")
+    parser.add_argument("--layout-index", default=None,
+                        help="File (.npz) of known page layouts; matching documents reuse their boxes without a model call")
+    parser.add_argument("--layout-threshold", type=float, default=0.8, help="Minimum layout similarity to reuse boxes")
+    parser.add_argument("--layout-verify-rate", type=float, default=0.05, help="Fraction of layout matches still sent to the model")
+    parser.add_argument("--job-input-uri", default=None,
+                        help="Run Bedrock batch inference jobs, uploading their input under this s3:// prefix")
+    parser.add_argument("--job-output-uri", default=None, help="s3:// prefix for the batch job output")
+    parser.add_argument("--job-role-arn", default=None, help="Service role of the batch jobs")
+    parser.add_argument("--job-region", default=None,
+                        help="Region of the batch jobs; defaults to the first of --regions, else us-west-2")
+    parser.add_argument("--job-dir", default=None, help="Run batch jobs with the local file-based stand-in in this directory")
+    parser.add_argument("--records-per-job", type=int, default=10000)
+    parser.add_argument("--poll-interval", type=float, default=60.0, help="Seconds between batch job status checks")
+    parser.add_argument("--metrics-out", default=None, help="Write per-stage latency and cost metrics in Prometheus text format")
+    args = parser.parse_args(argv)
+    if args.job_dir or args.job_input_uri:
+        try:
+            model_family(args.model_id)
+        except ValueError as e:
+            parser.error(str(e))
+    if args.no_resume and os.path.isdir(args.output) and not _is_parquet_output(args.output):
+        parser.error(f"--no-resume would delete {args.output}, which is not a .parquet result directory")
+
+    schema = get_local_json(args.schema)
+    instrumentation = Instrumentation() if args.metrics_out else None
+    client = None
+    if args.endpoint_url:
+        client = HTTPBackend(args.endpoint_url, max_pool_connections=args.max_concurrency)
+    elif args.regions:
+        client = BackendPool.for_regions(args.regions, max_pool_connections=args.max_pool_connections)
+    layout_index = None
+    if args.layout_index:
+        layout_index = LayoutIndex(threshold=args.layout_threshold, verify_rate=args.layout_verify_rate)
+        if os.path.exists(args.layout_index):
+            layout_index.load(args.layout_index)
+    extractor = BoundingBoxExtractor(
+        model_id=args.model_id,
+        prompt_template_file=args.prompt,
+        field_config=schema,
+        norm=args.norm,
+        client=client,
+        cache=SQLiteResponseCache(args.cache) if args.cache else None,
+        instrumentation=instrumentation,
+        layout_index=layout_index
+    )
+    evaluator = BBoxEvaluator(field_config=schema, matching=args.matching, instrumentation=instrumentation)
+    job_backend = None
+    if args.job_dir:
+        job_backend = LocalJobBackend(args.job_dir, client if client is not None else get_bedrock_client())
+    elif args.job_input_uri:
+        if not (args.job_output_uri and args.job_role_arn):
+            parser.error("--job-input-uri needs --job-output-uri and --job-role-arn")
+        job_region = args.job_region or (args.regions[0] if args.regions else "us-west-2")
+        job_backend = BedrockJobBackend(args.job_input_uri, args.job_output_uri, args.job_role_arn, region=job_region)
+    if args.no_resume and os.path.isdir(args.output):
+        shutil.rmtree(args.output)
+    elif args.no_resume and os.path.isfile(args.output):
+        os.remove(args.output)
+
+    loader = S3BulkLoader(max_workers=args.download_workers, cache_dir=args.s3_cache_dir)
+    processed, errors, total_ap, evaluated = 0, 0, 0.0, 0
+    try:
+        for record in run_pipeline(iter_manifest(args.source, loader), extractor, make_writer(args.output), evaluator,
+                                   max_concurrency=args.max_concurrency, resume=not args.no_resume, loader=loader,
+                                   job_backend=job_backend, records_per_job=args.records_per_job,
+                                   poll_interval=args.poll_interval):
+            processed += 1
+            errors += record["error"] is not None
+            if record["evaluation"] is not None:
+                evaluated += 1
+                total_ap += record["evaluation"]["mean_ap"]
+            if processed % 100 == 0:
+                print(f"Processed {processed} documents ({errors} errors)")
+    finally:
+        if isinstance(job_backend, LocalJobBackend):
+            job_backend.close()
+
+    mean_ap = total_ap / evaluated if evaluated else 0
+    print(f"Processed {processed} documents ({errors} errors), mean AP over {evaluated} evaluated: {mean_ap:.3f}")
+    if args.source.startswith("s3://"):
+        print(f"S3: {loader.stats()}")
+    loader.close()
+    if layout_index is not None:
+        print(f"Layouts: {layout_index.stats()}")
+        layout_index.save(args.layout_index)
+    if instrumentation is not None:
+        with open(args.metrics_out, "w") as f:
+            f.write(instrumentation.to_prometheus())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,41 +1,98 @@
 # Utils package for document information localization
+#
+# Submodules are imported on first attribute access (PEP 562), so importing the package does not
+# pull in boto3, PIL or numpy until a function that needs them is used.
 
-# JSON parsing utilities
-from .json_parser import parse_json_response, get_local_json
+from importlib import import_module
 
-# Schema utilities
-from .schema_utils import get_structure, split_schema
+_EXPORTS = {
+    # JSON parsing utilities
+    'parse_json_response': 'json_parser',
+    'parse_json_response_detailed': 'json_parser',
+    'IncrementalJSONParser': 'json_parser',
+    'ParseResult': 'json_parser',
+    'get_local_json': 'json_parser',
+    # Schema utilities
+    'get_structure': 'schema_utils',
+    'split_schema': 'schema_utils',
+    # Prompt templates
+    'PromptTemplate': 'prompt_template',
+    # Image utilities
+    'draw_gridlines': 'image_utils',
+    'get_image_bytes_with_gridlines': 'image_utils',
+    'ImageInfo': 'image_meta',
+    'get_image_info': 'image_meta',
+    'DecodedImageCache': 'image_meta',
+    'get_decoded_image': 'image_meta',
+    'PreprocessConfig': 'image_preprocessing',
+    'PreprocessedImage': 'image_preprocessing',
+    'preprocess_image': 'image_preprocessing',
+    # Bounding box drawing utilities
+    'get_random_color': 'bbox_drawing',
+    'draw_single_bbox': 'bbox_drawing',
+    'draw_bounding_boxes': 'bbox_drawing',
+    'create_masked_image': 'bbox_drawing',
+    'rasterize_boxes': 'bbox_drawing',
+    'render_overlay': 'bbox_drawing',
+    'render_overlays': 'bbox_drawing',
+    # Box geometry
+    'bbox_to_xyxy': 'box_ops',
+    'normalize_boxes': 'box_ops',
+    'box_iou': 'box_ops',
+    # Compact results
+    'BBoxArray': 'bbox_array',
+    'BoxRecord': 'bbox_array',
+    # Layout index
+    'LayoutIndex': 'layout_index',
+    'LayoutFingerprint': 'layout_index',
+    'LayoutMatch': 'layout_index',
+    'layout_fingerprint': 'layout_index',
+    # Batch inference jobs
+    'JobBackend': 'batch_jobs',
+    'BedrockJobBackend': 'batch_jobs',
+    'LocalJobBackend': 'batch_jobs',
+    'BatchJobError': 'batch_jobs',
+    # Instrumentation
+    'Instrumentation': 'instrumentation',
+    'NullInstrumentation': 'instrumentation',
+    'NULL_INSTRUMENTATION': 'instrumentation',
+    # Model backends
+    'ModelBackend': 'model_backend',
+    'BedrockBackend': 'model_backend',
+    'HTTPBackend': 'model_backend',
+    'BackendPool': 'model_backend',
+    'configure_bedrock_client': 'bedrock_helper',
+    'get_bedrock_client': 'bedrock_helper',
+    # Response caching
+    'ResponseCache': 'response_cache',
+    'LRUResponseCache': 'response_cache',
+    'SQLiteResponseCache': 'response_cache',
+    'make_cache_key': 'response_cache',
+    # Rate limiting
+    'RateLimiter': 'rate_limiter',
+    'ModelBudget': 'rate_limiter',
+    'is_throttling_error': 'rate_limiter',
+    # S3 utilities
+    'get_s3_json': 's3_helper',
+    'get_s3_image': 's3_helper',
+    'list_s3_keys': 's3_helper',
+    'configure_s3_client': 's3_helper',
+    'get_s3_client': 's3_helper',
+    'S3BulkLoader': 's3_loader',
+}
 
-# Image utilities
-from .image_utils import draw_gridlines, get_image_bytes_with_gridlines
+__all__ = list(_EXPORTS)
 
-# Bounding box drawing utilities
-from .bbox_drawing import (
-    get_random_color,
-    draw_single_bbox,
-    draw_bounding_boxes,
-    create_masked_image
-)
 
-# S3 utilities
-from .s3_helper import get_s3_json, get_s3_image
+def __getattr__(name):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(f".{module}", __name__), name)
+    # Cache on the package so later lookups skip __getattr__
+    globals()[name] = value
+    return value
 
-__all__ = [
-    # JSON parsing
-    'parse_json_response',
-    'get_local_json',
-    # Schema utilities
-    'get_structure',
-    'split_schema',
-    # Image utilities
-    'draw_gridlines',
-    'get_image_bytes_with_gridlines',
-    # Bounding box utilities
-    'get_random_color',
-    'draw_single_bbox',
-    'draw_bounding_boxes',
-    'create_masked_image',
-    # S3 utilities
-    'get_s3_json',
-    'get_s3_image'
-]
\ No newline at end of file
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,343 @@
+# © 2024 Amazon Web Services, Inc. or its affiliates. All Rights Reserved
+# This AWS Content is provided subject to the terms of the AWS Customer Agreement available at http://aws.amazon.com/agreement or other written agreement between Customer and either Amazon Web Services, Inc. or Amazon Web Services EMEA SARL or both.
+# License terms can be found at: https://aws.amazon.com/legal/aws-ip-license-terms/
+
+import base64
+import json
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Batch inference job states, as reported by get_model_invocation_job
+JOB_SUCCEEDED = ("Completed", "PartiallyCompleted")
+JOB_TERMINAL = JOB_SUCCEEDED + ("Failed", "Stopped", "Expired")
+
+
+class BatchJobError(Exception):
+    """A document has no usable output record: the job failed or the record carries an error."""
+
+    def __init__(self, job_id: str, code: Optional[str], message: Optional[str]):
+        super().__init__(f"Job {job_id}: {code}: {message}")
+        self.job_id = job_id
+        self.code = code
+
+
+# Version of the Anthropic messages API that Bedrock expects in InvokeModel bodies
+ANTHROPIC_VERSION = "bedrock-2023-05-31"
+
+
+def model_family(model_id: str) -> str:
+    """
+    Record format of a model id or inference profile: "nova" or "anthropic".
+
+    Raises:
+        ValueError: For models whose batch records this module cannot build
+    """
+    if "anthropic." in model_id:
+        return "anthropic"
+    if "amazon.nova" in model_id:
+        return "nova"
+    raise ValueError(f"Batch inference records can only be built for Amazon Nova and Anthropic Claude models, not {model_id}")
+
+
+def build_model_input(model_id: str, messages: List[Dict], system: List[Dict], max_tokens: int, temperature: float) -> Dict:
+    """
+    Turn converse arguments into the InvokeModel body of a batch inference record for model_id.
+
+    Amazon Nova bodies follow the "messages-v1" schema: converse messages with image bytes
+    base64 encoded and Nova's inference configuration keys. Anthropic Claude bodies follow the
+    Anthropic messages API, with typed content blocks and the system prompt as one string.
+    """
+    if model_family(model_id) == "anthropic":
+        def _block(block: Dict) -> Dict:
+            if "image" in block:
+                image = block["image"]
+                return {"type": "image", "source": {"type": "base64", "media_type": f"image/{image['format']}",
+                                                    "data": base64.b64encode(image["source"]["bytes"]).decode("ascii")}}
+            return {"type": "text", "text": block["text"]}
+
+        return {
+            "anthropic_version": ANTHROPIC_VERSION,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "system": "\n".join(block["text"] for block in system),
+            "messages": [{"role": m["role"], "content": [_block(b) for b in m["content"]]} for m in messages],
+        }
+
+    def _encode(value: Any) -> Any:
+        if isinstance(value, (bytes, bytearray)):
+            return base64.b64encode(value).decode("ascii")
+        if isinstance(value, dict):
+            return {k: _encode(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [_encode(v) for v in value]
+        return value
+
+    return {
+        "schemaVersion": "messages-v1",
+        "system": system,
+        "messages": _encode(messages),
+        "inferenceConfig": {"max_new_tokens": max_tokens, "temperature": temperature},
+    }
+
+
+def model_input_to_converse(model_input: Dict) -> Dict:
+    """Inverse of build_model_input: converse keyword arguments (without modelId) for a record body."""
+    anthropic = "anthropic_version" in model_input
+    messages = []
+    for message in model_input["messages"]:
+        content = []
+        for block in message["content"]:
+            if anthropic and block["type"] == "image":
+                source = block["source"]
+                block = {"image": {"format": source["media_type"].split("/", 1)[1],
+                                   "source": {"bytes": base64.b64decode(source["data"])}}}
+            elif anthropic:
+                block = {"text": block["text"]}
+            elif "image" in block:
+                image = block["image"]
+                block = {"image": {"format": image["format"], "source": {"bytes": base64.b64decode(image["source"]["bytes"])}}}
+            content.append(block)
+        messages.append({"role": message["role"], "content": content})
+    if anthropic:
+        return {
+            "messages": messages,
+            "system": [{"text": model_input["system"]}] if model_input.get("system") else [],
+            "inferenceConfig": {"maxTokens": model_input["max_tokens"], "temperature": model_input.get("temperature", 0)},
+        }
+    config = model_input.get("inferenceConfig", {})
+    return {
+        "messages": messages,
+        "system": model_input.get("system", []),
+        "inferenceConfig": {"maxTokens": config.get("max_new_tokens", 3000), "temperature": config.get("temperature", 0)},
+    }
+
+
+def response_to_model_output(response: Dict, anthropic: bool = False) -> Dict:
+    """Inverse of model_output_to_response: the modelOutput Bedrock writes for a converse response."""
+    if not anthropic:
+        return {k: response[k] for k in ("output", "stopReason", "usage") if k in response}
+    usage = response.get("usage", {})
+    return {
+        "type": "message",
+        "role": "assistant",
+        "content": [{"type": "text", "text": block["text"]} for block in response["output"]["message"]["content"] if "text" in block],
+        "stop_reason": response.get("stopReason"),
+        "usage": {"input_tokens": usage.get("inputTokens", 0), "output_tokens": usage.get("outputTokens", 0)},
+    }
+
+
+def model_output_to_response(model_output: Dict) -> Dict:
+    """Shape a batch record's modelOutput (Nova or Anthropic) like a converse response (output, stopReason, usage, metrics)."""
+    if "content" in model_output:
+        usage = model_output.get("usage", {})
+        input_tokens, output_tokens = usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+        return {
+            "output": {"message": {"role": "assistant", "content": [
+                {"text": block["text"]} for block in model_output["content"] if block.get("type") == "text"]}},
+            "stopReason": model_output.get("stop_reason"),
+            "usage": {"inputTokens": input_tokens, "outputTokens": output_tokens, "totalTokens": input_tokens + output_tokens},
+            "metrics": {},
+        }
+    return {
+        "output": model_output["output"],
+        "stopReason": model_output.get("stopReason"),
+        "usage": model_output.get("usage", {}),
+        "metrics": {},
+    }
+
+
+def _write_jsonl(records: Iterable[Dict], f) -> int:
+    count = 0
+    for record in records:
+        f.write(json.dumps(record).encode("utf-8"))
+        f.write(b"\n")
+        count += 1
+    return count
+
+
+class JobBackend:
+    """
+    Submits batch inference jobs and reads back their output records.
+
+    Input records are {"recordId": ..., "modelInput": {...}}; output records add "modelOutput"
+    or "error". ``status`` returns the Bedrock job state ("Submitted", "InProgress",
+    "Completed", "PartiallyCompleted", "Failed", ...).
+    """
+
+    def submit(self, job_name: str, model_id: str, records: Iterable[Dict]) -> Optional[str]:
+        """Upload the records, start a job and return its id; None when there were no records to run."""
+        raise NotImplementedError
+
+    def status(self, job_id: str) -> str:
+        raise NotImplementedError
+
+    def output_records(self, job_id: str) -> Iterator[Dict]:
+        """Stream the output records of a finished job."""
+        raise NotImplementedError
+
+
+class BedrockJobBackend(JobBackend):
+    """
+    Bedrock batch inference (create_model_invocation_job) with input and output on S3.
+
+    Each job's records are written to a temporary file and uploaded as
+    ``{input_uri}/{job_name}.jsonl``; Bedrock writes ``{output_uri}/{job id}/{job_name}.jsonl.out``.
+
+    Args:
+        input_uri: s3://bucket/prefix for the input files
+        output_uri: s3://bucket/prefix for the job output
+        role_arn: Service role Bedrock assumes to read and write those prefixes
+        region: Region of the bedrock control-plane client
+        client: Optional bedrock client; created on first use when None
+        s3_client: Optional S3 client; defaults to s3_helper.get_s3_client()
+        timeout_hours: Job timeout passed to Bedrock
+    """
+
+    def __init__(self, input_uri: str, output_uri: str, role_arn: str, region: str = "us-west-2",
+                 client: Any = None, s3_client: Any = None, timeout_hours: int = 72):
+        self.input_uri = input_uri.rstrip("/")
+        self.output_uri = output_uri.rstrip("/")
+        self.role_arn = role_arn
+        self.region = region
+        self.timeout_hours = timeout_hours
+        self._client = client
+        self._s3_client = s3_client
+        self._lock = threading.Lock()
+
+    @property
+    def client(self) -> Any:
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    import boto3
+                    self._client = boto3.client("bedrock", region_name=self.region)
+        return self._client
+
+    @property
+    def s3_client(self) -> Any:
+        if self._s3_client is not None:
+            return self._s3_client
+        from .s3_helper import get_s3_client
+        return get_s3_client()
+
+    @staticmethod
+    def _split(uri: str) -> Tuple[str, str]:
+        bucket, _, prefix = uri[len("s3://"):].partition("/")
+        return bucket, prefix
+
+    def submit(self, job_name: str, model_id: str, records: Iterable[Dict]) -> Optional[str]:
+        bucket, prefix = self._split(self.input_uri)
+        key = f"{prefix}/{job_name}.jsonl" if prefix else f"{job_name}.jsonl"
+        with tempfile.TemporaryFile() as f:
+            if not _write_jsonl(records, f):
+                # Bedrock rejects jobs below its minimum record count
+                return None
+            f.seek(0)
+            self.s3_client.upload_fileobj(f, bucket, key)
+        response = self.client.create_model_invocation_job(
+            jobName=job_name,
+            roleArn=self.role_arn,
+            modelId=model_id,
+            inputDataConfig={"s3InputDataConfig": {"s3Uri": f"s3://{bucket}/{key}", "s3InputFormat": "JSONL"}},
+            outputDataConfig={"s3OutputDataConfig": {"s3Uri": f"{self.output_uri}/"}},
+            timeoutDurationInHours=self.timeout_hours,
+        )
+        return response["jobArn"]
+
+    def status(self, job_id: str) -> str:
+        return self.client.get_model_invocation_job(jobIdentifier=job_id)["status"]
+
+    def output_records(self, job_id: str) -> Iterator[Dict]:
+        bucket, prefix = self._split(self.output_uri)
+        job_prefix = f"{prefix}/{job_id.rsplit('/', 1)[-1]}/" if prefix else f"{job_id.rsplit('/', 1)[-1]}/"
+        paginator = self.s3_client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=bucket, Prefix=job_prefix):
+            for obj in page.get("Contents", []):
+                if not obj["Key"].endswith(".jsonl.out"):
+                    continue
+                body = self.s3_client.get_object(Bucket=bucket, Key=obj["Key"])["Body"]
+                for line in body.iter_lines():
+                    if line.strip():
+                        yield json.loads(line)
+
+
+class LocalJobBackend(JobBackend):
+    """
+    File-based stand-in for batch inference, for tests and offline runs.
+
+    Each job is a directory under ``directory`` holding ``input.jsonl``; a background thread
+    answers every record with ``client.converse`` (e.g. an HTTPBackend or the benchmarks'
+    FakeBedrockClient) and writes ``output.jsonl.out`` in the Bedrock output format, then marks
+    the job completed.
+    A record whose call raises gets an "error" entry, and the job ends "PartiallyCompleted".
+
+    Args:
+        directory: Where job directories are created
+        client: Object exposing ``converse(**kwargs)``
+        max_workers: Jobs processed at the same time
+    """
+
+    def __init__(self, directory: str, client: Any, max_workers: int = 2):
+        self.directory = directory
+        self.client = client
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._lock = threading.Lock()
+        self._status: Dict[str, str] = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def submit(self, job_name: str, model_id: str, records: Iterable[Dict]) -> Optional[str]:
+        job_dir = os.path.join(self.directory, job_name)
+        os.makedirs(job_dir, exist_ok=True)
+        with open(os.path.join(job_dir, "input.jsonl"), "wb") as f:
+            count = _write_jsonl(records, f)
+        if not count:
+            shutil.rmtree(job_dir)
+            return None
+        with self._lock:
+            self._status[job_name] = "Submitted"
+        self._executor.submit(self._run, job_name, model_id)
+        return job_name
+
+    def _run(self, job_id: str, model_id: str) -> None:
+        job_dir = os.path.join(self.directory, job_id)
+        with self._lock:
+            self._status[job_id] = "InProgress"
+        failed = 0
+        try:
+            with open(os.path.join(job_dir, "input.jsonl"), "rb") as source, \
+                    open(os.path.join(job_dir, "output.jsonl.out.tmp"), "wb") as out:
+                for line in source:
+                    record = json.loads(line)
+                    try:
+                        response = self.client.converse(modelId=model_id, **model_input_to_converse(record["modelInput"]))
+                        result = {"recordId": record["recordId"], "modelOutput": response_to_model_output(
+                            response, anthropic="anthropic_version" in record["modelInput"])}
+                    except Exception as e:
+                        failed += 1
+                        result = {"recordId": record["recordId"], "error": {"errorCode": type(e).__name__, "errorMessage": str(e)}}
+                    out.write(json.dumps(result).encode("utf-8"))
+                    out.write(b"\n")
+            os.replace(os.path.join(job_dir, "output.jsonl.out.tmp"), os.path.join(job_dir, "output.jsonl.out"))
+            status = "PartiallyCompleted" if failed else "Completed"
+        except Exception as e:
+            print(f"Error running local job {job_id}: {str(e)}")
+            status = "Failed"
+        with self._lock:
+            self._status[job_id] = status
+
+    def status(self, job_id: str) -> str:
+        with self._lock:
+            return self._status.get(job_id, "Failed")
+
+    def output_records(self, job_id: str) -> Iterator[Dict]:
+        with open(os.path.join(self.directory, job_id, "output.jsonl.out"), "rb") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,385 @@
+# © 2024 Amazon Web Services, Inc. or its affiliates. All Rights Reserved
+# This AWS Content is provided subject to the terms of the AWS Customer Agreement available at http://aws.amazon.com/agreement or other written agreement between Customer and either Amazon Web Services, Inc. or Amazon Web Services EMEA SARL or both.
+# License terms can be found at: https://aws.amazon.com/legal/aws-ip-license-terms/
+
+import threading
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+# Skeleton node tags: a box dict, a dict, a list and any other value
+_BOX, _DICT, _LIST, _VALUE = "b", "d", "l", "v"
+_VALUE_NODE = (_VALUE,)
+
+# Layouts are shared by every document with the same result structure, list lengths included;
+# stop interning past this
+MAX_INTERNED_LAYOUTS = 4096
+
+
+class BoxRecord:
+    """One box of a BBoxArray: field, instance ordinal within the field, corners and score."""
+
+    __slots__ = ("field", "instance", "x1", "y1", "x2", "y2", "score")
+
+    def __init__(self, field: str, instance: int, x1: float, y1: float, x2: float, y2: float, score: float):
+        self.field = field
+        self.instance = instance
+        self.x1 = x1
+        self.y1 = y1
+        self.x2 = x2
+        self.y2 = y2
+        self.score = score
+
+    @property
+    def bbox(self) -> List[List[float]]:
+        return [[self.x1, self.y1], [self.x2, self.y2]]
+
+    def __repr__(self) -> str:
+        return f"BoxRecord({self.field!r}, {self.instance}, {self.bbox}, score={self.score})"
+
+
+class _Layout:
+    """
+    Structure of a result with the boxes taken out, shared between documents.
+
+    The per-box index arrays only depend on the structure, so documents with the same layout
+    (the same fields, box formats and number of list entries) share them and store nothing but
+    their coordinates.
+    """
+
+    __slots__ = ("skeleton", "fields", "field_index", "instance_index", "nested", "flat", "field_offsets",
+                 "_first_cache")
+
+    def __init__(self, skeleton: Tuple):
+        self.skeleton = skeleton
+        _, keys, children = skeleton
+        self.fields: Tuple[str, ...] = keys
+        field_index, nested, flat = [], [], []
+        for f, child in enumerate(children):
+            self._index_boxes(child, f, False, field_index, nested, flat)
+        self.field_index = np.asarray(field_index, dtype=np.uint16)
+        self.nested = np.asarray(nested, dtype=bool)
+        self.flat = np.asarray(flat, dtype=bool)
+        counts = np.bincount(self.field_index, minlength=len(keys)) if len(field_index) else np.zeros(len(keys), dtype=np.int64)
+        self.field_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.intp)
+        self.instance_index = (np.arange(len(field_index)) - self.field_offsets[self.field_index]).astype(np.uint16)
+        for array in (self.field_index, self.nested, self.flat, self.field_offsets, self.instance_index):
+            array.setflags(write=False)
+        self._first_cache: Dict[Tuple[str, ...], np.ndarray] = {}
+
+    @classmethod
+    def _index_boxes(cls, node: Tuple, field: int, under_dict: bool, field_index: List[int], nested: List[bool],
+                     flat: List[bool]) -> None:
+        tag = node[0]
+        if tag == _BOX:
+            field_index.append(field)
+            nested.append(under_dict)
+            flat.append(node[2])
+        elif tag == _DICT:
+            for child in node[2]:
+                cls._index_boxes(child, field, True, field_index, nested, flat)
+        elif tag == _LIST:
+            for child in node[1]:
+                cls._index_boxes(child, field, under_dict, field_index, nested, flat)
+
+    def first_indices(self, fields: Tuple[str, ...]) -> np.ndarray:
+        """Index of the first box of each field reachable through lists only (-1 when there is none)."""
+        indices = self._first_cache.get(fields)
+        if indices is None:
+            positions = {name: f for f, name in enumerate(self.fields)}
+            indices = np.full(len(fields), -1, dtype=np.intp)
+            for i, name in enumerate(fields):
+                f = positions.get(name)
+                if f is None:
+                    continue
+                for b in range(self.field_offsets[f], self.field_offsets[f + 1]):
+                    if not self.nested[b]:
+                        indices[i] = b
+                        break
+            indices.setflags(write=False)
+            self._first_cache[fields] = indices
+        return indices
+
+
+_LAYOUTS: Dict[Tuple, _Layout] = {}
+_LAYOUTS_LOCK = threading.Lock()
+
+
+def _intern_layout(skeleton: Tuple) -> _Layout:
+    layout = _LAYOUTS.get(skeleton)
+    if layout is None:
+        layout = _Layout(skeleton)
+        with _LAYOUTS_LOCK:
+            if len(_LAYOUTS) < MAX_INTERNED_LAYOUTS:
+                layout = _LAYOUTS.setdefault(skeleton, layout)
+    return layout
+
+
+def _as_corners(bbox: Any) -> Optional[Tuple[Tuple[float, float, float, float], bool]]:
+    """
+    Read [[x1, y1], [x2, y2]] or flat [x1, y1, x2, y2] coordinates.
+
+    Returns:
+        The corners and whether the box was flat, or None when malformed
+    """
+    try:
+        if len(bbox) == 2:
+            (x1, y1), (x2, y2) = bbox
+            flat = False
+        else:
+            x1, y1, x2, y2 = bbox
+            flat = True
+        return (float(x1), float(y1), float(x2), float(y2)), flat
+    except (TypeError, ValueError):
+        return None
+
+
+def _reformat(node: Tuple, flat: bool) -> Tuple:
+    """Skeleton with every box node set to the flat or the [[x1, y1], [x2, y2]] format."""
+    tag = node[0]
+    if tag == _BOX:
+        return (_BOX, node[1], flat)
+    if tag == _DICT:
+        return (_DICT, node[1], tuple(_reformat(child, flat) for child in node[2]))
+    if tag == _LIST:
+        return (_LIST, tuple(_reformat(child, flat) for child in node[1]))
+    return node
+
+
+def _score(item: Dict) -> float:
+    score = item.get('score', item.get('confidence', 1.0))
+    try:
+        return float(score)
+    except (TypeError, ValueError):
+        return 1.0
+
+
+class BBoxArray:
+    """
+    Compact, array-backed extraction result.
+
+    All boxes of a document live in one contiguous (n, 4) float32 array of [x1, y1, x2, y2]
+    corners in result order (the [[x1, y1], [x2, y2]] of the JSON result, bottom-left origin).
+    Field and instance indices come from a layout shared by every document with the same
+    structure, i.e. the same fields and the same number of entries in every list, so tables
+    whose row count varies get one layout per row count. Other values (text, page, ...) are
+    kept aside only when present. ``to_result`` rebuilds the usual nested dict.
+
+    Boxes given in the flat [x1, y1, x2, y2] format (top-left origin, as the model emits them)
+    are flagged in ``flat`` and written back flat. Like the dict results they come from, they
+    are found but not valid for the evaluator, and are drawn with a top-left origin.
+
+    ``boxes`` and ``field_boxes`` are read-only views, so the evaluator and the renderers work
+    on the coordinates without copying or walking the tree.
+
+    Example:
+        compact = BBoxArray.from_result(bboxes)
+        compact.field_boxes("TOTAL")   # (instances, 4) view
+        compact.to_result() == bboxes  # up to float32 precision
+    """
+
+    __slots__ = ("_boxes", "_layout", "_values", "_scores")
+
+    def __init__(self, boxes: np.ndarray, layout: _Layout, values: Optional[Tuple] = None,
+                 scores: Optional[np.ndarray] = None):
+        boxes.setflags(write=False)
+        self._boxes = boxes
+        self._layout = layout
+        self._values = values
+        self._scores = scores
+
+    @classmethod
+    def from_result(cls, data: Optional[Dict]) -> Optional["BBoxArray"]:
+        """Build a BBoxArray from an extraction result or ground truth dict (None stays None)."""
+        if data is None:
+            return None
+        coords: List[Tuple[float, float, float, float]] = []
+        values: List[Any] = []
+        scores: List[float] = []
+
+        def _skeleton(node: Any) -> Tuple:
+            if isinstance(node, dict):
+                if 'bbox' in node:
+                    box = _as_corners(node['bbox'])
+                    if box is not None:
+                        corners, flat = box
+                        coords.append(corners)
+                        scores.append(_score(node))
+                        values.extend(v for k, v in node.items() if k != 'bbox')
+                        return (_BOX, tuple(node), flat)
+                return (_DICT, tuple(node), tuple(_skeleton(v) for v in node.values()))
+            if isinstance(node, list):
+                return (_LIST, tuple(_skeleton(v) for v in node))
+            values.append(node)
+            return _VALUE_NODE
+
+        skeleton = _skeleton(data)
+        if skeleton[0] != _DICT:
+            raise ValueError("An extraction result must be a dict of fields")
+        boxes = np.asarray(coords, dtype=np.float32).reshape(-1, 4)
+        score_array = None
+        if any(score != 1.0 for score in scores):
+            score_array = np.asarray(scores, dtype=np.float32)
+            score_array.setflags(write=False)
+        return cls(boxes, _intern_layout(skeleton), tuple(values) if values else None, score_array)
+
+    def to_result(self, decimals: Optional[int] = 4) -> Dict:
+        """
+        Rebuild the nested dict result.
+
+        Args:
+            decimals: Rounding of the coordinates, which hides float32 noise; None keeps it
+        """
+        boxes = self._boxes.astype(np.float64)
+        if decimals is not None:
+            boxes = boxes.round(decimals)
+        box_iter = iter(boxes.tolist())
+        value_iter = iter(self._values or ())
+
+        def _build(node: Tuple) -> Any:
+            tag = node[0]
+            if tag == _BOX:
+                x1, y1, x2, y2 = next(box_iter)
+                bbox = [x1, y1, x2, y2] if node[2] else [[x1, y1], [x2, y2]]
+                return {k: bbox if k == 'bbox' else next(value_iter) for k in node[1]}
+            if tag == _DICT:
+                return {k: _build(child) for k, child in zip(node[1], node[2])}
+            if tag == _LIST:
+                return [_build(child) for child in node[1]]
+            return next(value_iter)
+
+        return _build(self._layout.skeleton)
+
+    @property
+    def boxes(self) -> np.ndarray:
+        """Read-only (n, 4) float32 view of all boxes as x1, y1, x2, y2."""
+        return self._boxes
+
+    @property
+    def fields(self) -> Tuple[str, ...]:
+        return self._layout.fields
+
+    @property
+    def field_index(self) -> np.ndarray:
+        """Field position (in ``fields``) of every box."""
+        return self._layout.field_index
+
+    @property
+    def instance_index(self) -> np.ndarray:
+        """Ordinal of every box within its field."""
+        return self._layout.instance_index
+
+    @property
+    def flat(self) -> np.ndarray:
+        """Whether every box was given in the flat [x1, y1, x2, y2] top-left format."""
+        return self._layout.flat
+
+    @property
+    def scores(self) -> np.ndarray:
+        """Score (or confidence) of every box; 1.0 when the result has none."""
+        if self._scores is None:
+            return np.ones(len(self._boxes), dtype=np.float32)
+        return self._scores
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held by this document's own arrays; the shared layout is not counted."""
+        return self._boxes.nbytes + (self._scores.nbytes if self._scores is not None else 0)
+
+    def field_boxes(self, field: str) -> np.ndarray:
+        """Read-only view of the boxes of one field, in output order."""
+        try:
+            f = self._layout.fields.index(field)
+        except ValueError:
+            return self._boxes[:0]
+        offsets = self._layout.field_offsets
+        return self._boxes[offsets[f]:offsets[f + 1]]
+
+    def first_boxes(self, fields: Tuple[str, ...]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        First box of each field as BBoxEvaluator scores it: the first one reachable through
+        lists only, like a table's first cell.
+
+        Returns:
+            (len(fields), 4) boxes (zeros where missing or flat), a bool mask of the fields found
+            and a bool mask of the fields whose first box is valid, i.e. not flat
+        """
+        indices = self._layout.first_indices(tuple(fields))
+        found = indices >= 0
+        valid = found.copy()
+        valid[found] = ~self._layout.flat[indices[found]]
+        boxes = np.zeros((len(indices), 4), dtype=np.float64)
+        boxes[valid] = self._boxes[indices[valid]]
+        return boxes, found, valid
+
+    @staticmethod
+    def pack_first_boxes(documents: List["BBoxArray"], fields: Tuple[str, ...]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        ``first_boxes`` of many documents at once, gathered from their concatenated boxes.
+
+        Returns:
+            (documents, fields, 4) boxes and (documents, fields) bool masks of the fields found
+            and of the valid boxes
+        """
+        fields = tuple(fields)
+        if not documents:
+            empty = np.zeros((0, len(fields)), dtype=bool)
+            return np.zeros((0, len(fields), 4)), empty, empty.copy()
+        indices = np.stack([document._layout.first_indices(fields) for document in documents])
+        found = indices >= 0
+        offsets = np.cumsum([0] + [len(document._boxes) for document in documents[:-1]])
+        all_boxes = np.concatenate([document._boxes for document in documents] + [np.zeros((1, 4), dtype=np.float32)])
+        all_flat = np.concatenate([document._layout.flat for document in documents] + [np.zeros(1, dtype=bool)])
+        # Missing fields point at the trailing zero row
+        gather = np.where(found, indices + offsets[:, None], len(all_boxes) - 1)
+        valid = found & ~all_flat[gather]
+        # Flat boxes are invalid and read as zeros, like missing ones
+        gather[found & ~valid] = len(all_boxes) - 1
+        return all_boxes[gather].astype(np.float64), found, valid
+
+    def map_boxes(self, transform: Callable[[np.ndarray], np.ndarray], flat: Optional[bool] = None) -> "BBoxArray":
+        """
+        Return a copy with transform applied to the (n, 4) box array, keeping structure and values.
+
+        Args:
+            transform: Function of the (n, 4) float32 boxes
+            flat: Set the format of every box in the copy; None keeps each box's format
+        """
+        boxes = np.ascontiguousarray(transform(self._boxes), dtype=np.float32).reshape(-1, 4)
+        layout = self._layout if flat is None else _intern_layout(_reformat(self._layout.skeleton, flat))
+        return BBoxArray(boxes, layout, self._values, self._scores)
+
+    def __len__(self) -> int:
+        return len(self._boxes)
+
+    def __iter__(self) -> Iterator[BoxRecord]:
+        fields = self._layout.fields
+        scores = self.scores.tolist()
+        for (x1, y1, x2, y2), f, instance, score in zip(self._boxes.tolist(), self._layout.field_index.tolist(),
+                                                        self._layout.instance_index.tolist(), scores):
+            yield BoxRecord(fields[f], instance, x1, y1, x2, y2, score)
+
+    def __repr__(self) -> str:
+        return f"BBoxArray({len(self)} boxes, {len(self.fields)} fields)"
+
+
+def adjust_model_boxes(boxes: np.ndarray, width: int, height: int, norm: Optional[int] = None,
+                       model_width: Optional[int] = None, model_height: Optional[int] = None) -> np.ndarray:
+    """
+    Vectorized counterpart of BoundingBoxExtractor._normalize_bbox.
+
+    Maps raw model boxes (x1, y1, x2, y2 with a top-left origin, normalized to ``norm`` or in
+    model pixels) to the original image with a bottom-left origin.
+    """
+    b = boxes.astype(np.float64)
+    if norm is not None:
+        b[:, [0, 2]] *= width / norm
+        b[:, [1, 3]] *= height / norm
+    else:
+        if model_width and model_width != width:
+            b[:, [0, 2]] *= width / model_width
+        if model_height and model_height != height:
+            b[:, [1, 3]] *= height / model_height
+    x1, x2 = np.minimum(b[:, 0], b[:, 2]), np.maximum(b[:, 0], b[:, 2])
+    y1, y2 = np.minimum(b[:, 1], b[:, 3]), np.maximum(b[:, 1], b[:, 3])
+    return np.stack([x1, height - y2, x2, height - y1], axis=1)
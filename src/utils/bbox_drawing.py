@@ -2,12 +2,22 @@
 # This AWS Content is provided subject to the terms of the AWS Customer Agreement available at http://aws.amazon.com/agreement or other written agreement between Customer and either Amazon Web Services, Inc. or Amazon Web Services EMEA SARL or both.
 # License terms can be found at: https://aws.amazon.com/legal/aws-ip-license-terms/
 
-import secrets
 import colorsys
+import os
+import secrets
+import sys
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from functools import lru_cache, partial
 from io import BytesIO
-from typing import Dict, List, Tuple, Union
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
 from PIL import Image, ImageDraw, ImageColor, ImageFont
 
+from .image_meta import get_decoded_image
+
+if TYPE_CHECKING:
+    import numpy as np
+    from .bbox_array import BBoxArray
+
 
 def get_random_color() -> str:
     """
@@ -21,151 +31,328 @@ def get_random_color() -> str:
     rgb = colorsys.hsv_to_rgb(hue, 0.9, 0.9)
     return '#{:02x}{:02x}{:02x}'.format(int(rgb[0] * 255), int(rgb[1] * 255), int(rgb[2] * 255))
 
+
+# Tried in order; the first font that loads is used for every label
+FONT_CANDIDATES = (
+    "/System/Library/Fonts/Supplemental/Arial.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/dejavu/DejaVuSans.ttf",
+    "arial.ttf",
+    "DejaVuSans.ttf",
+)
+
+
+@lru_cache(maxsize=64)
+def _load_font(size: int) -> ImageFont.ImageFont:
+    """Load the label font once per size instead of once per box."""
+    for path in FONT_CANDIDATES:
+        try:
+            return ImageFont.truetype(path, size)
+        except OSError:
+            continue
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        # Pillow < 10.1 only has the fixed-size bitmap font
+        return ImageFont.load_default()
+
+
+class _Style(NamedTuple):
+    line_width: int
+    font: ImageFont.ImageFont
+
+
+@lru_cache(maxsize=256)
+def _style_for(width: int, height: int, min_font_size: int, min_line_width: int) -> _Style:
+    """Line width and font scaled to the image size."""
+    min_dimension = min(width, height)
+    line_width = max(min_line_width, int(min_dimension * 0.003))
+    font_size = max(min_font_size, int(min_dimension * 0.015))
+    return _Style(line_width, _load_font(font_size))
+
+
+def _draw_boxes(image: Image.Image, boxes: Iterable[Tuple[float, float, float, float, str, str]], style: _Style) -> None:
+    """Draw (x1, y1, x2, y2, label, color) boxes in top-left pixel coordinates with a single ImageDraw."""
+    draw = ImageDraw.Draw(image, "RGBA")
+    label_sizes: Dict[str, Tuple[int, int]] = {}
+    for x1, y1, x2, y2, label, color in boxes:
+        draw.rectangle([x1, y1, x2, y2], outline=ImageColor.getrgb(color) + (100,), width=style.line_width)
+        if label not in label_sizes:
+            label_bbox = draw.textbbox((0, 0), label, font=style.font)
+            label_sizes[label] = (label_bbox[2] - label_bbox[0], label_bbox[3] - label_bbox[1])
+        text_width, text_height = label_sizes[label]
+        draw.rectangle([x1, y1-text_height-2, x1+text_width+4, y1-2], fill=color)
+        draw.text((x1+2, y1-text_height-1), label, fill="white", font=style.font)
+
+
+def _to_xyxy(bbox: List[List[float]], height: float, scale: float = 1.0) -> Tuple[float, float, float, float]:
+    """Convert a bottom-left origin [[x1,y1],[x2,y2]] box to scaled top-left (x1, y1, x2, y2), as BBoxEvaluator does."""
+    (bx1, by1), (bx2, by2) = bbox
+    return (min(bx1, bx2) * scale, (height - max(by1, by2)) * scale,
+            max(bx1, bx2) * scale, (height - min(by1, by2)) * scale)
+
+
 def draw_single_bbox(image: Image.Image, bbox: List[List[float]], label: str, color: str = None, min_font_size: int = 12, min_line_width: int = 2) -> None:
     """
-    Draw a single bounding box with its label on the image.
-    
+    Draw a single bounding box with its label on the image, using the same bbox logic as BBoxEvaluator.
+
     Args:
         image: PIL Image object
-        bbox: List of coordinates [[x1,y1], [x2,y2]]
+        bbox: List of coordinates [[x1,y1], [x2,y2]] with a bottom-left origin
         label: String label for the bbox
         color: Color for the bbox and label (optional)
         min_font_size: Minimum font size (optional)
         min_line_width: Minimum line width (optional)
     """
-    draw = ImageDraw.Draw(image, "RGBA")
-    
-    # Calculate scaling factors based on image size
     width, height = image.size
-    min_dimension = min(width, height)
-    line_width = max(min_line_width, int(min_dimension * 0.003))
-    font_size = max(min_font_size, int(min_dimension * 0.015))
-    
-    # Use default font with larger size
-    try:
-        font = ImageFont.truetype("/System/Library/Fonts/Supplemental/Arial.ttf", font_size) 
-    except:
-        font = ImageFont.load_default()
-    
-    # Generate random color if not provided
-    if color is None:
-        color = get_random_color()
+    style = _style_for(width, height, min_font_size, min_line_width)
+    _draw_boxes(image, [_to_xyxy(bbox, height) + (label, color or get_random_color())], style)
 
-    # Extract coordinates
-    x1, y1 = bbox[0]
-    x2, y2 = bbox[1]
 
-    # Ensure coordinates are in correct order
-    x1, x2 = min(x1, x2), max(x1, x2)
-    y1, y2 = height - max(y1, y2), height - min(y1, y2)
+def _iter_bboxes(value: Any) -> Iterator[List[List[float]]]:
+    """Yield every bbox in a field value: a single box, table cells or a list of instances."""
+    if isinstance(value, dict):
+        if 'bbox' in value:
+            yield value['bbox']
+        else:
+            for item in value.values():
+                yield from _iter_bboxes(item)
+    elif isinstance(value, list):
+        for item in value:
+            yield from _iter_bboxes(item)
 
-    # Draw rectangle
-    draw.rectangle([x1, y1, x2, y2], outline=ImageColor.getrgb(color) + (100,), width=line_width)
 
-    # Calculate label dimensions
-    label_bbox = draw.textbbox((0, 0), label, font=font)
-    text_width = label_bbox[2] - label_bbox[0]
-    text_height = label_bbox[3] - label_bbox[1]
-    
-    # Draw label background and text
-    draw.rectangle([x1, y1-text_height-2, x1+text_width+4, y1-2], fill=color)
-    draw.text((x1+2, y1-text_height-1), label, fill="white", font=font)
+def _bbox_array(value: Any) -> Optional["BBoxArray"]:
+    """Return value if it is a BBoxArray; plain dict results never import numpy."""
+    module = sys.modules.get(f"{__package__}.bbox_array")
+    return value if module is not None and isinstance(value, module.BBoxArray) else None
 
 
-def draw_single_bbox(image: Image.Image, bbox: List[List[float]], label: str, color: str = None, min_font_size: int = 12, min_line_width: int = 2) -> None:
+def _array_to_xyxy(compact: "BBoxArray", height: float, scale: float = 1.0) -> "np.ndarray":
+    """Vectorized _to_xyxy over all boxes of a BBoxArray; flat boxes already have a top-left origin."""
+    import numpy as np
+
+    b = compact.boxes.astype(np.float64)
+    y1, y2 = np.minimum(b[:, 1], b[:, 3]), np.maximum(b[:, 1], b[:, 3])
+    flat = compact.flat
+    return np.stack([np.minimum(b[:, 0], b[:, 2]), np.where(flat, y1, height - y2),
+                     np.maximum(b[:, 0], b[:, 2]), np.where(flat, y2, height - y1)], axis=1) * scale
+
+
+def _collect_boxes(bounding_data: Union[Dict, "BBoxArray"], height: float, scale: float = 1.0,
+                   colors: Optional[Dict[str, str]] = None) -> List[Tuple[float, float, float, float, str, str]]:
+    compact = _bbox_array(bounding_data)
+    if compact is not None:
+        labels = compact.fields
+        field_colors = [(colors or {}).get(key) or get_random_color() for key in labels]
+        # Flat boxes are skipped, as _to_xyxy rejects them in dict results
+        return [(x1, y1, x2, y2, labels[f], field_colors[f])
+                for (x1, y1, x2, y2), f, flat in zip(_array_to_xyxy(compact, height, scale).tolist(),
+                                                     compact.field_index.tolist(), compact.flat.tolist()) if not flat]
+    boxes = []
+    for key, value in bounding_data.items():
+        color = (colors or {}).get(key) or get_random_color()
+        for bbox in _iter_bboxes(value):
+            try:
+                boxes.append(_to_xyxy(bbox, height, scale) + (key, color))
+            except (TypeError, ValueError):
+                # Malformed model output; skip the box rather than the whole image
+                continue
+    return boxes
+
+
+def draw_bounding_boxes(image_bytes: bytes, bounding_data: Union[Dict, "BBoxArray"], colors: Optional[Dict[str, str]] = None) -> Image.Image:
     """
-    Draw a single bounding box with its label on the image, using the same bbox logic as BBoxEvaluator.
+    Draw bounding boxes using the same bbox extraction logic as BBoxEvaluator.
+
+    All boxes are drawn in one pass with the font and line width computed once for the image.
+
+    Args:
+        image_bytes: Image as bytes
+        bounding_data: Extraction result or ground truth, field -> value with "bbox" entries, or a BBoxArray
+        colors: Optional field -> color; other fields get a random color
     """
-    draw = ImageDraw.Draw(image, "RGBA")
-    
-    # Calculate scaling factors based on image size
+    image = get_decoded_image(image_bytes)
     width, height = image.size
-    min_dimension = min(width, height)
-    line_width = max(min_line_width, int(min_dimension * 0.003))
-    font_size = max(min_font_size, int(min_dimension * 0.015))
-    
-    try:
-        font = ImageFont.truetype("/System/Library/Fonts/Supplemental/Arial.ttf", font_size) 
-    except:
-        font = ImageFont.load_default()
-    
-    if color is None:
-        color = get_random_color()
+    _draw_boxes(image, _collect_boxes(bounding_data, height, colors=colors), _style_for(width, height, 12, 2))
+    return image
 
-    # Extract coordinates using same logic as BBoxEvaluator._get_iou
-    xp1, yp1 = min(bbox[0][0], bbox[1][0]), height - max(bbox[0][1], bbox[1][1])
-    xp2, yp2 = max(bbox[0][0], bbox[1][0]), height - min(bbox[0][1], bbox[1][1])
-    
-    # Draw rectangle
-    draw.rectangle([xp1, yp1, xp2, yp2], outline=ImageColor.getrgb(color) + (100,), width=line_width)
 
-    # Calculate label dimensions
-    label_bbox = draw.textbbox((0, 0), label, font=font)
-    text_width = label_bbox[2] - label_bbox[0]
-    text_height = label_bbox[3] - label_bbox[1]
-    
-    # Draw label background and text
-    draw.rectangle([xp1, yp1-text_height-2, xp1+text_width+4, yp1-2], fill=color)
-    draw.text((xp1+2, yp1-text_height-1), label, fill="white", font=font)
+def render_overlay(image: Union[str, bytes], bounding_data: Union[Dict, "BBoxArray"], output_path: Optional[str] = None,
+                   max_size: Optional[int] = None, colors: Optional[Dict[str, str]] = None,
+                   quality: int = 85) -> Optional[Image.Image]:
+    """
+    Render a review overlay, optionally as a thumbnail, and write it to output_path.
+
+    For thumbnails the image is decoded at reduced size (JPEG draft mode) and boxes are scaled to
+    it, so full-resolution pixels are never drawn on.
+
+    Args:
+        image: Image path or bytes
+        bounding_data: Field -> value with "bbox" entries in original pixels, bottom-left origin, or a BBoxArray
+        output_path: File to write; the format follows its extension. Returns the image when None
+        max_size: Longest side of the output in pixels; None keeps the original size
+        colors: Optional field -> color
+        quality: JPEG/WebP quality
 
-def draw_bounding_boxes(image_bytes: bytes, bounding_data: Dict) -> Image.Image:
+    Returns:
+        The rendered image when output_path is None, otherwise None
     """
-    Draw bounding boxes using the same bbox extraction logic as BBoxEvaluator.
+    img = Image.open(BytesIO(image) if isinstance(image, bytes) else image)
+    original_width, original_height = img.size
+    scale = 1.0
+    if max_size and max(original_width, original_height) > max_size:
+        scale = max_size / max(original_width, original_height)
+        target = (max(1, int(original_width * scale)), max(1, int(original_height * scale)))
+        img.draft("RGB", target)
+        img = img.convert("RGB")
+        if img.size != target:
+            img = img.resize(target, Image.BILINEAR)
+    elif img.mode != "RGB":
+        img = img.convert("RGB")
+
+    width, height = img.size
+    _draw_boxes(img, _collect_boxes(bounding_data, original_height, scale, colors), _style_for(width, height, 12, 2))
+    if output_path is None:
+        return img
+    directory = os.path.dirname(output_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    img.save(output_path, quality=quality)
+    return None
+
+
+def _render_job(job: Tuple[Union[str, bytes], Dict, str], max_size: Optional[int], colors: Optional[Dict[str, str]],
+                quality: int) -> str:
+    image, bounding_data, output_path = job
+    render_overlay(image, bounding_data, output_path, max_size=max_size, colors=colors, quality=quality)
+    return output_path
+
+
+def render_overlays(jobs: Iterable[Tuple[Union[str, bytes], Dict, str]], max_workers: Optional[int] = None,
+                    max_size: Optional[int] = 512, colors: Optional[Dict[str, str]] = None, quality: int = 85,
+                    max_pending: Optional[int] = None) -> Iterator[Tuple[str, Optional[Exception]]]:
     """
-    image = Image.open(BytesIO(image_bytes))
+    Render many overlays to disk in parallel across a process pool.
 
-    def extract_bbox(value):
-        if isinstance(value, dict) and 'bbox' in value:
-            return value['bbox']
-        return None
+    Jobs are consumed lazily with at most max_pending submitted at a time. Passing image paths
+    rather than bytes lets every worker read its own image instead of receiving it over a pipe.
 
-    for key, value in bounding_data.items():
-        color = get_random_color()
-        
-        if key == 'TABLE':
-            # Handle TABLE separately
-            for row in value:
-                for cell in row:
-                    bbox = extract_bbox(cell)
-                    if bbox:
-                        draw_single_bbox(image, bbox, f"{key}", color)
-        else:
-            bbox = extract_bbox(value)
-            if bbox:
-                draw_single_bbox(image, bbox, key, color)
+    Args:
+        jobs: Iterable of (image path or bytes, bounding data, output path)
+        max_workers: Worker processes; defaults to the number of CPUs
+        max_size: Longest side of each output in pixels; None renders full size
+        colors: Optional field -> color shared by all overlays, so fields look the same everywhere
+        quality: JPEG/WebP quality
+        max_pending: Jobs in flight; defaults to 4 per worker
+
+    Yields:
+        (output path, error or None) as each overlay finishes
+    """
+    render = partial(_render_job, max_size=max_size, colors=colors, quality=quality)
+    max_workers = max_workers or os.cpu_count() or 1
+    max_pending = max_pending or 4 * max_workers
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        pending = {}
+        for job in jobs:
+            if len(pending) >= max_pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield _render_result(pending.pop(future), future)
+            pending[executor.submit(render, job)] = job[2]
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield _render_result(pending.pop(future), future)
 
-    return image
 
+def _render_result(output_path: str, future) -> Tuple[str, Optional[Exception]]:
+    try:
+        future.result()
+        return output_path, None
+    except Exception as e:
+        return output_path, e
+
+
+def _mask_rectangles(bounding_data: Any, width: int, height: int) -> "np.ndarray":
+    """
+    Collect every bbox as integer top-left (x1, y1, x2, y2) rows, clipped to the image.
+
+    Extractor output ([[x1,y1],[x2,y2]], bottom-left origin) and the legacy flat
+    [x1, y1, x2, y2] top-left format are both accepted, in dicts and in BBoxArrays.
+    """
+    import numpy as np
+
+    compact = _bbox_array(bounding_data)
+    rows = _array_to_xyxy(compact, height) if compact is not None else []
+    for bbox in _iter_bboxes(bounding_data if compact is None else None):
+        try:
+            if len(bbox) == 2:
+                rows.append(_to_xyxy(bbox, height))
+            else:
+                x1, y1, x2, y2 = map(float, bbox)
+                rows.append((min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)))
+        except (TypeError, ValueError):
+            continue
+    boxes = np.asarray(rows, dtype=np.float64).reshape(-1, 4)
+    # Cover every pixel the box touches
+    boxes[:, :2] = np.floor(boxes[:, :2])
+    boxes[:, 2:] = np.ceil(boxes[:, 2:])
+    boxes[:, [0, 2]] = np.clip(boxes[:, [0, 2]], 0, width)
+    boxes[:, [1, 3]] = np.clip(boxes[:, [1, 3]], 0, height)
+    boxes = boxes.astype(np.intp)
+    return boxes[(boxes[:, 2] > boxes[:, 0]) & (boxes[:, 3] > boxes[:, 1])]
+
+
+def rasterize_boxes(boxes: "np.ndarray", width: int, height: int) -> "np.ndarray":
+    """
+    Rasterise (x1, y1, x2, y2) integer rectangles into a (height, width) uint8 mask (255 inside).
+
+    Each rectangle adds +1/-1 at its four corners of a difference array; two cumulative sums
+    then give the coverage of every pixel, so the cost does not grow with the number of boxes.
+    """
+    import numpy as np
+
+    diff = np.zeros((height + 1, width + 1), dtype=np.int32)
+    x1, y1, x2, y2 = boxes.T
+    np.add.at(diff, (y1, x1), 1)
+    np.add.at(diff, (y1, x2), -1)
+    np.add.at(diff, (y2, x1), -1)
+    np.add.at(diff, (y2, x2), 1)
+    coverage = diff.cumsum(axis=0).cumsum(axis=1)[:height, :width]
+    return np.where(coverage > 0, 255, 0).astype(np.uint8)
 
 
-def create_masked_image(image_bytes: bytes, predictions: Dict) -> Tuple[Image.Image, bytes]:
+def create_masked_image(image_bytes: bytes, predictions: Union[Dict, "BBoxArray"], format: str = "JPEG", quality: int = 90,
+                        fill: Union[int, Tuple[int, ...]] = 0) -> Tuple[Image.Image, bytes]:
     """
     Create masked image from image bytes, masking out areas defined in predictions.
-    
+
     Args:
         image_bytes: Image as bytes
-        predictions: Dictionary containing prediction data with bounding boxes
-        
+        predictions: Extraction result (or any nesting of dicts/lists) whose "bbox" entries are
+            either [[x1,y1],[x2,y2]] with a bottom-left origin, as returned by the extractor,
+            or flat [x1, y1, x2, y2] with a top-left origin; or a BBoxArray
+        format: Output format: "JPEG", "PNG" (lossless) or "WEBP"
+        quality: Quality for JPEG and WEBP
+        fill: Color painted over the masked areas
+
     Returns:
-        Tuple of (PIL Image, bytes) containing masked image
+        Tuple of (PIL Image, bytes) containing masked image; the bytes can be passed straight
+        back to BoundingBoxExtractor.get_bboxes
     """
-    import numpy as np
-    import io
-    
-    # Convert bytes to PIL Image
-    img = Image.open(io.BytesIO(image_bytes))
-    mask = np.ones(np.array(img).shape[:2], dtype=np.uint8) * 255
-    
-    for category in predictions.values():
-        for item in category:
-            x1, y1, x2, y2 = map(int, item['bbox'])
-            mask[y1:y2, x1:x2] = 0
-    
-    masked = Image.composite(img, Image.new('RGB', img.size, 0), Image.fromarray(mask))
-    
-    # Convert masked image back to bytes
-    img_byte_array = io.BytesIO()
-    masked.save(img_byte_array, format='JPEG')
-    img_byte_array = img_byte_array.getvalue()
-    
-    return masked, img_byte_array
+    image = get_decoded_image(image_bytes)
+    width, height = image.size
+    boxes = _mask_rectangles(predictions, width, height)
+    if len(boxes):
+        image.paste(fill, mask=Image.fromarray(rasterize_boxes(boxes, width, height)))
+
+    format = format.upper()
+    if format == "JPEG" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    buffer = BytesIO()
+    if format in ("JPEG", "WEBP"):
+        image.save(buffer, format=format, quality=quality)
+    else:
+        image.save(buffer, format=format)
+    return image, buffer.getvalue()
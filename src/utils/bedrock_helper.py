@@ -2,8 +2,12 @@
 # This AWS Content is provided subject to the terms of the AWS Customer Agreement available at http://aws.amazon.com/agreement or other written agreement between Customer and either Amazon Web Services, Inc. or Amazon Web Services EMEA SARL or both.
 # License terms can be found at: https://aws.amazon.com/legal/aws-ip-license-terms/
 
-import boto3
-from botocore.config import Config
+import threading
+from typing import Any, Optional
+
+from .instrumentation import Instrumentation
+from .rate_limiter import RateLimiter
+from .response_cache import ResponseCache, make_cache_key
 
 NOVA_PREMIER_MODEL_ID = "us.amazon.nova-premier-v1:0"
 NOVA_PRO_MODEL_ID = "us.amazon.nova-pro-v1:0"
@@ -11,23 +15,159 @@ NOVA_LITE_MODEL_ID = "us.amazon.nova-lite-v1:0"
 SONNET_37_MODEL_ID = "us.anthropic.claude-3-7-sonnet-20250219-v1:0"
 SONNET_35_V2_MODEL_ID = "us.anthropic.claude-3-5-sonnet-20241022-v2:0"
 
-BEDROCK_WEST_CONFIG = Config(
-    region_name='us-west-2',
-    signature_version='v4',
-    read_timeout=500,
-    retries={
-        'max_attempts': 10,
-        'mode': 'adaptive'
-    }
-)
-
-BEDROCK_RT_WEST = boto3.client("bedrock-runtime", config=BEDROCK_WEST_CONFIG)
-
-def get_converse_response(messages, system, max_tokens, temperature, model_id):
-    response = BEDROCK_RT_WEST.converse(
-        modelId= model_id,
-        messages=messages,
-        system=system,
-        inferenceConfig={'maxTokens': max_tokens, "temperature": temperature}
-    )
-    return response
\ No newline at end of file
+_default_client = None
+_rate_limited_client = None
+_default_client_settings = {"region": "us-west-2", "max_pool_connections": 50, "profile_name": None}
+_default_client_lock = threading.Lock()
+
+
+def configure_bedrock_client(client: Any = None, region: str = "us-west-2", max_pool_connections: int = 50,
+                             profile_name: Optional[str] = None) -> None:
+    """
+    Set the client used when no ``client`` is passed to the converse helpers.
+
+    Args:
+        client: Object exposing ``converse``/``converse_stream`` (a model_backend backend or pool);
+            a BedrockBackend with the other arguments is built on first use when None
+        region: Region of the default client
+        max_pool_connections: HTTP connection pool size of the default client
+        profile_name: AWS profile of the default client; None uses the default credential chain
+    """
+    global _default_client, _rate_limited_client
+    with _default_client_lock:
+        _default_client_settings.update(region=region, max_pool_connections=max_pool_connections, profile_name=profile_name)
+        _default_client = client
+        _rate_limited_client = client
+
+
+def get_bedrock_client(rate_limited: bool = False) -> Any:
+    """
+    Return the default bedrock-runtime client, creating it on first use.
+
+    Args:
+        rate_limited: Return the client used under a RateLimiter, which makes a single attempt
+            per call so throttling is retried by the limiter alone instead of by botocore as well
+    """
+    global _default_client, _rate_limited_client
+    if rate_limited:
+        if _rate_limited_client is None:
+            with _default_client_lock:
+                if _rate_limited_client is None:
+                    from .model_backend import BedrockBackend
+                    _rate_limited_client = BedrockBackend(**_default_client_settings, max_attempts=1)
+        return _rate_limited_client
+    if _default_client is None:
+        with _default_client_lock:
+            if _default_client is None:
+                from .model_backend import BedrockBackend
+                _default_client = BedrockBackend(**_default_client_settings)
+    return _default_client
+
+
+def __getattr__(name: str) -> Any:
+    # Module-level client and config used to be built at import time; keep them available lazily
+    if name == "BEDROCK_RT_WEST":
+        client = get_bedrock_client()
+        return getattr(client, "client", client)
+    if name == "BEDROCK_WEST_CONFIG":
+        from botocore.config import Config
+        return Config(region_name='us-west-2', signature_version='v4', read_timeout=500, max_pool_connections=50,
+                      retries={'max_attempts': 10, 'mode': 'adaptive'})
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def get_converse_response(messages, system, max_tokens, temperature, model_id, client=None, cache: ResponseCache = None,
+                          rate_limiter: RateLimiter = None, instrumentation: Instrumentation = None):
+    """
+    Call the Bedrock converse API.
+
+    Args:
+        client: Object exposing ``converse(**kwargs)``, e.g. a model_backend.BackendPool; defaults to
+            get_bedrock_client(), without botocore retries when a rate_limiter is given
+        cache: Optional ResponseCache; identical requests are answered from it without a model call
+        rate_limiter: Optional RateLimiter enforcing per-model budgets and backing off on throttling
+        instrumentation: Optional Instrumentation; cache hits are counted as "cache_hits", and only
+            model calls are timed as "network" (without rate limiter waits) and add token usage
+    """
+    inference_config = {'maxTokens': max_tokens, "temperature": temperature}
+    if cache is not None:
+        key = make_cache_key(model_id, messages, system, inference_config)
+        cached = cache.get(key)
+        if cached is not None:
+            if instrumentation is not None:
+                instrumentation.count("cache_hits", model_id=model_id)
+            return cached
+
+    def _converse():
+        converse = (client if client is not None else get_bedrock_client(rate_limited=rate_limiter is not None)).converse
+        if instrumentation is None:
+            return converse(modelId=model_id, messages=messages, system=system, inferenceConfig=inference_config)
+        with instrumentation.timer("network", model_id):
+            return converse(modelId=model_id, messages=messages, system=system, inferenceConfig=inference_config)
+
+    response = rate_limiter.call(model_id, _converse) if rate_limiter is not None else _converse()
+    if instrumentation is not None:
+        instrumentation.record_usage(model_id, response.get('usage'))
+    if cache is not None:
+        cache.put(key, response)
+    return response
+
+
+def get_converse_stream_response(messages, system, max_tokens, temperature, model_id, client=None,
+                                 cache: ResponseCache = None, rate_limiter: RateLimiter = None):
+    """
+    Call the Bedrock converse-stream API and yield its events as they arrive.
+
+    Events have the converse-stream shape ({"contentBlockDelta": {"delta": {"text": ...}}},
+    {"messageStop": {...}}, {"metadata": {"usage": ..., "metrics": ...}}). A cached response is
+    replayed as a single text delta, and a completed stream is stored in the cache.
+
+    Args:
+        client: Object exposing ``converse_stream(**kwargs)``; defaults to get_bedrock_client(), without
+            botocore retries when a rate_limiter is given
+        cache: Optional ResponseCache shared with get_converse_response
+        rate_limiter: Optional RateLimiter; usage is reconciled from the final metadata event
+    """
+    inference_config = {'maxTokens': max_tokens, "temperature": temperature}
+    if cache is not None:
+        key = make_cache_key(model_id, messages, system, inference_config)
+        cached = cache.get(key)
+        if cached is not None:
+            yield {"contentBlockDelta": {"delta": {"text": cached["output"]["message"]["content"][0]["text"]}, "contentBlockIndex": 0}}
+            yield {"messageStop": {"stopReason": cached.get("stopReason", "end_turn")}}
+            yield {"metadata": {"usage": cached.get("usage", {}), "metrics": cached.get("metrics", {})}}
+            return
+
+    def _converse_stream():
+        return (client if client is not None else get_bedrock_client(rate_limited=rate_limiter is not None)).converse_stream(
+            modelId=model_id,
+            messages=messages,
+            system=system,
+            inferenceConfig=inference_config
+        )
+
+    reserved = rate_limiter.estimate(model_id) if rate_limiter is not None else 0
+    if rate_limiter is not None:
+        response = rate_limiter.call(model_id, _converse_stream, estimated_tokens=reserved, record=False)
+    else:
+        response = _converse_stream()
+
+    text, stop_reason, usage, metrics = [], None, {}, {}
+    for event in response["stream"]:
+        if "contentBlockDelta" in event:
+            text.append(event["contentBlockDelta"]["delta"].get("text", ""))
+        elif "messageStop" in event:
+            stop_reason = event["messageStop"].get("stopReason")
+        elif "metadata" in event:
+            usage = event["metadata"].get("usage", {})
+            metrics = event["metadata"].get("metrics", {})
+        yield event
+
+    if rate_limiter is not None:
+        rate_limiter.record_usage(model_id, reserved, usage)
+    if cache is not None:
+        cache.put(key, {
+            "output": {"message": {"role": "assistant", "content": [{"text": "".join(text)}]}},
+            "stopReason": stop_reason,
+            "usage": usage,
+            "metrics": metrics
+        })
\ No newline at end of file
@@ -0,0 +1,53 @@
+# © 2024 Amazon Web Services, Inc. or its affiliates. All Rights Reserved
+# This AWS Content is provided subject to the terms of the AWS Customer Agreement available at http://aws.amazon.com/agreement or other written agreement between Customer and either Amazon Web Services, Inc. or Amazon Web Services EMEA SARL or both.
+# License terms can be found at: https://aws.amazon.com/legal/aws-ip-license-terms/
+
+from typing import Any, Optional, Tuple
+import numpy as np
+
+
+def bbox_to_xyxy(bbox: Any) -> Optional[Tuple[float, float, float, float]]:
+    """
+    Convert a [[x1, y1], [x2, y2]] bbox to a flat (x1, y1, x2, y2) tuple.
+
+    Returns:
+        Flat coordinates, or None if the bbox is malformed
+    """
+    try:
+        return float(bbox[0][0]), float(bbox[0][1]), float(bbox[1][0]), float(bbox[1][1])
+    except (TypeError, IndexError, ValueError, KeyError):
+        return None
+
+
+def normalize_boxes(boxes: np.ndarray) -> np.ndarray:
+    """
+    Order corners so that every box is (min_x, min_y, max_x, max_y).
+
+    Args:
+        boxes: Array of shape (..., 4) with corners in any order
+
+    Returns:
+        Array of the same shape with sorted corners
+    """
+    return np.concatenate([
+        np.minimum(boxes[..., 0:1], boxes[..., 2:3]),
+        np.minimum(boxes[..., 1:2], boxes[..., 3:4]),
+        np.maximum(boxes[..., 0:1], boxes[..., 2:3]),
+        np.maximum(boxes[..., 1:2], boxes[..., 3:4]),
+    ], axis=-1)
+
+
+def box_iou(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """
+    Intersection over Union of normalized boxes, broadcasting over leading dimensions.
+
+    Pass ``a[:, None]`` and ``b[None, :]`` for a pairwise IoU matrix.
+    """
+    inter_w = np.clip(np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]), 0, None)
+    inter_h = np.clip(np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1]), 0, None)
+    inter = inter_w * inter_h
+    area_a = (a[..., 2] - a[..., 0]) * (a[..., 3] - a[..., 1])
+    area_b = (b[..., 2] - b[..., 0]) * (b[..., 3] - b[..., 1])
+    union = area_a + area_b - inter
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(union > 0, inter / np.where(union > 0, union, 1), 0.0)
@@ -0,0 +1,181 @@
+# © 2024 Amazon Web Services, Inc. or its affiliates. All Rights Reserved
+# This AWS Content is provided subject to the terms of the AWS Customer Agreement available at http://aws.amazon.com/agreement or other written agreement between Customer and either Amazon Web Services, Inc. or Amazon Web Services EMEA SARL or both.
+# License terms can be found at: https://aws.amazon.com/legal/aws-ip-license-terms/
+
+import hashlib
+import struct
+import threading
+from collections import OrderedDict
+from io import BytesIO
+from typing import TYPE_CHECKING, NamedTuple, Optional
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+
+class ImageInfo(NamedTuple):
+    width: int
+    height: int
+    format: str
+
+
+# JPEG start-of-frame markers carrying the image dimensions (DHT, JPG and DAC are excluded)
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def _jpeg_info(data: bytes) -> Optional[ImageInfo]:
+    i = 2
+    while i + 9 < len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:
+            i += 1
+            continue
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            i += 2
+            continue
+        length = struct.unpack(">H", data[i + 2:i + 4])[0]
+        if marker in _JPEG_SOF_MARKERS:
+            height, width = struct.unpack(">HH", data[i + 5:i + 9])
+            return ImageInfo(width, height, "jpeg")
+        i += 2 + length
+    return None
+
+
+def _png_info(data: bytes) -> Optional[ImageInfo]:
+    if len(data) < 24 or data[12:16] != b"IHDR":
+        return None
+    width, height = struct.unpack(">II", data[16:24])
+    return ImageInfo(width, height, "png")
+
+
+def _tiff_info(data: bytes) -> Optional[ImageInfo]:
+    endian = "<" if data[:2] == b"II" else ">"
+    ifd = struct.unpack(endian + "I", data[4:8])[0]
+    if ifd + 2 > len(data):
+        return None
+    count = struct.unpack(endian + "H", data[ifd:ifd + 2])[0]
+    dims = {}
+    for n in range(count):
+        entry = ifd + 2 + 12 * n
+        if entry + 12 > len(data):
+            break
+        tag, field_type = struct.unpack(endian + "HH", data[entry:entry + 4])
+        if tag in (256, 257):
+            fmt = endian + ("H" if field_type == 3 else "I")
+            dims[tag] = struct.unpack(fmt, data[entry + 8:entry + 8 + struct.calcsize(fmt)])[0]
+    if 256 in dims and 257 in dims:
+        return ImageInfo(dims[256], dims[257], "tiff")
+    return None
+
+
+def _gif_info(data: bytes) -> Optional[ImageInfo]:
+    width, height = struct.unpack("<HH", data[6:10])
+    return ImageInfo(width, height, "gif")
+
+
+def _webp_info(data: bytes) -> Optional[ImageInfo]:
+    chunk = data[12:16]
+    if chunk == b"VP8 " and len(data) >= 30:
+        width, height = struct.unpack("<HH", data[26:30])
+        return ImageInfo(width & 0x3FFF, height & 0x3FFF, "webp")
+    if chunk == b"VP8L" and len(data) >= 25:
+        bits = struct.unpack("<I", data[21:25])[0]
+        return ImageInfo((bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1, "webp")
+    if chunk == b"VP8X" and len(data) >= 30:
+        width = int.from_bytes(data[24:27], "little") + 1
+        height = int.from_bytes(data[27:30], "little") + 1
+        return ImageInfo(width, height, "webp")
+    return None
+
+
+def get_image_info(image_bytes: bytes) -> ImageInfo:
+    """
+    Read width, height and format from the image header without decoding pixels.
+
+    JPEG, PNG, TIFF, GIF and WebP headers are parsed directly; anything else falls back to PIL,
+    which also only reads the header.
+
+    Returns:
+        ImageInfo with the lowercase format name ("jpeg", "png", "tiff", "gif", "webp", ...)
+    """
+    info = None
+    try:
+        if image_bytes[:3] == b"\xff\xd8\xff":
+            info = _jpeg_info(image_bytes)
+        elif image_bytes[:8] == b"\x89PNG\r\n\x1a\n":
+            info = _png_info(image_bytes)
+        elif image_bytes[:4] in (b"II*\x00", b"MM\x00*"):
+            info = _tiff_info(image_bytes)
+        elif image_bytes[:6] in (b"GIF87a", b"GIF89a"):
+            info = _gif_info(image_bytes)
+        elif image_bytes[:4] == b"RIFF" and image_bytes[8:12] == b"WEBP":
+            info = _webp_info(image_bytes)
+    except struct.error:
+        info = None
+    if info is not None:
+        return info
+
+    from PIL import Image
+
+    with Image.open(BytesIO(image_bytes)) as img:
+        image_format = "jpeg" if img.format in ("JPEG", "JPG", "MPO") else img.format.lower()
+        return ImageInfo(img.size[0], img.size[1], image_format)
+
+
+class DecodedImageCache:
+    """Thread-safe LRU of decoded images keyed by a hash of their bytes, bounded by total pixels."""
+
+    def __init__(self, max_pixels: int = 64 * 1024 * 1024):
+        self.max_pixels = max_pixels
+        self._images: "OrderedDict[bytes, Image.Image]" = OrderedDict()
+        self._pixels = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, image_bytes: bytes, copy: bool = True) -> "Image.Image":
+        """
+        Return the decoded image for image_bytes, decoding it on first use.
+
+        Args:
+            image_bytes: Encoded image
+            copy: Return a private copy that may be drawn on; pass False only for read-only use
+
+        Returns:
+            PIL Image
+        """
+        key = hashlib.blake2b(image_bytes, digest_size=16).digest()
+        with self._lock:
+            image = self._images.get(key)
+            if image is not None:
+                self._images.move_to_end(key)
+                self.hits += 1
+        if image is None:
+            from PIL import Image
+
+            image = Image.open(BytesIO(image_bytes))
+            image.load()
+            with self._lock:
+                self.misses += 1
+                if key not in self._images:
+                    self._images[key] = image
+                    self._pixels += image.size[0] * image.size[1]
+                    while self._pixels > self.max_pixels and len(self._images) > 1:
+                        _, evicted = self._images.popitem(last=False)
+                        self._pixels -= evicted.size[0] * evicted.size[1]
+        return image.copy() if copy else image
+
+    def clear(self) -> None:
+        with self._lock:
+            self._images.clear()
+            self._pixels = 0
+
+
+DECODED_IMAGE_CACHE = DecodedImageCache()
+
+
+def get_decoded_image(image_bytes: bytes, copy: bool = True) -> "Image.Image":
+    """Decode image bytes through the shared DecodedImageCache."""
+    return DECODED_IMAGE_CACHE.get(image_bytes, copy=copy)
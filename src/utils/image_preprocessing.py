@@ -0,0 +1,96 @@
+# © 2024 Amazon Web Services, Inc. or its affiliates. All Rights Reserved
+# This AWS Content is provided subject to the terms of the AWS Customer Agreement available at http://aws.amazon.com/agreement or other written agreement between Customer and either Amazon Web Services, Inc. or Amazon Web Services EMEA SARL or both.
+# License terms can be found at: https://aws.amazon.com/legal/aws-ip-license-terms/
+
+import math
+from io import BytesIO
+from typing import NamedTuple, Optional
+
+from .image_meta import get_image_info
+
+# Image formats accepted by the Bedrock converse API
+BEDROCK_IMAGE_FORMATS = ("png", "jpeg", "gif", "webp")
+
+
+class PreprocessConfig(NamedTuple):
+    """
+    Options for shrinking document images before they are sent to the model.
+
+    Attributes:
+        max_side: Maximum length of the longer side in pixels
+        max_pixels: Maximum number of pixels (width * height)
+        grayscale: Convert to 8-bit grayscale
+        format: Output format ("jpeg", "webp" or "png"); None keeps the source format when Bedrock accepts it
+        quality: Encoder quality for lossy formats
+    """
+    max_side: Optional[int] = None
+    max_pixels: Optional[int] = None
+    grayscale: bool = False
+    format: Optional[str] = None
+    quality: int = 85
+
+
+class PreprocessedImage(NamedTuple):
+    image_bytes: bytes
+    format: str
+    width: int
+    height: int
+    original_width: int
+    original_height: int
+
+
+def _target_size(width: int, height: int, config: PreprocessConfig) -> tuple:
+    scale = 1.0
+    if config.max_side:
+        scale = min(scale, config.max_side / max(width, height))
+    if config.max_pixels:
+        scale = min(scale, math.sqrt(config.max_pixels / (width * height)))
+    if scale >= 1.0:
+        return width, height
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+
+def preprocess_image(image_bytes: bytes, config: PreprocessConfig) -> PreprocessedImage:
+    """
+    Downscale and re-encode an image according to config.
+
+    The image is always decoded and re-encoded, even when it needs no resizing or conversion, so
+    EXIF and other metadata never reach the model. Pixels are not rotated by the EXIF orientation
+    tag, so coordinates stay in the stored pixel grid of the original image.
+
+    Args:
+        image_bytes: Original image bytes
+        config: Preprocessing options
+
+    Returns:
+        PreprocessedImage with the bytes to send and both the sent and the original dimensions
+    """
+    info = get_image_info(image_bytes)
+    original_width, original_height = info.width, info.height
+    output_format = (config.format or info.format).lower()
+    if output_format == "jpg":
+        output_format = "jpeg"
+    if output_format not in BEDROCK_IMAGE_FORMATS:
+        output_format = "jpeg"
+
+    width, height = _target_size(original_width, original_height, config)
+
+    from PIL import Image
+
+    img = Image.open(BytesIO(image_bytes))
+    if (width, height) != (original_width, original_height):
+        # Let the JPEG decoder do most of the downscaling in the DCT domain
+        img.draft("L" if config.grayscale else "RGB", (width, height))
+    if config.grayscale:
+        img = img.convert("L")
+    elif output_format == "jpeg" and img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    if img.size != (width, height):
+        img = img.resize((width, height), Image.LANCZOS)
+
+    buffer = BytesIO()
+    if output_format in ("jpeg", "webp"):
+        img.save(buffer, format=output_format.upper(), quality=config.quality)
+    else:
+        img.save(buffer, format=output_format.upper(), optimize=True)
+    return PreprocessedImage(buffer.getvalue(), output_format, width, height, original_width, original_height)
@@ -5,6 +5,8 @@
 from PIL import Image, ImageDraw, ImageFont
 from io import BytesIO
 
+from .image_meta import get_decoded_image
+
 
 def draw_gridlines(image: Image.Image, grid_spacing: int = 20, add_gridnumbers: bool = False) -> Image.Image:
     """
@@ -40,8 +42,9 @@ def draw_gridlines(image: Image.Image, grid_spacing: int = 20, add_gridnumbers:
 
 def get_image_bytes_with_gridlines(image_bytes: bytes, grid_spacing: int = 20, add_gridnumbers: bool = False) -> bytes:
     """Convert image bytes to image with gridlines and return as bytes."""
-    with Image.open(BytesIO(image_bytes)) as image:
-        image_with_grid = draw_gridlines(image, grid_spacing, add_gridnumbers)
-        buffer = BytesIO()
-        image_with_grid.save(buffer, format='PNG')
-        return buffer.getvalue()
\ No newline at end of file
+    # draw_gridlines works on a copy, so the cached image can be shared
+    image = get_decoded_image(image_bytes, copy=False)
+    image_with_grid = draw_gridlines(image, grid_spacing, add_gridnumbers)
+    buffer = BytesIO()
+    image_with_grid.save(buffer, format='PNG')
+    return buffer.getvalue()
\ No newline at end of file
@@ -0,0 +1,191 @@
+# © 2024 Amazon Web Services, Inc. or its affiliates. All Rights Reserved
+# This AWS Content is provided subject to the terms of the AWS Customer Agreement available at http://aws.amazon.com/agreement or other written agreement between Customer and either Amazon Web Services, Inc. or Amazon Web Services EMEA SARL or both.
+# License terms can be found at: https://aws.amazon.com/legal/aws-ip-license-terms/
+
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# On-demand USD prices per 1,000 input / output tokens; pass ``prices`` to override for your region or contract
+MODEL_PRICES_PER_1K_TOKENS = {
+    "us.amazon.nova-premier-v1:0": (0.0025, 0.0125),
+    "us.amazon.nova-pro-v1:0": (0.0008, 0.0032),
+    "us.amazon.nova-lite-v1:0": (0.00006, 0.00024),
+    "us.anthropic.claude-3-7-sonnet-20250219-v1:0": (0.003, 0.015),
+    "us.anthropic.claude-3-5-sonnet-20241022-v2:0": (0.003, 0.015),
+}
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class _Histogram:
+    """Count, sum and a fixed-size uniform reservoir of samples for percentile estimates."""
+
+    def __init__(self, reservoir_size: int):
+        self.count = 0
+        self.total = 0.0
+        self.samples: List[float] = []
+        self.reservoir_size = reservoir_size
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        if len(self.samples) < self.reservoir_size:
+            self.samples.append(value)
+        else:
+            slot = random.randrange(self.count)
+            if slot < self.reservoir_size:
+                self.samples[slot] = value
+
+    def quantiles(self) -> Dict[float, float]:
+        ordered = sorted(self.samples)
+        if not ordered:
+            return {q: 0.0 for q in QUANTILES}
+        return {q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] for q in QUANTILES}
+
+
+class Instrumentation:
+    """
+    Per-stage latency histograms, counters and token/cost accounting.
+
+    Stages are timed with ``timer`` and labelled by model_id where relevant. Aggregates are
+    available from ``summary`` or as Prometheus text from ``to_prometheus``; when an OpenTelemetry
+    meter is given, every observation is also recorded on its instruments.
+    """
+
+    enabled = True
+
+    def __init__(self, prices: Optional[Dict[str, Tuple[float, float]]] = None, reservoir_size: int = 10000,
+                 otel_meter: Any = None, namespace: str = "docloc"):
+        self.prices = dict(MODEL_PRICES_PER_1K_TOKENS, **(prices or {}))
+        self.reservoir_size = reservoir_size
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self._histograms: Dict[Tuple[str, str], _Histogram] = {}
+        self._counters: Dict[Tuple[str, str], float] = {}
+        self._otel_histogram = None
+        self._otel_counter = None
+        if otel_meter is not None:
+            self._otel_histogram = otel_meter.create_histogram(f"{namespace}.stage.duration", unit="s")
+            self._otel_counter = otel_meter.create_counter(f"{namespace}.events")
+
+    @contextmanager
+    def timer(self, stage: str, model_id: str = "") -> Iterator[None]:
+        """Time the enclosed block as one observation of stage."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start, model_id)
+
+    def observe(self, stage: str, seconds: float, model_id: str = "") -> None:
+        with self._lock:
+            histogram = self._histograms.get((stage, model_id))
+            if histogram is None:
+                histogram = self._histograms[(stage, model_id)] = _Histogram(self.reservoir_size)
+            histogram.observe(seconds)
+        if self._otel_histogram is not None:
+            self._otel_histogram.record(seconds, {"stage": stage, "model_id": model_id})
+
+    def count(self, name: str, value: float = 1, model_id: str = "") -> None:
+        with self._lock:
+            self._counters[(name, model_id)] = self._counters.get((name, model_id), 0) + value
+        if self._otel_counter is not None:
+            self._otel_counter.add(value, {"name": name, "model_id": model_id})
+
+    def record_usage(self, model_id: str, usage: Optional[Dict]) -> None:
+        """Count input/output tokens of a model response and its estimated cost."""
+        if not usage:
+            return
+        input_tokens = usage.get("inputTokens", 0)
+        output_tokens = usage.get("outputTokens", 0)
+        self.count("input_tokens", input_tokens, model_id)
+        self.count("output_tokens", output_tokens, model_id)
+        price = self.prices.get(model_id)
+        if price is not None:
+            self.count("estimated_cost_usd", (input_tokens * price[0] + output_tokens * price[1]) / 1000, model_id)
+
+    def summary(self) -> Dict[str, Any]:
+        """Return stage percentiles in seconds and counters, keyed by "stage" or "stage[model_id]"."""
+        def _label(name: str, model_id: str) -> str:
+            return f"{name}[{model_id}]" if model_id else name
+
+        with self._lock:
+            stages = {
+                _label(stage, model_id): {
+                    "count": h.count,
+                    "mean": h.total / h.count if h.count else 0.0,
+                    **{f"p{int(q * 100)}": v for q, v in h.quantiles().items()},
+                }
+                for (stage, model_id), h in self._histograms.items()
+            }
+            counters = {_label(name, model_id): value for (name, model_id), value in self._counters.items()}
+        return {"stages": stages, "counters": counters}
+
+    def to_prometheus(self) -> str:
+        """Render all metrics in the Prometheus text exposition format."""
+        def _labels(**labels: str) -> str:
+            items = [f'{k}="{v}"' for k, v in labels.items() if v != ""]
+            return "{" + ",".join(items) + "}" if items else ""
+
+        lines = [f"# TYPE {self.namespace}_stage_seconds summary"]
+        with self._lock:
+            for (stage, model_id), h in sorted(self._histograms.items()):
+                for q, v in h.quantiles().items():
+                    lines.append(f"{self.namespace}_stage_seconds{_labels(stage=stage, model_id=model_id, quantile=str(q))} {v}")
+                lines.append(f"{self.namespace}_stage_seconds_sum{_labels(stage=stage, model_id=model_id)} {h.total}")
+                lines.append(f"{self.namespace}_stage_seconds_count{_labels(stage=stage, model_id=model_id)} {h.count}")
+            for name in sorted({name for name, _ in self._counters}):
+                lines.append(f"# TYPE {self.namespace}_{name}_total counter")
+                for (counter, model_id), value in sorted(self._counters.items()):
+                    if counter == name:
+                        lines.append(f"{self.namespace}_{name}_total{_labels(model_id=model_id)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self) -> None:
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+
+class NullInstrumentation(Instrumentation):
+    """Disabled instrumentation; every call is a no-op."""
+
+    enabled = False
+
+    def __init__(self):
+        self._null_timer = _NullTimer()
+
+    def timer(self, stage: str, model_id: str = "") -> "_NullTimer":
+        return self._null_timer
+
+    def observe(self, stage: str, seconds: float, model_id: str = "") -> None:
+        pass
+
+    def count(self, name: str, value: float = 1, model_id: str = "") -> None:
+        pass
+
+    def record_usage(self, model_id: str, usage: Optional[Dict]) -> None:
+        pass
+
+    def summary(self) -> Dict[str, Any]:
+        return {"stages": {}, "counters": {}}
+
+    def to_prometheus(self) -> str:
+        return ""
+
+    def reset(self) -> None:
+        pass
+
+
+class _NullTimer:
+    def __enter__(self) -> None:
+        return None
+
+    def __exit__(self, *exc) -> bool:
+        return False
+
+
+NULL_INSTRUMENTATION = NullInstrumentation()
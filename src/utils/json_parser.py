@@ -4,34 +4,304 @@
 
 import json
 import re
-from typing import Dict, Optional
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+# Characters the scanner has to stop at; everything else is skipped in bulk
+_STRUCTURAL = re.compile(r"[{}\[\],\"']")
+_STRING_END = {'"': re.compile(r'["\\]'), "'": re.compile(r"['\\]")}
+_NUMBER = re.compile(r"[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?")
+_LITERALS = {"true": True, "false": False, "null": None, "True": True, "False": False, "None": None}
+_KEY = re.compile(r"""\s*["']?([^"':,{}\[\]]+)""")
+_FENCE = "```json"
+
+
+class ParseResult(NamedTuple):
+    data: Optional[Dict]
+    failed_fields: List[str]
+    complete: bool
+
+
+class _LenientParser:
+    """Recursive descent parser for JSON with single quotes, trailing commas and Python literals."""
+
+    def __init__(self, text: str):
+        self.text = text
+        self.pos = 0
+
+    def _skip_ws(self) -> None:
+        while self.pos < len(self.text) and self.text[self.pos] in " \t\r\n":
+            self.pos += 1
+
+    def _peek(self) -> str:
+        self._skip_ws()
+        if self.pos >= len(self.text):
+            raise ValueError("Unexpected end of input")
+        return self.text[self.pos]
+
+    def _expect(self, char: str) -> None:
+        if self._peek() != char:
+            raise ValueError(f"Expected {char!r} at position {self.pos}")
+        self.pos += 1
+
+    def parse_member(self) -> Tuple[str, Any]:
+        """Parse a single 'key: value' pair and require the input to end after it."""
+        key = self._parse_string()
+        self._expect(":")
+        value = self.parse_value()
+        self._skip_ws()
+        if self.pos != len(self.text):
+            raise ValueError(f"Unexpected content at position {self.pos}")
+        return key, value
+
+    def parse_value(self) -> Any:
+        char = self._peek()
+        if char == "{":
+            return self._parse_object()
+        if char == "[":
+            return self._parse_array()
+        if char in "\"'":
+            return self._parse_string()
+        match = _NUMBER.match(self.text, self.pos)
+        if match:
+            self.pos = match.end()
+            number = match.group(0)
+            return float(number) if any(c in number for c in ".eE") else int(number)
+        for literal, value in _LITERALS.items():
+            if self.text.startswith(literal, self.pos):
+                self.pos += len(literal)
+                return value
+        raise ValueError(f"Unexpected character {char!r} at position {self.pos}")
+
+    def _parse_object(self) -> Dict:
+        self._expect("{")
+        result = {}
+        while self._peek() != "}":
+            key = self._parse_string()
+            self._expect(":")
+            result[key] = self.parse_value()
+            if self._peek() == ",":
+                self.pos += 1
+            elif self._peek() != "}":
+                raise ValueError(f"Expected ',' or '}}' at position {self.pos}")
+        self.pos += 1
+        return result
+
+    def _parse_array(self) -> List:
+        self._expect("[")
+        result = []
+        while self._peek() != "]":
+            result.append(self.parse_value())
+            if self._peek() == ",":
+                self.pos += 1
+            elif self._peek() != "]":
+                raise ValueError(f"Expected ',' or ']' at position {self.pos}")
+        self.pos += 1
+        return result
+
+    def _parse_string(self) -> str:
+        quote = self._peek()
+        if quote not in "\"'":
+            raise ValueError(f"Expected string at position {self.pos}")
+        end_pattern = _STRING_END[quote]
+        i = self.pos + 1
+        while True:
+            match = end_pattern.search(self.text, i)
+            if match is None:
+                raise ValueError("Unterminated string")
+            if match.group(0) == "\\":
+                i = match.end() + 1
+                continue
+            break
+        raw = self.text[self.pos + 1:match.start()]
+        self.pos = match.end()
+        if quote == "'":
+            raw = raw.replace("\\'", "'").replace('"', '\\"')
+        return json.loads('"' + raw + '"', strict=False)
+
+
+class IncrementalJSONParser:
+    """
+    Streaming parser for the top-level JSON object of a model response.
+
+    Text is scanned once as it arrives; every top-level field is parsed as soon as the scanner
+    sees the comma or closing brace that ends it. Markdown fences and text around the object
+    are ignored, and a field that cannot be parsed is reported without affecting the others.
+    Output that starts with a top-level array is rejected rather than read as its first element.
+
+    Like parse_json_response_detailed, the first ```json fence wins: when one appears, whatever
+    was parsed from the text before it (a brace in a preamble, say) is discarded and parsing
+    restarts after the fence. ``restarts`` counts these, so a streaming caller can drop fields
+    it already received.
+
+    Example:
+        parser = IncrementalJSONParser()
+        for chunk in stream:
+            for field, value in parser.feed(chunk):
+                ...
+        result = parser.close()
+    """
+
+    def __init__(self):
+        self._fenced = False
+        self._fence_tail = ""
+        self.restarts = 0
+        self._reset()
+
+    def _reset(self) -> None:
+        self._buffer = ""
+        self._pos = 0
+        self._started = False
+        self._leading = True
+        self.rejected = False
+        self._depth = 0
+        self._quote: Optional[str] = None
+        self._member_start = 0
+        self.complete = False
+        self.data: Dict[str, Any] = {}
+        self.failed_fields: List[str] = []
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        """
+        Add response text.
+
+        Returns:
+            (field, value) pairs completed by this chunk, in output order
+        """
+        if not self._fenced:
+            # Look for the fence across chunk boundaries
+            text = self._fence_tail + chunk
+            fence = text.find(_FENCE)
+            if fence >= 0:
+                self._fenced = True
+                if self._started or self.rejected:
+                    self.restarts += 1
+                self._reset()
+                chunk = text[fence + len(_FENCE):]
+            else:
+                self._fence_tail = text[-(len(_FENCE) - 1):]
+        if self.complete or self.rejected:
+            return []
+        if self._leading and chunk.strip():
+            self._leading = False
+            if chunk.lstrip()[0] == "[":
+                self.rejected = True
+                return []
+        self._buffer += chunk
+        completed = []
+        text = self._buffer
+        i = self._pos
+        while i < len(text):
+            if self._quote is not None:
+                match = _STRING_END[self._quote].search(text, i)
+                if match is None:
+                    i = len(text)
+                    break
+                if match.group(0) == "\\":
+                    if match.end() >= len(text):
+                        # Escape split across chunks; resume at the backslash
+                        i = match.start()
+                        break
+                    i = match.end() + 1
+                    continue
+                self._quote = None
+                i = match.end()
+                continue
+
+            match = _STRUCTURAL.search(text, i)
+            if match is None:
+                i = len(text)
+                break
+            char = match.group(0)
+            i = match.end()
+            if not self._started:
+                if char == "{":
+                    self._started = True
+                    self._depth = 1
+                    self._member_start = i
+                continue
+            if char in "\"'":
+                self._quote = char
+            elif char in "{[":
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._finish_member(text[self._member_start:i - 1], completed)
+                    self.complete = True
+                    break
+            elif char == "," and self._depth == 1:
+                self._finish_member(text[self._member_start:i - 1], completed)
+                self._member_start = i
+        if self._started and not self.complete:
+            # Only the unfinished field has to be kept for the next chunk
+            self._buffer = text[self._member_start:]
+            i -= self._member_start
+            self._member_start = 0
+        self._pos = i
+        return completed
+
+    def _finish_member(self, member: str, completed: List[Tuple[str, Any]]) -> None:
+        if not member.strip():
+            return
+        try:
+            # Strict JSON is the common case and is parsed in C; fall back to the lenient parser
+            (key, value), = json.loads("{" + member + "}").items()
+        except ValueError:
+            key = None
+        try:
+            if key is None:
+                key, value = _LenientParser(member).parse_member()
+        except ValueError:
+            key_match = _KEY.match(member)
+            self.failed_fields.append(key_match.group(1).strip() if key_match else member.strip()[:40])
+            return
+        self.data[key] = value
+        completed.append((key, value))
+
+    def close(self) -> ParseResult:
+        """
+        Finish parsing; a truncated last field is recovered if its value is complete.
+
+        Returns:
+            ParseResult with the parsed fields (None if no object was found or the output is a
+            top-level array), the fields that failed to parse and whether the closing brace was seen
+        """
+        if not self._started or self.rejected:
+            return ParseResult(None, [], False)
+        if not self.complete:
+            tail = self._buffer[self._member_start:]
+            # Drop a closing fence that follows a missing brace
+            tail = tail.split("```", 1)[0]
+            self._finish_member(tail, [])
+        return ParseResult(self.data, self.failed_fields, self.complete)
+
+
+def parse_json_response_detailed(response_text: str) -> ParseResult:
+    """Parse the JSON object in a model response, reporting fields that could not be recovered."""
+    parser = IncrementalJSONParser()
+    parser.feed(response_text)
+    return parser.close()
 
 
 def parse_json_response(response_text: str) -> Optional[Dict]:
-    """Extract and parse JSON response enclosed in ```json ... ``` markers."""
-    try:
-        # Extract content between ```json and ``` markers
-        pattern = r'```json\n(.*?)```'
-        match = re.search(pattern, response_text, re.DOTALL)
-        
-        if not match:
-            print("No JSON block found between ```json ... ``` markers.")
-            return None
-        
-        json_text = match.group(1)
-        
-        # Replace single quotes with double quotes
-        json_text = json_text.replace("'", '"')
-        
-        # Parse the JSON
-        return json.loads(json_text)
-        
-    except Exception as e:
-        print(f"Error parsing JSON: {str(e)}")
+    """
+    Extract and parse the JSON object in a model response, usually enclosed in ```json ... ``` markers.
+
+    Missing fences, single quotes, trailing commas and truncated output are tolerated: every
+    field that parses is returned and the others are reported.
+    """
+    result = parse_json_response_detailed(response_text)
+    if result.data is None:
+        print("No JSON object found in response.")
+        return None
+    if result.failed_fields:
+        print(f"Could not parse fields: {', '.join(result.failed_fields)}")
+    if not result.data and not result.complete:
         return None
+    return result.data
 
 def get_local_json(path: str) -> Dict:
     """Load JSON data from local file."""
     with open(path, 'r') as f:
         json_data = json.load(f)
-    return json_data
\ No newline at end of file
+    return json_data
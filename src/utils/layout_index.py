@@ -0,0 +1,310 @@
+# © 2024 Amazon Web Services, Inc. or its affiliates. All Rights Reserved
+# This AWS Content is provided subject to the terms of the AWS Customer Agreement available at http://aws.amazon.com/agreement or other written agreement between Customer and either Amazon Web Services, Inc. or Amazon Web Services EMEA SARL or both.
+# License terms can be found at: https://aws.amazon.com/legal/aws-ip-license-terms/
+
+import json
+import random
+import threading
+from io import BytesIO
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from .box_ops import bbox_to_xyxy
+
+# Resolution of the ink profiles used to align pages, of the aligned ink map and of the retrieval thumbnail
+PROFILE_BINS = 256
+INK_SIZE = 64
+THUMBNAIL_GRID = 32
+
+
+class LayoutFingerprint(NamedTuple):
+    vector: np.ndarray  # unit-norm blurred layout descriptor for candidate retrieval
+    ink: np.ndarray  # INK_SIZE x INK_SIZE ink map, compared after alignment
+    rows: np.ndarray  # ink per row, PROFILE_BINS bins, top to bottom
+    cols: np.ndarray  # ink per column, PROFILE_BINS bins, left to right
+    width: int
+    height: int
+
+
+class LayoutMatch(NamedTuple):
+    similarity: float
+    bboxes: Dict  # cached boxes mapped onto the queried image, each marked "reused"
+    entry: int  # index entry that matched
+    shift: Tuple[float, float]  # (dx, dy) in pixels applied by the refinement, top-left origin
+
+
+def _centered_unit(values: np.ndarray) -> np.ndarray:
+    values = values - values.mean()
+    norm = np.linalg.norm(values)
+    return values / norm if norm > 0 else values
+
+
+def layout_fingerprint(image_bytes: bytes) -> LayoutFingerprint:
+    """
+    Compute a cheap structural fingerprint of a page.
+
+    The image is decoded at reduced resolution (JPEG draft mode) to grayscale "ink". The
+    retrieval vector concatenates a heavily blurred 32x32 ink thumbnail with coarse row and
+    column profiles, so it tolerates small offsets and different text. The row and column
+    profiles at full resolution and a lightly blurred 64x64 ink map are kept to align a
+    candidate page and score it precisely.
+    """
+    from PIL import Image, ImageFilter
+
+    image = Image.open(BytesIO(image_bytes))
+    width, height = image.size
+    image.draft("L", (PROFILE_BINS, PROFILE_BINS))
+    gray = image.convert("L").resize((PROFILE_BINS, PROFILE_BINS), Image.BILINEAR)
+    ink = 1.0 - np.asarray(gray, dtype=np.float32) / 255
+    rows, cols = ink.mean(axis=1), ink.mean(axis=0)
+
+    blurred = 1.0 - np.asarray(gray.filter(ImageFilter.GaussianBlur(6)), dtype=np.float32) / 255
+    block = PROFILE_BINS // THUMBNAIL_GRID
+    thumbnail = blurred.reshape(THUMBNAIL_GRID, block, THUMBNAIL_GRID, block).mean(axis=(1, 3))
+    vector = np.concatenate([_centered_unit(thumbnail.ravel()),
+                             _centered_unit(rows.reshape(-1, 4).mean(axis=1)),
+                             _centered_unit(cols.reshape(-1, 4).mean(axis=1))])
+    ink_map = 1.0 - np.asarray(gray.resize((INK_SIZE, INK_SIZE), Image.BILINEAR).filter(ImageFilter.GaussianBlur(1)),
+                               dtype=np.float32) / 255
+    return LayoutFingerprint(_centered_unit(vector).astype(np.float32), ink_map, rows, cols, width, height)
+
+
+def _best_shift(query: np.ndarray, template: np.ndarray, max_shift: int) -> int:
+    """Shift s (in bins) maximizing the correlation of query[i + s] with template[i]."""
+    q, t = query - query.mean(), template - template.mean()
+    n = len(q)
+    best, best_score = 0, -np.inf
+    for s in range(-max_shift, max_shift + 1):
+        score = float(np.dot(q[max(s, 0):n + min(s, 0)], t[max(-s, 0):n - max(s, 0)]))
+        if score > best_score:
+            best, best_score = s, score
+    return best
+
+
+def _shifted(ink: np.ndarray, dy: int, dx: int) -> np.ndarray:
+    """Move the content of ink by (-dy, -dx) cells, filling with blank."""
+    out = np.zeros_like(ink)
+    h, w = ink.shape
+    out[max(-dy, 0):h - max(dy, 0), max(-dx, 0):w - max(dx, 0)] = ink[max(dy, 0):h + min(dy, 0), max(dx, 0):w + min(dx, 0)]
+    return out
+
+
+def aligned_similarity(query: LayoutFingerprint, template: LayoutFingerprint, max_shift: float = 0.06) -> Tuple[float, float, float]:
+    """
+    Similarity of two pages after aligning their ink profiles.
+
+    Returns:
+        (cosine similarity of the aligned ink maps, dx, dy) with the offset of the query page
+        relative to the template in query pixels, top-left origin
+    """
+    max_bins = int(max_shift * PROFILE_BINS)
+    sx = _best_shift(query.cols, template.cols, max_bins)
+    sy = _best_shift(query.rows, template.rows, max_bins)
+    cell = PROFILE_BINS // INK_SIZE
+    ink = _shifted(query.ink, round(sy / cell), round(sx / cell))
+    similarity = float(np.dot(_centered_unit(ink.ravel()), _centered_unit(template.ink.ravel())))
+    return similarity, sx * query.width / PROFILE_BINS, sy * query.height / PROFILE_BINS
+
+
+def _box_skeleton(data: Any) -> Any:
+    """
+    Keep only the [[x1, y1], [x2, y2]] boxes of a result and the fields, dicts and lists around
+    them; text, scores and other values belong to the page they were read from. None when no
+    box is left.
+    """
+    if isinstance(data, dict):
+        if "bbox" in data:
+            return {"bbox": data["bbox"]} if bbox_to_xyxy(data["bbox"]) is not None else None
+        kept = {k: _box_skeleton(v) for k, v in data.items()}
+        return {k: v for k, v in kept.items() if v is not None} or None
+    if isinstance(data, list):
+        return [item for item in map(_box_skeleton, data) if item is not None] or None
+    return None
+
+
+def _map_bboxes(data: Any, sx: float, sy: float, dx: float, dy: float) -> Any:
+    """
+    Scale and shift the bottom-left boxes of a box skeleton; dx/dy are a top-left origin shift.
+    Every box is marked ``"reused": True`` so callers can tell it from model output.
+    """
+    if isinstance(data, dict):
+        if "bbox" in data:
+            (x1, y1), (x2, y2) = data["bbox"]
+            return {"bbox": [[x1 * sx + dx, y1 * sy - dy], [x2 * sx + dx, y2 * sy - dy]], "reused": True}
+        return {k: _map_bboxes(v, sx, sy, dx, dy) for k, v in data.items()}
+    return [_map_bboxes(item, sx, sy, dx, dy) for item in data]
+
+
+class LayoutIndex:
+    """
+    Nearest-neighbour index of page layouts with the accepted extraction result of each.
+
+    Documents rendered from a known template can reuse its boxes instead of calling the model.
+    ``match`` retrieves the ``candidates`` stored layouts with the same aspect ratio whose
+    blurred descriptor is closest (one float32 matrix-vector product over the index), aligns
+    each with the page through its ink profiles and scores the aligned ink maps. Above
+    ``threshold`` the stored boxes are scaled to the new page and, with ``refine``, shifted by
+    the offset that best aligns the row and column ink profiles (a page printed a little lower
+    moves every box with it). A fraction ``verify_rate`` of matches is still reported as needing
+    verification (``should_verify``) so the caller sends them to the model and calls ``verify``.
+
+    Only the boxes of a result are stored: text and other values would come from another
+    document, so a reused result has the boxes alone, each marked ``"reused": True``.
+
+    Args:
+        threshold: Minimum aligned similarity for a match; same-template pages score above
+            0.9 and different templates below 0.6 on the FATURA samples
+        verify_rate: Fraction of matches to verify with the model
+        refine: Shift reused boxes by the estimated page offset
+        max_shift: Largest offset searched by the refinement, as a fraction of the page
+        max_aspect_difference: Largest relative difference of width/height between matching pages
+        candidates: Layouts re-scored after alignment per query
+        min_agreement: Mean IoU below which a verified match counts as a disagreement
+        seed: Seed of the verification sampling
+    """
+
+    def __init__(self, threshold: float = 0.8, verify_rate: float = 0.05, refine: bool = True,
+                 max_shift: float = 0.06, max_aspect_difference: float = 0.02, candidates: int = 5,
+                 min_agreement: float = 0.5, seed: Optional[int] = None):
+        if not 0 <= verify_rate <= 1:
+            raise ValueError(f"verify_rate must be between 0 and 1, got {verify_rate}")
+        self.threshold = threshold
+        self.verify_rate = verify_rate
+        self.refine = refine
+        self.max_shift = max_shift
+        self.max_aspect_difference = max_aspect_difference
+        self.candidates = candidates
+        self.min_agreement = min_agreement
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._vectors = np.zeros((0, 0), dtype=np.float32)
+        self._size = 0
+        self._aspects: List[float] = []
+        self._entries: List[Tuple[LayoutFingerprint, Dict]] = []
+        self.matches = 0
+        self.misses = 0
+        self.verifications = 0
+        self.disagreements = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, fingerprint: LayoutFingerprint, bboxes: Dict) -> int:
+        """Store the boxes of an accepted result (in the fingerprinted image's pixels) and return its entry."""
+        bboxes = _box_skeleton(bboxes) or {}
+        with self._lock:
+            if self._size == len(self._vectors):
+                grown = np.zeros((max(16, 2 * self._size), len(fingerprint.vector)), dtype=np.float32)
+                if self._size:
+                    grown[:self._size] = self._vectors[:self._size]
+                self._vectors = grown
+            self._vectors[self._size] = fingerprint.vector
+            self._aspects.append(fingerprint.width / fingerprint.height)
+            self._entries.append((fingerprint, bboxes))
+            self._size += 1
+            return self._size - 1
+
+    def match(self, fingerprint: LayoutFingerprint) -> Optional[LayoutMatch]:
+        """Return the closest stored layout above the threshold, with its boxes mapped to this image."""
+        with self._lock:
+            if not self._size:
+                self.misses += 1
+                return None
+            similarities = self._vectors[:self._size] @ fingerprint.vector
+            aspect = fingerprint.width / fingerprint.height
+            same_shape = np.abs(np.asarray(self._aspects) / aspect - 1) <= self.max_aspect_difference
+            similarities = np.where(same_shape, similarities, -np.inf)
+            candidates = [int(i) for i in np.argsort(-similarities)[:self.candidates] if similarities[i] > -np.inf]
+            templates = [(i, self._entries[i]) for i in candidates]
+
+        best = None
+        for entry, (template, bboxes) in templates:
+            similarity, dx, dy = aligned_similarity(fingerprint, template, self.max_shift)
+            if best is None or similarity > best[0]:
+                best = (similarity, entry, template, bboxes, dx, dy)
+        with self._lock:
+            if best is None or best[0] < self.threshold:
+                self.misses += 1
+                return None
+            self.matches += 1
+        similarity, entry, template, bboxes, dx, dy = best
+        if not self.refine:
+            dx = dy = 0.0
+        sx, sy = fingerprint.width / template.width, fingerprint.height / template.height
+        return LayoutMatch(similarity, _map_bboxes(bboxes, sx, sy, dx, dy), entry, (dx, dy))
+
+    def should_verify(self) -> bool:
+        """Draw whether a match is sent to the model for verification."""
+        with self._lock:
+            return self._random.random() < self.verify_rate
+
+    def verify(self, fingerprint: LayoutFingerprint, match: LayoutMatch, extracted: Dict) -> float:
+        """
+        Compare a reused result with the model's for the same page and record the outcome.
+
+        When they disagree (mean IoU below ``min_agreement``) the model result is added as a
+        new entry, so the index learns the variant instead of reusing wrong boxes.
+
+        Returns:
+            Mean IoU of the reused and extracted boxes
+        """
+        agreement = layout_agreement(match.bboxes, extracted)
+        with self._lock:
+            self.verifications += 1
+            self.disagreements += agreement < self.min_agreement
+        if agreement < self.min_agreement:
+            self.add(fingerprint, extracted)
+        return agreement
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            queries = self.matches + self.misses
+            return {"entries": self._size, "matches": self.matches, "misses": self.misses,
+                    "match_rate": self.matches / queries if queries else 0.0,
+                    "verifications": self.verifications, "disagreements": self.disagreements}
+
+    def save(self, path: str) -> None:
+        """Write the index to path in .npz format."""
+        with self._lock:
+            entries = list(self._entries)
+        with open(path, "wb") as out:
+            np.savez_compressed(
+                out,
+                vectors=np.stack([f.vector for f, _ in entries]) if entries else np.zeros((0, 0), dtype=np.float32),
+                ink=np.stack([f.ink for f, _ in entries]) if entries else np.zeros((0, INK_SIZE, INK_SIZE), dtype=np.float32),
+                rows=np.stack([f.rows for f, _ in entries]) if entries else np.zeros((0, PROFILE_BINS), dtype=np.float32),
+                cols=np.stack([f.cols for f, _ in entries]) if entries else np.zeros((0, PROFILE_BINS), dtype=np.float32),
+                sizes=np.asarray([(f.width, f.height) for f, _ in entries], dtype=np.int64).reshape(-1, 2),
+                bboxes=np.asarray(json.dumps([b for _, b in entries])),
+            )
+
+    def load(self, path: str) -> "LayoutIndex":
+        """Add the entries of an index written by save; returns self."""
+        with np.load(path) as data:
+            for vector, ink, rows, cols, (width, height), bboxes in zip(data["vectors"], data["ink"], data["rows"], data["cols"],
+                                                                        data["sizes"].tolist(), json.loads(str(data["bboxes"]))):
+                self.add(LayoutFingerprint(vector, ink, rows, cols, width, height), bboxes)
+        return self
+
+
+def layout_agreement(reused: Dict, extracted: Dict) -> float:
+    """Mean IoU of the first box of every field present in both results (0 when none is)."""
+    from .box_ops import bbox_to_xyxy, box_iou, normalize_boxes
+
+    def _first(value: Any) -> Optional[Tuple[float, float, float, float]]:
+        if isinstance(value, list):
+            for item in value:
+                found = _first(item)
+                if found is not None:
+                    return found
+        elif isinstance(value, dict) and 'bbox' in value:
+            return bbox_to_xyxy(value['bbox'])
+        return None
+
+    pairs = [(_first(reused[field]), _first(extracted[field])) for field in reused if field in extracted]
+    pairs = [(a, b) for a, b in pairs if a is not None and b is not None]
+    if not pairs:
+        return 0.0
+    a, b = np.array(pairs, dtype=np.float64).transpose(1, 0, 2)
+    return float(box_iou(normalize_boxes(a), normalize_boxes(b)).mean())
@@ -0,0 +1,309 @@
+# © 2024 Amazon Web Services, Inc. or its affiliates. All Rights Reserved
+# This AWS Content is provided subject to the terms of the AWS Customer Agreement available at http://aws.amazon.com/agreement or other written agreement between Customer and either Amazon Web Services, Inc. or Amazon Web Services EMEA SARL or both.
+# License terms can be found at: https://aws.amazon.com/legal/aws-ip-license-terms/
+
+import base64
+import http.client
+import json
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+from urllib.parse import urlsplit
+
+from .rate_limiter import is_throttling_error
+
+
+class ModelBackend:
+    """
+    A model endpoint exposing the converse and converse_stream calls of bedrock-runtime.
+
+    Any backend, or a BackendPool of them, can be passed as ``client`` to BoundingBoxExtractor.
+    """
+
+    name = "backend"
+
+    def converse(self, **kwargs) -> Dict:
+        raise NotImplementedError
+
+    def converse_stream(self, **kwargs) -> Dict:
+        raise NotImplementedError
+
+
+class BedrockBackend(ModelBackend):
+    """
+    bedrock-runtime client for one region, created on first use.
+
+    Args:
+        region: AWS region of the endpoint
+        max_pool_connections: Size of the HTTP connection pool; keep it at least as large as the
+            number of concurrent requests sent to this region
+        model_ids: Optional mapping from requested model ids to the ids or inference profiles to
+            call in this region, e.g. {"us.amazon.nova-pro-v1:0": "eu.amazon.nova-pro-v1:0"}
+        profile_name: Optional AWS profile to create the session from
+        read_timeout: Socket read timeout in seconds
+        max_attempts: botocore retry attempts; keep it low when a BackendPool fails over instead
+    """
+
+    def __init__(self, region: str = "us-west-2", max_pool_connections: int = 50,
+                 model_ids: Optional[Dict[str, str]] = None, profile_name: Optional[str] = None,
+                 read_timeout: int = 500, max_attempts: int = 10):
+        self.region = region
+        self.name = f"bedrock:{region}"
+        self.max_pool_connections = max_pool_connections
+        self.model_ids = model_ids or {}
+        self.profile_name = profile_name
+        self.read_timeout = read_timeout
+        self.max_attempts = max_attempts
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self) -> Any:
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    import boto3
+                    from botocore.config import Config
+
+                    config = Config(
+                        region_name=self.region,
+                        signature_version='v4',
+                        read_timeout=self.read_timeout,
+                        max_pool_connections=self.max_pool_connections,
+                        retries={'max_attempts': self.max_attempts, 'mode': 'adaptive'}
+                    )
+                    self._client = boto3.Session(profile_name=self.profile_name).client("bedrock-runtime", config=config)
+        return self._client
+
+    def converse(self, **kwargs) -> Dict:
+        return self.client.converse(**self._map_model(kwargs))
+
+    def converse_stream(self, **kwargs) -> Dict:
+        return self.client.converse_stream(**self._map_model(kwargs))
+
+    def _map_model(self, kwargs: Dict) -> Dict:
+        model_id = kwargs.get("modelId")
+        if model_id in self.model_ids:
+            kwargs = dict(kwargs, modelId=self.model_ids[model_id])
+        return kwargs
+
+
+class HTTPModelError(Exception):
+    """Error returned by a local model server; ``response`` mirrors botocore's ClientError."""
+
+    def __init__(self, status: int, code: str, message: str):
+        super().__init__(f"{code} ({status}): {message}")
+        self.response = {"Error": {"Code": code, "Message": message}, "ResponseMetadata": {"HTTPStatusCode": status}}
+
+
+class HTTPBackend(ModelBackend):
+    """
+    Local stand-in model server speaking the converse request and response JSON over HTTP.
+
+    Requests are POSTed to ``{base_url}/model/{modelId}/converse`` (and ``/converse-stream``)
+    with image bytes base64 encoded, as in the Bedrock REST API. converse returns a converse
+    response object; converse-stream returns one event object per line. Error responses carry
+    {"code": ..., "message": ...}; status 429 and 503 are reported as throttling so a BackendPool
+    fails over. Connections are kept alive per thread, at most max_pool_connections at a time.
+
+    Args:
+        base_url: Server URL, e.g. "http://localhost:8080"
+        max_pool_connections: Maximum concurrent connections
+        timeout: Socket timeout in seconds
+    """
+
+    def __init__(self, base_url: str, max_pool_connections: int = 10, timeout: float = 300.0):
+        parts = urlsplit(base_url)
+        self.name = f"http:{parts.netloc}"
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port
+        self.path = parts.path.rstrip("/")
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pool_connections)
+        self._local = threading.local()
+
+    def converse(self, **kwargs) -> Dict:
+        with self._slots:
+            response = self._post(kwargs["modelId"], "converse", kwargs)
+            return json.loads(response.read())
+
+    def converse_stream(self, **kwargs) -> Dict:
+        self._slots.acquire()
+        try:
+            response = self._post(kwargs["modelId"], "converse-stream", kwargs)
+        except Exception:
+            self._slots.release()
+            raise
+        return {"stream": self._events(response)}
+
+    def _events(self, response: http.client.HTTPResponse) -> Iterator[Dict]:
+        try:
+            for line in response:
+                if line.strip():
+                    yield json.loads(line)
+        finally:
+            self._slots.release()
+
+    def _connection(self) -> http.client.HTTPConnection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            cls = http.client.HTTPSConnection if self.scheme == "https" else http.client.HTTPConnection
+            connection = self._local.connection = cls(self.host, self.port, timeout=self.timeout)
+        return connection
+
+    def _post(self, model_id: str, operation: str, request: Dict) -> http.client.HTTPResponse:
+        body = json.dumps({k: v for k, v in request.items() if k != "modelId"}, default=_encode_bytes).encode("utf-8")
+        path = f"{self.path}/model/{model_id}/{operation}"
+        for attempt in range(2):
+            connection = self._connection()
+            try:
+                connection.request("POST", path, body=body, headers={"Content-Type": "application/json"})
+                response = connection.getresponse()
+                break
+            except (http.client.HTTPException, ConnectionError):
+                # The server may have closed an idle keep-alive connection; reconnect once
+                connection.close()
+                self._local.connection = None
+                if attempt == 1:
+                    raise
+        if response.status >= 400:
+            try:
+                error = json.loads(response.read() or b"{}")
+            except ValueError:
+                error = {}
+            code = error.get("code") or ("ThrottlingException" if response.status in (429, 503) else "ModelError")
+            raise HTTPModelError(response.status, code, error.get("message", response.reason))
+        return response
+
+
+def _encode_bytes(value: Any) -> str:
+    if isinstance(value, (bytes, bytearray)):
+        return base64.b64encode(value).decode("ascii")
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def is_failover_error(error: Exception) -> bool:
+    """Check whether a request should be retried on another backend: throttling or a connection failure."""
+    if is_throttling_error(error) or isinstance(error, (ConnectionError, TimeoutError, http.client.HTTPException)):
+        return True
+    try:
+        from botocore.exceptions import ConnectionError as BotocoreConnectionError, ReadTimeoutError
+    except ImportError:
+        return False
+    return isinstance(error, (BotocoreConnectionError, ReadTimeoutError))
+
+
+class _BackendHealth:
+    def __init__(self):
+        self.in_flight = 0
+        self.latency = 1.0
+        self.failures = 0
+        self.cooldown_until = 0.0
+        self.requests = 0
+        self.errors = 0
+        self.failovers = 0
+
+
+class BackendPool(ModelBackend):
+    """
+    Spreads requests over several backends, e.g. regions or inference profiles, routing by health.
+
+    Each request goes to the available backend with the lowest expected wait, estimated as
+    (in-flight requests + 1) * moving average latency. A backend that throttles or cannot be
+    reached is put on an exponentially growing cooldown and the request fails over to the next
+    one; other errors are raised unchanged. When every backend fails, the last error is raised
+    so an outer RateLimiter can back off. For converse_stream only the initial call fails over.
+
+    Args:
+        backends: Backends to route between
+        cooldown: Cooldown in seconds after the first consecutive failure of a backend
+        max_cooldown: Upper bound of the cooldown
+        clock: Time source, replaceable for testing
+    """
+
+    name = "pool"
+
+    def __init__(self, backends: Sequence[Any], cooldown: float = 2.0, max_cooldown: float = 60.0,
+                 clock=time.monotonic):
+        if not backends:
+            raise ValueError("BackendPool needs at least one backend")
+        self.backends = list(backends)
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._health = [_BackendHealth() for _ in self.backends]
+
+    @classmethod
+    def for_regions(cls, regions: Sequence[str], max_pool_connections: int = 50, max_attempts: int = 2,
+                    **kwargs) -> "BackendPool":
+        """
+        Pool of BedrockBackends, one per region, each with its own connection pool.
+
+        Backends default to two botocore attempts instead of ten, so a throttled region fails over
+        quickly and the pool does the retrying on the other regions.
+        """
+        return cls([BedrockBackend(region, max_pool_connections=max_pool_connections, max_attempts=max_attempts, **kwargs)
+                    for region in regions])
+
+    def converse(self, **kwargs) -> Dict:
+        return self._call("converse", kwargs)
+
+    def converse_stream(self, **kwargs) -> Dict:
+        return self._call("converse_stream", kwargs)
+
+    def _order(self) -> List[int]:
+        """Backend indices by preference: available ones by expected wait, then cooling ones by cooldown end."""
+        now = self._clock()
+        with self._lock:
+            available = [i for i, h in enumerate(self._health) if h.cooldown_until <= now]
+            cooling = [i for i, h in enumerate(self._health) if h.cooldown_until > now]
+            available.sort(key=lambda i: (self._health[i].in_flight + 1) * self._health[i].latency)
+            cooling.sort(key=lambda i: self._health[i].cooldown_until)
+        return available + cooling
+
+    def _call(self, operation: str, kwargs: Dict) -> Dict:
+        last_error = None
+        for attempt, index in enumerate(self._order()):
+            health = self._health[index]
+            with self._lock:
+                health.in_flight += 1
+                health.requests += 1
+                health.failovers += attempt > 0
+            start = self._clock()
+            try:
+                response = getattr(self.backends[index], operation)(**kwargs)
+            except Exception as e:
+                with self._lock:
+                    health.in_flight -= 1
+                    health.errors += 1
+                    if is_failover_error(e):
+                        health.failures += 1
+                        health.cooldown_until = self._clock() + min(self.max_cooldown, self.cooldown * 2 ** (health.failures - 1))
+                if not is_failover_error(e):
+                    raise
+                last_error = e
+                continue
+            with self._lock:
+                health.in_flight -= 1
+                health.failures = 0
+                health.latency = 0.8 * health.latency + 0.2 * (self._clock() - start)
+            return response
+        raise last_error
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Return routing and health counters per backend."""
+        now = self._clock()
+        with self._lock:
+            return {
+                getattr(backend, "name", str(index)): {
+                    "in_flight": h.in_flight,
+                    "requests": h.requests,
+                    "errors": h.errors,
+                    "failovers": h.failovers,
+                    "latency_seconds": h.latency,
+                    "cooling_down_seconds": max(0.0, h.cooldown_until - now),
+                }
+                for index, (backend, h) in enumerate(zip(self.backends, self._health))
+            }
@@ -0,0 +1,90 @@
+# © 2024 Amazon Web Services, Inc. or its affiliates. All Rights Reserved
+# This AWS Content is provided subject to the terms of the AWS Customer Agreement available at http://aws.amazon.com/agreement or other written agreement between Customer and either Amazon Web Services, Inc. or Amazon Web Services EMEA SARL or both.
+# License terms can be found at: https://aws.amazon.com/legal/aws-ip-license-terms/
+
+import os
+import string
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+# (literal text, field name, format spec, conversion) as produced by string.Formatter.parse
+_Segment = Tuple[str, Optional[str], Optional[str], Optional[str]]
+
+
+class PromptTemplate:
+    """
+    Compiled system prompt template shared across threads.
+
+    The template file is read and parsed once, the schema dependent arguments ("elements" and
+    "schema") are rendered once, and full prompts are memoised per (width, height). The file is
+    re-read when its modification time changes, checked at most every ``check_interval`` seconds.
+
+    Templates use ``str.format`` fields: "w", "h", "elements" and "schema".
+    """
+
+    def __init__(self, path: str, field_config: Dict, check_interval: float = 5.0, max_cached: int = 128):
+        self.path = path
+        self.field_config = field_config
+        self.check_interval = check_interval
+        self.max_cached = max_cached
+        self._lock = threading.Lock()
+        self._rendered: "OrderedDict[Tuple[int, int], str]" = OrderedDict()
+        self._static_args = {
+            "elements": ", ".join(field_config.keys()),
+            "schema": str(field_config),
+        }
+        self._load()
+
+    def _load(self) -> None:
+        with open(self.path, "r") as file:
+            text = file.read()
+        self._mtime = os.stat(self.path).st_mtime_ns
+        self._last_check = time.monotonic()
+        self._segments: List[_Segment] = list(string.Formatter().parse(text))
+        self._rendered.clear()
+
+    def _reload_if_changed(self) -> None:
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval:
+            return
+        self._last_check = now
+        try:
+            changed = os.stat(self.path).st_mtime_ns != self._mtime
+        except OSError:
+            # Keep serving the compiled template if the file is briefly missing during a deploy
+            return
+        if changed:
+            self._load()
+
+    def render(self, width: int, height: int) -> str:
+        """Return the prompt for an image of the given dimensions."""
+        key = (width, height)
+        with self._lock:
+            self._reload_if_changed()
+            prompt = self._rendered.get(key)
+            if prompt is not None:
+                self._rendered.move_to_end(key)
+                return prompt
+            segments = self._segments
+
+        prompt = self._format(segments, dict(self._static_args, w=width, h=height))
+        with self._lock:
+            if segments is self._segments:
+                self._rendered[key] = prompt
+                if len(self._rendered) > self.max_cached:
+                    self._rendered.popitem(last=False)
+        return prompt
+
+    @staticmethod
+    def _format(segments: List[_Segment], args: Dict[str, Any]) -> str:
+        formatter = string.Formatter()
+        parts = []
+        for literal, field, spec, conversion in segments:
+            parts.append(literal)
+            if field is not None:
+                value, _ = formatter.get_field(field, (), args)
+                value = formatter.convert_field(value, conversion)
+                parts.append(formatter.format_field(value, spec or ""))
+        return "".join(parts)
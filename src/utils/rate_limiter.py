@@ -0,0 +1,206 @@
+# © 2024 Amazon Web Services, Inc. or its affiliates. All Rights Reserved
+# This AWS Content is provided subject to the terms of the AWS Customer Agreement available at http://aws.amazon.com/agreement or other written agreement between Customer and either Amazon Web Services, Inc. or Amazon Web Services EMEA SARL or both.
+# License terms can be found at: https://aws.amazon.com/legal/aws-ip-license-terms/
+
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, NamedTuple, Optional
+
+THROTTLING_ERROR_CODES = {
+    "ThrottlingException",
+    "TooManyRequestsException",
+    "ServiceUnavailableException",
+    "ModelNotReadyException",
+}
+
+
+def is_throttling_error(error: Exception) -> bool:
+    """Check whether an exception is a Bedrock throttling error (botocore ClientError or a look-alike)."""
+    response = getattr(error, "response", None)
+    if not isinstance(response, dict):
+        return False
+    return response.get("Error", {}).get("Code") in THROTTLING_ERROR_CODES
+
+
+class ModelBudget(NamedTuple):
+    requests_per_minute: Optional[float] = None
+    tokens_per_minute: Optional[float] = None
+
+
+class _ModelState:
+    """Token buckets and counters for a single model_id."""
+
+    def __init__(self, budget: ModelBudget, estimated_tokens: int, now: float):
+        self.budget = budget
+        self.request_tokens = budget.requests_per_minute or 0.0
+        self.token_tokens = budget.tokens_per_minute or 0.0
+        self.last_refill = now
+        self.blocked_until = 0.0
+        self.estimated_tokens = float(estimated_tokens)
+        self.waiting = 0
+        self.requests = 0
+        self.tokens = 0
+        self.throttles = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def refill(self, now: float) -> None:
+        elapsed = now - self.last_refill
+        self.last_refill = now
+        if self.budget.requests_per_minute:
+            self.request_tokens = min(self.budget.requests_per_minute,
+                                      self.request_tokens + elapsed * self.budget.requests_per_minute / 60)
+        if self.budget.tokens_per_minute:
+            self.token_tokens = min(self.budget.tokens_per_minute,
+                                    self.token_tokens + elapsed * self.budget.tokens_per_minute / 60)
+
+    def time_until_available(self, tokens: float, now: float) -> float:
+        wait = max(0.0, self.blocked_until - now)
+        if self.budget.requests_per_minute and self.request_tokens < 1:
+            wait = max(wait, (1 - self.request_tokens) * 60 / self.budget.requests_per_minute)
+        if self.budget.tokens_per_minute:
+            # A single request larger than the whole budget only waits for a full bucket
+            needed = min(tokens, self.budget.tokens_per_minute)
+            if self.token_tokens < needed:
+                wait = max(wait, (needed - self.token_tokens) * 60 / self.budget.tokens_per_minute)
+        return wait
+
+
+class RateLimiter:
+    """
+    Client-side scheduler enforcing per-model request and token budgets.
+
+    Requests reserve one request and an estimated number of tokens before the call; the estimate
+    is reconciled with the ``usage`` block of the response afterwards. Throttling errors pause
+    every caller of the same model and are retried with full-jitter exponential backoff.
+
+    The limiter does the retrying, so the client it calls should not retry throttling itself;
+    the converse helpers use a single-attempt default client when given a rate limiter, and a
+    BedrockBackend passed explicitly should be built with max_attempts=1.
+    """
+
+    def __init__(self, budgets: Optional[Dict[str, ModelBudget]] = None, default_budget: ModelBudget = ModelBudget(),
+                 max_retries: int = 8, base_backoff: float = 1.0, max_backoff: float = 60.0,
+                 estimated_tokens: int = 4000, clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep):
+        self.budgets = budgets or {}
+        self.default_budget = default_budget
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.initial_estimate = estimated_tokens
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._states: Dict[str, _ModelState] = {}
+
+    def _state(self, model_id: str) -> _ModelState:
+        state = self._states.get(model_id)
+        if state is None:
+            budget = self.budgets.get(model_id, self.default_budget)
+            state = self._states[model_id] = _ModelState(budget, self.initial_estimate, self._clock())
+        return state
+
+    def acquire(self, model_id: str, estimated_tokens: Optional[float] = None) -> float:
+        """
+        Block until the model's budget admits one more request.
+
+        Returns:
+            Time in seconds spent queueing
+        """
+        start = self._clock()
+        with self._lock:
+            state = self._state(model_id)
+            tokens = state.estimated_tokens if estimated_tokens is None else estimated_tokens
+            state.waiting += 1
+        try:
+            while True:
+                with self._lock:
+                    now = self._clock()
+                    state.refill(now)
+                    wait = state.time_until_available(tokens, now)
+                    if wait <= 0:
+                        if state.budget.requests_per_minute:
+                            state.request_tokens -= 1
+                        if state.budget.tokens_per_minute:
+                            state.token_tokens -= tokens
+                        waited = now - start
+                        state.total_wait += waited
+                        state.max_wait = max(state.max_wait, waited)
+                        return waited
+                self._sleep(wait)
+        finally:
+            with self._lock:
+                state.waiting -= 1
+
+    def record_usage(self, model_id: str, reserved_tokens: float, usage: Optional[Dict]) -> None:
+        """Reconcile a reservation with the token usage reported by the model."""
+        with self._lock:
+            state = self._state(model_id)
+            state.requests += 1
+            if not usage:
+                return
+            used = usage.get("totalTokens", usage.get("inputTokens", 0) + usage.get("outputTokens", 0))
+            state.tokens += used
+            if state.budget.tokens_per_minute:
+                state.token_tokens -= used - reserved_tokens
+            # Exponential moving average keeps the next reservation close to real usage
+            state.estimated_tokens = 0.8 * state.estimated_tokens + 0.2 * used
+
+    def record_throttle(self, model_id: str, attempt: int) -> float:
+        """Register a throttling error and pause the model; returns the jittered backoff in seconds."""
+        backoff = random.uniform(0, min(self.max_backoff, self.base_backoff * 2 ** attempt))
+        with self._lock:
+            state = self._state(model_id)
+            state.throttles += 1
+            state.blocked_until = max(state.blocked_until, self._clock() + backoff)
+        return backoff
+
+    def estimate(self, model_id: str) -> float:
+        """Current token reservation per request for model_id."""
+        with self._lock:
+            return self._state(model_id).estimated_tokens
+
+    def call(self, model_id: str, fn: Callable[[], Dict], estimated_tokens: Optional[float] = None,
+             record: bool = True) -> Any:
+        """
+        Run a model call under the budget, retrying throttled attempts with backoff.
+
+        Pass record=False for streaming calls whose usage only arrives at the end of the stream;
+        the caller then reports it with record_usage.
+        """
+        for attempt in range(self.max_retries + 1):
+            reserved = self.estimate(model_id) if estimated_tokens is None else estimated_tokens
+            self.acquire(model_id, reserved)
+            try:
+                response = fn()
+            except Exception as e:
+                with self._lock:
+                    # Give back the tokens of the failed request, whatever the error
+                    state = self._state(model_id)
+                    if state.budget.tokens_per_minute:
+                        state.token_tokens += reserved
+                if not is_throttling_error(e) or attempt == self.max_retries:
+                    raise
+                self.record_throttle(model_id, attempt)
+                continue
+            if record:
+                self.record_usage(model_id, reserved, response.get("usage") if isinstance(response, dict) else None)
+            return response
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Return queue depth, wait time and usage counters per model_id."""
+        with self._lock:
+            return {
+                model_id: {
+                    "queue_depth": state.waiting,
+                    "requests": state.requests,
+                    "tokens": state.tokens,
+                    "throttles": state.throttles,
+                    "total_wait_seconds": state.total_wait,
+                    "max_wait_seconds": state.max_wait,
+                    "estimated_tokens_per_request": state.estimated_tokens,
+                }
+                for model_id, state in self._states.items()
+            }
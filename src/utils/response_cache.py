@@ -0,0 +1,171 @@
+# © 2024 Amazon Web Services, Inc. or its affiliates. All Rights Reserved
+# This AWS Content is provided subject to the terms of the AWS Customer Agreement available at http://aws.amazon.com/agreement or other written agreement between Customer and either Amazon Web Services, Inc. or Amazon Web Services EMEA SARL or both.
+# License terms can be found at: https://aws.amazon.com/legal/aws-ip-license-terms/
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+# Only these keys of a converse response are worth replaying; ResponseMetadata is request specific
+CACHED_RESPONSE_KEYS = ("output", "stopReason", "usage", "metrics")
+
+
+def make_cache_key(model_id: str, messages: List[Dict], system: List[Dict], inference_config: Dict) -> str:
+    """
+    Build a content-addressed key for a converse request.
+
+    Image bytes are hashed in place so the key covers the exact document content, the rendered
+    system prompt, the model and the inference configuration.
+
+    Returns:
+        Hex SHA-256 digest
+    """
+    def _canonical(value: Any) -> Any:
+        if isinstance(value, (bytes, bytearray)):
+            return {"sha256": hashlib.sha256(value).hexdigest()}
+        if isinstance(value, dict):
+            return {k: _canonical(v) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [_canonical(v) for v in value]
+        return value
+
+    payload = {
+        "model_id": model_id,
+        "messages": _canonical(messages),
+        "system": _canonical(system),
+        "inference_config": inference_config,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _serialize_response(response: Dict) -> bytes:
+    return json.dumps({k: response[k] for k in CACHED_RESPONSE_KEYS if k in response}, default=str).encode("utf-8")
+
+
+class ResponseCache:
+    """Base class for converse response caches with hit/miss counters."""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict]:
+        """Return the cached response for key, or None."""
+        with self._lock:
+            value = self._get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(value)
+
+    def put(self, key: str, response: Dict) -> None:
+        """Store a converse response under key."""
+        value = _serialize_response(response)
+        with self._lock:
+            self._put(key, value)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters and current size."""
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hit_rate, "size_bytes": self.size_bytes}
+
+    @property
+    def size_bytes(self) -> int:
+        raise NotImplementedError
+
+    def _get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def _put(self, key: str, value: bytes) -> None:
+        raise NotImplementedError
+
+
+class LRUResponseCache(ResponseCache):
+    """In-memory LRU cache bounded by the total size of the stored responses."""
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024):
+        super().__init__()
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._size = 0
+
+    @property
+    def size_bytes(self) -> int:
+        return self._size
+
+    def _get(self, key: str) -> Optional[bytes]:
+        value = self._entries.get(key)
+        if value is not None:
+            self._entries.move_to_end(key)
+        return value
+
+    def _put(self, key: str, value: bytes) -> None:
+        if len(value) > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._size -= len(old)
+        self._entries[key] = value
+        self._size += len(value)
+        while self._size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+
+
+class SQLiteResponseCache(ResponseCache):
+    """On-disk cache in a single SQLite file, evicting least recently used entries above max_bytes."""
+
+    def __init__(self, path: str, max_bytes: int = 4 * 1024 * 1024 * 1024):
+        super().__init__()
+        self.path = path
+        self.max_bytes = max_bytes
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses "
+            "(key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        self._conn.commit()
+        self._size = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    @property
+    def size_bytes(self) -> int:
+        return self._size
+
+    def _get(self, key: str) -> Optional[bytes]:
+        row = self._conn.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+        self._conn.commit()
+        return row[0]
+
+    def _put(self, key: str, value: bytes) -> None:
+        if len(value) > self.max_bytes:
+            return
+        row = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            self._size -= row[0]
+        self._conn.execute(
+            "INSERT OR REPLACE INTO responses (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+            (key, value, len(value), time.time())
+        )
+        self._size += len(value)
+        while self._size > self.max_bytes:
+            oldest = self._conn.execute("SELECT key, size FROM responses ORDER BY last_access LIMIT 1").fetchone()
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (oldest[0],))
+            self._size -= oldest[1]
+        self._conn.commit()
+
+    def close(self) -> None:
+        self._conn.close()
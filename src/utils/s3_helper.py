@@ -2,24 +2,74 @@
 # This AWS Content is provided subject to the terms of the AWS Customer Agreement available at http://aws.amazon.com/agreement or other written agreement between Customer and either Amazon Web Services, Inc. or Amazon Web Services EMEA SARL or both.
 # License terms can be found at: https://aws.amazon.com/legal/aws-ip-license-terms/
 
-import boto3
 import json
-from typing import Dict, Any
+import threading
+from typing import Dict, Any, Iterator, Optional
 
-boto3.setup_default_session(profile_name='early_access', region_name='us-west-2')
+_S3_SETTINGS: Dict[str, Any] = {"profile_name": None, "region_name": "us-west-2", "max_pool_connections": 50, "endpoint_url": None}
+_s3_client = None
+_s3_lock = threading.Lock()
 
-S3_CLIENT = boto3.client('s3')
+
+def configure_s3_client(client: Any = None, profile_name: Optional[str] = None, region_name: str = "us-west-2",
+                        max_pool_connections: int = 50, endpoint_url: Optional[str] = None) -> None:
+    """
+    Set the S3 client used by this module.
+
+    Args:
+        client: Ready-made client (e.g. a moto or stubbed client); built on first use when None
+        profile_name: AWS profile for the client built on first use; None uses the default
+            credential chain (AWS_PROFILE, environment, instance role)
+        region_name: Region for the client built on first use
+        max_pool_connections: HTTP connection pool size, shared by all threads using the client
+        endpoint_url: Alternative endpoint, e.g. a local S3 stand-in such as a moto server
+    """
+    global _s3_client
+    with _s3_lock:
+        _S3_SETTINGS.update(profile_name=profile_name, region_name=region_name,
+                            max_pool_connections=max_pool_connections, endpoint_url=endpoint_url)
+        _s3_client = client
+
+
+def get_s3_client() -> Any:
+    """Return the shared S3 client, creating it on first use."""
+    global _s3_client
+    if _s3_client is None:
+        with _s3_lock:
+            if _s3_client is None:
+                import boto3
+                from botocore.config import Config
+
+                session = boto3.Session(profile_name=_S3_SETTINGS["profile_name"], region_name=_S3_SETTINGS["region_name"])
+                config = Config(max_pool_connections=_S3_SETTINGS["max_pool_connections"])
+                _s3_client = session.client('s3', config=config, endpoint_url=_S3_SETTINGS["endpoint_url"])
+    return _s3_client
+
+
+def __getattr__(name: str) -> Any:
+    # S3_CLIENT used to be created at import time; keep it available without the side effect
+    if name == "S3_CLIENT":
+        return get_s3_client()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def get_s3_json(bucket: str, key: str) -> Dict[str, Any]:
     """Retrieve and parse JSON object from S3."""
-    response = S3_CLIENT.get_object(Bucket=bucket, Key=key)
+    response = get_s3_client().get_object(Bucket=bucket, Key=key)
     content = response['Body'].read().decode('utf-8')
     return json.loads(content)
 
 
 def get_s3_image(bucket: str, key: str) -> bytes:
     """Retrieve image bytes from S3."""
-    response = S3_CLIENT.get_object(Bucket=bucket, Key=key)
+    response = get_s3_client().get_object(Bucket=bucket, Key=key)
     image_bytes = response['Body'].read()
     return image_bytes
+
+
+def list_s3_keys(bucket: str, prefix: str = "") -> Iterator[str]:
+    """Lazily list object keys under a prefix, one page at a time."""
+    paginator = get_s3_client().get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            yield obj['Key']
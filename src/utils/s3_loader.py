@@ -0,0 +1,195 @@
+# © 2024 Amazon Web Services, Inc. or its affiliates. All Rights Reserved
+# This AWS Content is provided subject to the terms of the AWS Customer Agreement available at http://aws.amazon.com/agreement or other written agreement between Customer and either Amazon Web Services, Inc. or Amazon Web Services EMEA SARL or both.
+# License terms can be found at: https://aws.amazon.com/legal/aws-ip-license-terms/
+
+import hashlib
+import os
+import re
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple, TypeVar
+
+from .s3_helper import get_s3_client
+
+T = TypeVar("T")
+
+
+class S3Pair(NamedTuple):
+    stem: str
+    image_key: str
+    truth_key: Optional[str]
+
+
+class S3BulkLoader:
+    """
+    Concurrent S3 reader with an on-disk cache keyed by ETag.
+
+    ``prefetch`` keeps up to ``lookahead`` downloads running on a bounded thread pool that shares
+    one connection-pooled client, so images arrive while earlier documents are still with the
+    model. Objects whose size is known from the listing (or a HEAD request when caching) are
+    fetched as concurrent byte ranges from ``range_threshold`` up. With ``cache_dir`` every object
+    is stored under its bucket, key and ETag; a repeat run only asks S3 for the ETag (free when it
+    came from ``list_pairs``) and skips the download when it matches.
+
+    The client comes from ``s3_helper.get_s3_client`` unless one is passed, so a moto mock or a
+    local S3 endpoint (``configure_s3_client(endpoint_url=...)``) works unchanged.
+
+    Args:
+        client: S3 client; defaults to the shared s3_helper client
+        max_workers: Concurrent object downloads
+        cache_dir: Directory for the local cache; None disables it
+        range_threshold: Objects at least this large (bytes) are downloaded in ranges
+        part_size: Size of each range in bytes
+        range_workers: Concurrent ranges per large object
+    """
+
+    def __init__(self, client: Any = None, max_workers: int = 16, cache_dir: Optional[str] = None,
+                 range_threshold: int = 16 * 1024 * 1024, part_size: int = 8 * 1024 * 1024, range_workers: int = 4):
+        self._client = client
+        self.max_workers = max_workers
+        self.cache_dir = cache_dir
+        self.range_threshold = range_threshold
+        self.part_size = part_size
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._range_executor = ThreadPoolExecutor(max_workers=range_workers)
+        self._lock = threading.Lock()
+        # (bucket, key) -> (etag, size) learned from listings, so cached objects need no HEAD request
+        self._object_info: Dict[Tuple[str, str], Tuple[str, int]] = {}
+        self.cache_hits = 0
+        self.downloads = 0
+        self.bytes_downloaded = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @property
+    def client(self) -> Any:
+        return self._client if self._client is not None else get_s3_client()
+
+    def list_pairs(self, bucket: str, prefix: str, image_extensions: Sequence[str]) -> Iterator[S3Pair]:
+        """
+        List a prefix and pair every image with the ``.json`` ground truth of the same stem.
+
+        Keys are listed in lexicographic order, so all files of a stem fall between the key
+        ``stem`` and the last key starting with ``stem.``; other stems sharing that prefix, like
+        ``inv.notes.png`` between ``inv.json`` and ``inv.png``, can sort in between. Open stems
+        are kept on a stack (their key ranges nest) and each is paired and yielded as soon as the
+        listing moves past its range, so pairs still arrive with the listing pages.
+        """
+        # (stem, extension -> key) of the stems whose key range the listing is still inside
+        open_groups: List[Tuple[str, Dict[str, str]]] = []
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            for obj in page.get('Contents', []):
+                key = obj['Key']
+                with self._lock:
+                    self._object_info[(bucket, key)] = (obj['ETag'], obj['Size'])
+                stem, ext = os.path.splitext(key)
+                while open_groups and open_groups[-1][0] != stem and not key.startswith(open_groups[-1][0] + "."):
+                    yield from self._pairs(*open_groups.pop(), image_extensions)
+                if not open_groups or open_groups[-1][0] != stem:
+                    open_groups.append((stem, {}))
+                open_groups[-1][1][ext.lower()] = key
+        while open_groups:
+            yield from self._pairs(*open_groups.pop(), image_extensions)
+
+    @staticmethod
+    def _pairs(stem: str, group: Dict[str, str], image_extensions: Sequence[str]) -> Iterator[S3Pair]:
+        for ext, key in group.items():
+            if ext in image_extensions:
+                yield S3Pair(stem, key, group.get(".json"))
+
+    def load(self, ref: str) -> bytes:
+        """Read an ``s3://bucket/key`` URI through the cache, or a local path from disk."""
+        if not ref.startswith("s3://"):
+            with open(ref, "rb") as f:
+                return f.read()
+        bucket, _, key = ref[len("s3://"):].partition("/")
+        return self.fetch(bucket, key)
+
+    def fetch(self, bucket: str, key: str) -> bytes:
+        """Return the object's bytes from the local cache or S3."""
+        with self._lock:
+            info = self._object_info.get((bucket, key))
+        if info is None and self.cache_dir:
+            # The cache is keyed by ETag, which is cheaper to ask for than the object
+            head = self.client.head_object(Bucket=bucket, Key=key)
+            info = (head['ETag'], head['ContentLength'])
+        etag, size = info if info is not None else (None, None)
+
+        cache_path = self._cache_path(bucket, key, etag) if self.cache_dir and etag else None
+        if cache_path is not None and os.path.exists(cache_path):
+            with open(cache_path, "rb") as f:
+                data = f.read()
+            with self._lock:
+                self.cache_hits += 1
+            return data
+
+        if size is not None and size >= self.range_threshold:
+            data = self._fetch_ranges(bucket, key, etag, size)
+        else:
+            data = self.client.get_object(Bucket=bucket, Key=key)['Body'].read()
+        with self._lock:
+            self.downloads += 1
+            self.bytes_downloaded += len(data)
+        if cache_path is not None:
+            self._store(cache_path, data)
+        return data
+
+    def _fetch_ranges(self, bucket: str, key: str, etag: Optional[str], size: int) -> bytes:
+        def _get(start: int) -> bytes:
+            kwargs = {"Bucket": bucket, "Key": key, "Range": f"bytes={start}-{min(start + self.part_size, size) - 1}"}
+            if etag:
+                # Fail instead of stitching together ranges of two versions of the object
+                kwargs["IfMatch"] = etag
+            return self.client.get_object(**kwargs)['Body'].read()
+
+        return b"".join(self._range_executor.map(_get, range(0, size, self.part_size)))
+
+    def _cache_path(self, bucket: str, key: str, etag: str) -> str:
+        name = hashlib.sha256(f"{bucket}/{key}".encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, name[:2], f"{name}-{re.sub(r'[^0-9A-Za-z-]', '', etag)}")
+
+    def _store(self, cache_path: str, data: bytes) -> None:
+        directory, name = os.path.split(cache_path)
+        os.makedirs(directory, exist_ok=True)
+        object_hash = name[:64]
+        for stale in os.listdir(directory):
+            # Drop versions of the object cached under an older ETag
+            if stale.startswith(object_hash + "-") and stale != name and not stale.endswith(".tmp"):
+                try:
+                    os.remove(os.path.join(directory, stale))
+                except OSError:
+                    pass
+        tmp_path = f"{cache_path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, cache_path)
+
+    def prefetch(self, items: Iterable[T], ref: Callable[[T], str], lookahead: Optional[int] = None) -> Iterator[Tuple[T, bytes]]:
+        """
+        Yield (item, bytes) in input order while up to lookahead loads run in the background.
+
+        Args:
+            items: Items to load, consumed lazily
+            ref: Returns the ``s3://`` URI or local path of an item
+            lookahead: Maximum loads in flight (and results buffered); defaults to max_workers
+        """
+        lookahead = lookahead or self.max_workers
+        pending = deque()
+        for item in items:
+            pending.append((item, self._executor.submit(self.load, ref(item))))
+            if len(pending) >= lookahead:
+                done_item, future = pending.popleft()
+                yield done_item, future.result()
+        while pending:
+            done_item, future = pending.popleft()
+            yield done_item, future.result()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"cache_hits": self.cache_hits, "downloads": self.downloads, "bytes_downloaded": self.bytes_downloaded}
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._range_executor.shutdown(wait=False, cancel_futures=True)
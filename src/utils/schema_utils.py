@@ -19,10 +19,15 @@ def get_structure(obj: Any) -> Any:
 
 
 def split_schema(schema: Dict, num_parts: int) -> List[Dict]:
-    """Split schema into multiple parts for processing."""
-    if num_parts == 1:
+    """Split schema into at most num_parts parts of near-equal size, preserving field order."""
+    if num_parts <= 1 or len(schema) <= 1:
         return [schema]
-    else:
-        part_size = len(schema) // num_parts
-        parts = [dict(list(schema.items())[i:i+part_size]) for i in range(0, len(schema), part_size)]
-        return parts
\ No newline at end of file
+    num_parts = min(num_parts, len(schema))
+    items = list(schema.items())
+    part_size, remainder = divmod(len(items), num_parts)
+    parts, start = [], 0
+    for i in range(num_parts):
+        end = start + part_size + (1 if i < remainder else 0)
+        parts.append(dict(items[start:end]))
+        start = end
+    return parts
\ No newline at end of file